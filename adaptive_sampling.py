@@ -0,0 +1,188 @@
+"""
+Sequential confidence intervals that decide when a simulation has sampled enough chunks.
+
+A run monitors quantities of three kinds, named the way the web UI names them:
+
+    target     "Pig"         fraction of chunks that match the pig genome, whatever else they match
+    category   "Human-Pig"   fraction of chunks whose match mask is exactly {pig}
+    ratio      "Pig/Bonobo"  ratio of two target fractions
+
+Proportions get Wilson score intervals and ratios a delta-method interval on the log scale. Intervals are recomputed
+after every batch, so under this optional stopping their coverage is only approximate; `PrecisionGoal.min_samples`
+keeps a run from stopping on its first few, very noisy batches.
+
+Target and ratio quantities only need the targets they name, so once they are precise enough their targets are dropped
+from later batches and the remaining samples go to the comparisons that are still uncertain. Category quantities need
+every target.
+"""
+
+import math
+from collections.abc import Sequence
+from dataclasses import dataclass
+from statistics import NormalDist
+
+import numpy as np
+import numpy.typing as npt
+
+
+@dataclass(frozen=True)
+class PrecisionGoal:
+    """Stop once every monitored interval is at most `half_width` wide on each side, or within `relative_precision`
+    of its estimate; zero disables a criterion, and with both disabled a run takes all of its samples."""
+
+    half_width: float = 0.0
+    relative_precision: float = 0.0
+    confidence: float = 0.95
+    min_samples: int = 1_000
+
+    @property
+    def enabled(self) -> bool:
+        return self.half_width > 0 or self.relative_precision > 0
+
+    @property
+    def z(self) -> float:
+        return NormalDist().inv_cdf((1 + self.confidence) / 2)
+
+    def is_met(self, estimate: float, low: float, high: float) -> bool:
+        half_width = (high - low) / 2
+        if not math.isfinite(half_width):
+            return False
+        if self.half_width > 0 and not half_width <= self.half_width:
+            return False
+        if self.relative_precision > 0 and not half_width <= self.relative_precision * estimate:
+            return False
+        return self.enabled
+
+
+@dataclass(frozen=True)
+class Interval:
+    name: str
+    estimate: float
+    low: float
+    high: float
+    samples: int
+    converged: bool
+
+    def to_dict(self) -> dict[str, str | float | int | bool | None]:
+        """Fields as JSON values; unbounded ends become None, since JSON has no infinity."""
+        return {
+            name: value if not isinstance(value, float) or math.isfinite(value) else None
+            for name, value in self.__dict__.items()
+        }
+
+
+def wilson_interval(hits: int, samples: int, z: float) -> tuple[float, float]:
+    """Wilson score interval of a binomial proportion."""
+    if samples == 0:
+        return 0.0, 1.0
+    p = hits / samples
+    denominator = 1 + z**2 / samples
+    centre = (p + z**2 / (2 * samples)) / denominator
+    spread = z * math.sqrt(p * (1 - p) / samples + z**2 / (4 * samples**2)) / denominator
+    return max(0.0, centre - spread), min(1.0, centre + spread)
+
+
+def ratio_interval(hits_a: int, hits_b: int, hits_both: int, z: float) -> tuple[float, float, float]:
+    """Estimate and delta-method interval of `p_a / p_b` from hit counts on the same chunks."""
+    if hits_a == 0 or hits_b == 0:
+        return (0.0 if hits_a == 0 else math.inf), 0.0, math.inf
+    ratio = hits_a / hits_b
+    # Var(log p_a - log p_b), including the covariance of two proportions estimated on the same chunks
+    variance = 1 / hits_a + 1 / hits_b - 2 * hits_both / (hits_a * hits_b)
+    spread = z * math.sqrt(max(variance, 0.0))
+    return ratio, ratio * math.exp(-spread), ratio * math.exp(spread)
+
+
+class SamplingTracker:
+    """Per-target and pairwise match counts over batches that may each compare against only some of the targets."""
+
+    def __init__(
+        self,
+        target_names: Sequence[str],
+        categories: Sequence[str],
+        goal: PrecisionGoal,
+        monitor: Sequence[str] = (),
+    ):
+        self.target_names = tuple(target_names)
+        self.categories = tuple(categories)
+        self.goal = goal
+        self.samples = 0
+        num_targets = len(target_names)
+        self.all_targets = 2**num_targets - 1
+        # Row `mask` holds the bits of that match mask, one column per target
+        self._bits = (np.arange(2**num_targets)[:, None] >> np.arange(num_targets)) & 1
+        # [a, b]: chunks compared against both a and b; those of them that matched a; those that matched a and b
+        self.pair_samples = np.zeros((num_targets, num_targets), dtype=np.int64)
+        self.pair_hits = np.zeros((num_targets, num_targets), dtype=np.int64)
+        self.co_hits = np.zeros((num_targets, num_targets), dtype=np.int64)
+        self.quantities = [self._parse(name) for name in (monitor or target_names)]
+
+    def _parse(self, name: str) -> tuple[str, str, int, int]:
+        """Resolve a monitored quantity to (kind, name, first operand, second operand)."""
+        if "/" in name:
+            a, b = (self._target(operand.strip()) for operand in name.split("/", 1))
+            return "ratio", name, a, b
+        if name in self.target_names:
+            return "target", name, self._target(name), 0
+        if name in self.categories:
+            return "category", name, self.categories.index(name), 0
+        raise ValueError(f"Unknown quantity {name!r}: expected a target, a category or a ratio of targets")
+
+    def _target(self, name: str) -> int:
+        if name not in self.target_names:
+            raise ValueError(f"Unknown target genome {name!r}, expected one of {self.target_names}")
+        return self.target_names.index(name)
+
+    def add(self, counts: npt.NDArray[np.int64], active_targets: int) -> None:
+        """Record a batch's per-mask chunk counts; bits outside `active_targets` were not compared."""
+        active = (active_targets >> np.arange(len(self.target_names))) & 1
+        hits = counts @ self._bits
+        self.pair_samples += int(counts.sum()) * np.outer(active, active)
+        self.pair_hits += np.outer(hits, active)
+        self.co_hits += self._bits.T @ (counts[:, None] * self._bits)
+        self.samples += int(counts.sum())
+
+    @property
+    def target_samples(self) -> npt.NDArray[np.int64]:
+        """Chunks compared against each target so far."""
+        return self.pair_samples.diagonal().copy()
+
+    def intervals(self, full_counts: npt.NDArray[np.int64]) -> list[Interval]:
+        """Current interval of every monitored quantity; `full_counts` are the chunks compared against every target."""
+        z = self.goal.z
+        intervals = []
+        for kind, name, a, b in self.quantities:
+            if kind == "ratio":
+                samples = int(self.pair_samples[a, b])
+                estimate, low, high = ratio_interval(
+                    int(self.pair_hits[a, b]), int(self.pair_hits[b, a]), int(self.co_hits[a, b]), z
+                )
+            else:
+                hits, samples = (
+                    (int(self.pair_hits[a, a]), int(self.pair_samples[a, a]))
+                    if kind == "target"
+                    else (int(full_counts[a]), int(full_counts.sum()))
+                )
+                estimate = hits / samples if samples else 0.0
+                low, high = wilson_interval(hits, samples, z)
+            intervals.append(Interval(name, estimate, low, high, samples, self.goal.is_met(estimate, low, high)))
+        return intervals
+
+    def active_targets(self, intervals: list[Interval]) -> int:
+        """Targets that the next batch still has to compare against, as a bitmask."""
+        if not self.goal.enabled or self.samples < self.goal.min_samples:
+            return self.all_targets
+        active = 0
+        for (kind, _, a, b), interval in zip(self.quantities, intervals):
+            if interval.converged:
+                continue
+            if kind == "category":
+                active |= self.all_targets
+            elif kind == "ratio":
+                active |= (1 << a) | (1 << b)
+            else:
+                active |= 1 << a
+        return active
+
+    def converged(self, intervals: list[Interval]) -> bool:
+        return self.goal.enabled and self.samples >= self.goal.min_samples and all(i.converged for i in intervals)
@@ -1,57 +1,108 @@
+import atexit
 import json
 import multiprocessing as mp
 import os
 import random
 import signal
-from collections.abc import Callable
-from concurrent.futures import ProcessPoolExecutor, as_completed
+import threading
+import uuid
+from collections.abc import Callable, Sequence
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, ProcessPoolExecutor, wait
 from dataclasses import dataclass, field
-from itertools import repeat
+from functools import cached_property
+from itertools import repeat, zip_longest
 from multiprocessing import shared_memory
+from multiprocessing.queues import SimpleQueue
 from pathlib import Path
-from typing import Any
+from time import perf_counter
+from typing import TYPE_CHECKING, Any
 
 import numpy as np
-import plotly.graph_objects as go
-from flask import Flask, jsonify, render_template, request
+import numpy.typing as npt
+from flask import Flask, Response, jsonify, render_template, request
 from flask_socketio import SocketIO
+from werkzeug.datastructures import FileStorage
 from werkzeug.utils import secure_filename
 
-from genome_comparison import compare_chunk, read_and_encode_genome
+from adaptive_sampling import Interval, PrecisionGoal, SamplingTracker
+from genome_comparison import (
+    BASES_PER_WORD,
+    ENGINES,
+    MAX_EDIT_CHUNK_SIZE,
+    GenomeIndex,
+    PackedGenome,
+    match_masks,
+    pack_genome_into,
+    seed_size_for,
+    stream_encode_genome,
+)
+from genome_registry import DEFAULT_MAX_REGISTRY_BYTES, FileIdentity, GenomeRegistry
+from metrics import Metrics
+from result_cache import RESULTS_PATH, UNKNOWN, ResultCache, genome_key
+
+if TYPE_CHECKING:
+    # Distributed workers, the genome cache and sketches are imported where a run or a pre-flight first uses them, so
+    # that they don't add to the app's startup
+    from genome_cache import CachedGenome, CachedIndex
 
 app = Flask(__name__)
 socketio = SocketIO(app)
 
 
-@dataclass(frozen=True)
+# Counters grow as 2**N, and match masks are int64
+MAX_TARGETS = 16
+
+# How often the sampling loop checks for a stop request while it waits for batches
+_STOP_POLL_SECONDS = 0.1
+
+
+def category_names(target_names: Sequence[str]) -> list[str]:
+    """Name the chunk category of every match mask; bit t of a mask is set when the chunk matched target t."""
+    names = []
+    for mask in range(2 ** len(target_names)):
+        matched = [name for t, name in enumerate(target_names) if mask >> t & 1]
+        names.append("-".join(["Human", *matched]) if matched else "Human only")
+    return names
+
+
+@dataclass
 class SimulationState:
-    human_only: int = 0
-    human_genome1: int = 0
-    human_genome2: int = 0
-    human_genome3: int = 0
-    human_genome1_genome2: int = 0
-    human_genome1_genome3: int = 0
-    human_genome2_genome3: int = 0
-    human_genome1_genome2_genome3: int = 0
-    total_comparisons: int = 0
+    """Chunk counts indexed by match mask: `counts[mask]` chunks matched exactly the targets whose bits are set.
+
+    `counts` (and `total_comparisons`) only hold the chunks compared against every target. Once adaptive stopping drops
+    the targets whose quantities are precise enough, later batches only add to `samples` and to the `target_samples`
+    of the targets they still compare against, so the category counts fall behind the number of chunks sampled.
+    """
+
+    target_names: tuple[str, ...]
+    counts: npt.NDArray[np.int64]
+    intervals: list[Interval] = field(default_factory=list)
+    converged: bool = False
+    samples: int = 0
+    target_samples: npt.NDArray[np.int64] | None = None
+
+    @classmethod
+    def empty(cls, target_names: Sequence[str]) -> "SimulationState":
+        num_targets = len(target_names)
+        return cls(
+            tuple(target_names),
+            np.zeros(2**num_targets, dtype=np.int64),
+            target_samples=np.zeros(num_targets, dtype=np.int64),
+        )
+
+    @property
+    def total_comparisons(self) -> int:
+        return int(self.counts.sum())
+
+    def add(self, counts: npt.NDArray[np.int64]) -> None:
+        """Merge a batch of per-mask counts, e.g. `np.bincount(masks, minlength=2**N)`."""
+        np.add(self.counts, counts, out=self.counts)
 
     def to_dict(self) -> dict[str, int]:
-        result = {
-            "Human only": self.human_only,
-            f"Human-{simulation.config.genome1_name}": self.human_genome1,
-            f"Human-{simulation.config.genome2_name}": self.human_genome2,
-            f"Human-{simulation.config.genome1_name}-{simulation.config.genome2_name}": self.human_genome1_genome2,
-        }
-        if simulation.config.genome3_path:
-            result.update(
-                {
-                    f"Human-{simulation.config.genome3_name}": self.human_genome3,
-                    f"Human-{simulation.config.genome1_name}-{simulation.config.genome3_name}": self.human_genome1_genome3,
-                    f"Human-{simulation.config.genome2_name}-{simulation.config.genome3_name}": self.human_genome2_genome3,
-                    f"Human-{simulation.config.genome1_name}-{simulation.config.genome2_name}-{simulation.config.genome3_name}": self.human_genome1_genome2_genome3,
-                }
-            )
-        return result
+        return dict(zip(category_names(self.target_names), self.counts.tolist()))
+
+    def target_samples_dict(self) -> dict[str, int]:
+        return dict(zip(self.target_names, self.target_samples.tolist()))
 
 
 @dataclass(frozen=True)
@@ -61,146 +112,661 @@ class SimulationConfig:
     num_processes: int = mp.cpu_count()
     update_interval: int = 100
     human_genome_path: str = ""
-    genome1_path: str = ""
-    genome2_path: str = ""
-    genome3_path: str = ""
-    genome1_name: str = "Genome1"
-    genome2_name: str = "Genome2"
-    genome3_name: str = "Genome3"
+    target_paths: tuple[str, ...] = ()
+    target_names: tuple[str, ...] = ()
+    engine: str = "scan"
+    both_strands: bool = False  # also count chunks that match the reverse strand of a target
+    edit_distance: bool = False  # max_differences also counts insertions and deletions (chunks of at most 64 bases)
+    metrics_in_updates: bool = False  # push a summary of the run's metrics in every Socket.IO update
+    update_seconds: float = 0.25  # clients get the latest state at most this often, however fast the run goes
+    cache_dir: str = "cache"  # empty to encode FASTA files into shared memory, kept in `genome_registry` between runs
+    registry_max_bytes: int = DEFAULT_MAX_REGISTRY_BYTES  # shared memory kept for genomes and indexes no run uses
+    sketch_scaled: int | None = None  # pre-flight sketches keep one k-mer in this many (`DEFAULT_SCALED` when unset)
+    num_samples: int = 10_000
+    batch_size: int = 100  # chunks per worker task
+    # `host:port` of distributed worker nodes, each sampling on `num_processes` connections; empty to sample locally
+    workers: tuple[str, ...] = ()
+    # Runs with the same seed sample the same chunks, so a rerun or a run with more targets reuses the stored results;
+    # None draws a new seed, and new chunks, for every run
+    seed: int | None = 0
+    results_path: str = str(RESULTS_PATH)  # empty to scan every chunk again instead of reusing stored results
+    # Adaptive stopping: end the run, before num_samples, once the intervals of the monitored quantities (target names,
+    # category names or "A/B" ratios of targets; every target when empty) are this precise. 0 disables a criterion.
+    target_half_width: float = 0.0
+    target_relative_precision: float = 0.0
+    confidence: float = 0.95
+    min_samples: int = 1_000
+    monitor: tuple[str, ...] = ()
+
+    @property
+    def num_workers(self) -> int:
+        """Processes sampling at once, locally or over all the distributed worker nodes."""
+        return self.num_processes * max(len(self.workers), 1)
+
+    @classmethod
+    def from_dict(cls, config: dict[str, Any]) -> "SimulationConfig":
+        """Build a config from its JSON form, including configs saved with separate genome1-3 fields."""
+        config = dict(config)
+        legacy = [(config.pop(f"genome{i}_path", ""), config.pop(f"genome{i}_name", f"Genome{i}")) for i in (1, 2, 3)]
+        if "target_paths" not in config:
+            config["target_paths"] = [path for path, _ in legacy if path]
+            config["target_names"] = [name for path, name in legacy if path]
+        config["target_paths"] = tuple(config["target_paths"])
+        config["target_names"] = tuple(config.get("target_names", ()))
+        config["monitor"] = tuple(config.get("monitor", ()))
+        config["workers"] = tuple(config.get("workers", ()))
+        return cls(**config)
+
+
+@dataclass(frozen=True)
+class SharedGenome:
+    """A packed genome copied into shared memory so that workers can attach to it without copying."""
+
+    shm: shared_memory.SharedMemory
+    length: int
+
+    @classmethod
+    def create(cls, genome: PackedGenome) -> "SharedGenome":
+        shm = shared_memory.SharedMemory(create=True, size=max(genome.words.nbytes, 1))
+        np.frombuffer(shm.buf, dtype=np.uint64, count=len(genome.words))[:] = genome.words
+        return cls(shm, len(genome))
+
+    @classmethod
+    def from_encoded(cls, encoded: npt.NDArray[np.int8]) -> "SharedGenome":
+        """Pack an encoded genome straight into a new block, without a packed copy in process memory."""
+        num_words = (len(encoded) + BASES_PER_WORD - 1) // BASES_PER_WORD
+        shm = shared_memory.SharedMemory(create=True, size=max(num_words * 8, 1))
+        pack_genome_into(encoded, np.frombuffer(shm.buf, dtype=np.uint64, count=num_words))
+        return cls(shm, len(encoded))
+
+    def attach(self) -> PackedGenome:
+        num_words = (self.length + BASES_PER_WORD - 1) // BASES_PER_WORD
+        return PackedGenome(np.frombuffer(self.shm.buf, dtype=np.uint64, count=num_words), self.length)
+
+    @property
+    def nbytes(self) -> int:
+        return self.shm.size
+
+    @cached_property
+    def result_key(self) -> bytes:
+        """Result-store key of the genome, hashed once for as long as the block is registered."""
+        return genome_key(self.attach())
+
+    def release(self) -> None:
+        self.shm.close()
+        self.shm.unlink()
+
+
+@dataclass(frozen=True)
+class SharedIndex:
+    """A `GenomeIndex` whose tables live in shared memory so that workers can attach to them without copying."""
+
+    offsets_shm: shared_memory.SharedMemory
+    positions_shm: shared_memory.SharedMemory
+    num_offsets: int
+    num_positions: int
+    positions_dtype: str
+    seed_size: int
+
+    @classmethod
+    def create(cls, index: GenomeIndex) -> "SharedIndex":
+        offsets_shm = shared_memory.SharedMemory(create=True, size=max(index.offsets.nbytes, 1))
+        positions_shm = shared_memory.SharedMemory(create=True, size=max(index.positions.nbytes, 1))
+        np.frombuffer(offsets_shm.buf, dtype=index.offsets.dtype, count=len(index.offsets))[:] = index.offsets
+        np.frombuffer(positions_shm.buf, dtype=index.positions.dtype, count=len(index.positions))[:] = index.positions
+        return cls(
+            offsets_shm,
+            positions_shm,
+            len(index.offsets),
+            len(index.positions),
+            index.positions.dtype.str,
+            index.seed_size,
+        )
+
+    def attach(self, genome: PackedGenome) -> GenomeIndex:
+        offsets = np.frombuffer(self.offsets_shm.buf, dtype=np.int64, count=self.num_offsets)
+        positions = np.frombuffer(self.positions_shm.buf, dtype=self.positions_dtype, count=self.num_positions)
+        return GenomeIndex(genome, offsets, positions, self.seed_size)
+
+    @property
+    def nbytes(self) -> int:
+        return self.offsets_shm.size + self.positions_shm.size
+
+    def release(self) -> None:
+        for shm in (self.offsets_shm, self.positions_shm):
+            shm.close()
+            shm.unlink()
+
+
+@dataclass
+class BatchTimings:
+    """Where a worker spent the time of one batch, sent back with its counts; the fused scan compares every target in
+    one pass, so it reports a single "(fused)" target."""
+
+    busy_seconds: float = 0.0
+    result_store_seconds: float = 0.0
+    compare_seconds: dict[str, float] = field(default_factory=dict)
+    warm_up_seconds: float = 0.0  # only in the first batch of each worker
+
+
+# Genomes of a simulation worker process, attached once by `_init_worker`
+_worker_config: SimulationConfig | None = None
+_worker_human_genome: PackedGenome | None = None
+_worker_targets: list[PackedGenome] = []
+_worker_indexes: list[GenomeIndex] = []
+_worker_results: ResultCache | None = None
+_worker_target_keys: list[bytes] = []
+_worker_warm_up_seconds = 0.0
+
+
+def _init_worker(
+    config: SimulationConfig,
+    human_genome: "SharedGenome | CachedGenome",
+    targets: "list[tuple[SharedGenome | CachedGenome, SharedIndex | CachedIndex | None]]",
+    target_keys: list[bytes],
+    worker_pids: SimpleQueue | None = None,
+) -> None:
+    """Attach to the shared-memory blocks (or map the cache entries) once for the lifetime of the worker, and load the
+    kernels before the first batch arrives. A local worker first reports its PID to `worker_pids`, so that a stopped run
+    can kill it mid-batch."""
+    global _worker_config, _worker_human_genome, _worker_targets, _worker_indexes, _worker_results, _worker_target_keys
+    global _worker_warm_up_seconds
+    if worker_pids is not None:
+        worker_pids.put(os.getpid())
+    _worker_config = config
+    _worker_human_genome = human_genome.attach()
+    _worker_targets = [genome.attach() for genome, _ in targets]
+    if config.engine == "index":
+        seed_size = seed_size_for(config.chunk_size, config.max_differences)
+        _worker_indexes = [
+            index.attach(genome) if index is not None else GenomeIndex.build(genome, seed_size)
+            for (_, index), genome in zip(targets, _worker_targets)
+        ]
+    if config.results_path:
+        _worker_results = ResultCache(config.results_path)
+        _worker_target_keys = target_keys
+    start = perf_counter()
+    _warm_up()
+    _worker_warm_up_seconds = perf_counter() - start
+
+
+def _init_remote_worker(config: SimulationConfig, target_keys: list[bytes]) -> None:
+    """`_init_worker` on a distributed worker node, which maps the genomes and their indexes from its own cache rather
+    than attaching to the coordinator's memory; the worker processes of a node share one copy of each."""
+    from genome_cache import load_cached_genome, load_cached_index
+
+    cache_dir = Path(config.cache_dir)
+    human_genome = load_cached_genome(config.human_genome_path, cache_dir)
+    seed_size = seed_size_for(config.chunk_size, config.max_differences)
+    targets = [
+        (
+            load_cached_genome(path, cache_dir),
+            load_cached_index(path, seed_size, cache_dir) if config.engine == "index" else None,
+        )
+        for path in config.target_paths
+    ]
+    _init_worker(config, human_genome, targets, target_keys)
+
+
+def _warm_up() -> None:
+    """Run the batch kernels once on a single chunk, so that loading them from the Numba cache (or compiling them, the
+    first time) doesn't hold up the first batch. The scan is warmed up on targets cut down to a few words, which have
+    the same array types as the full ones."""
+    chunk_size = _worker_config.chunk_size
+    if len(_worker_human_genome) < chunk_size:
+        return
+    chunk = _worker_human_genome.chunk(0, chunk_size)
+    max_differences, both_strands, edit_distance = (
+        _worker_config.max_differences,
+        _worker_config.both_strands,
+        _worker_config.edit_distance,
+    )
+    if _worker_config.engine == "index":
+        for index in _worker_indexes[:1]:
+            index.compare_chunk(chunk, max_differences, both_strands, edit_distance)
+        return
+    num_words = (2 * chunk_size + BASES_PER_WORD - 1) // BASES_PER_WORD
+    tiny_targets = [
+        PackedGenome(target.words[:num_words], min(len(target), num_words * BASES_PER_WORD))
+        for target in _worker_targets
+    ]
+    match_masks([chunk], tiny_targets, max_differences, both_strands, edit_distance)
+
+
+def _match_chunks(chunks: list[PackedGenome], targets: list[int], timings: BatchTimings) -> npt.NDArray[np.bool_]:
+    """Whether each chunk (row) matches each of the given targets (column)."""
+    max_differences, both_strands, edit_distance = (
+        _worker_config.max_differences,
+        _worker_config.both_strands,
+        _worker_config.edit_distance,
+    )
+    if _worker_config.engine == "index":
+        matched = np.empty((len(chunks), len(targets)), dtype=np.bool_)
+        for j, t in enumerate(targets):
+            start = perf_counter()
+            index = _worker_indexes[t]
+            matched[:, j] = [
+                index.compare_chunk(chunk, max_differences, both_strands, edit_distance) for chunk in chunks
+            ]
+            timings.compare_seconds[_worker_config.target_names[t]] = perf_counter() - start
+        return matched
+    start = perf_counter()
+    selected = [_worker_targets[t] for t in targets]
+    masks = match_masks(chunks, selected, max_differences, both_strands, edit_distance)
+    timings.compare_seconds["(fused)"] = perf_counter() - start
+    return ((masks[:, None] >> np.arange(len(targets))) & 1).astype(np.bool_)
+
+
+def _sample_batch(
+    batch_size: int, seed: tuple[int, int], active_targets: int
+) -> tuple[npt.NDArray[np.int64], BatchTimings]:
+    """Compare `batch_size` random human chunks against the targets in the `active_targets` bitmask; returns the chunk
+    count of each match mask, and where the time went.
+
+    Results already in the result store are reused, and only the remaining (chunk, target) pairs are scanned.
+    """
+    global _worker_warm_up_seconds
+    batch_start = perf_counter()
+    timings = BatchTimings(warm_up_seconds=_worker_warm_up_seconds)
+    _worker_warm_up_seconds = 0.0
+    chunk_size, max_differences, both_strands, edit_distance = (
+        _worker_config.chunk_size,
+        _worker_config.max_differences,
+        _worker_config.both_strands,
+        _worker_config.edit_distance,
+    )
+    rng = np.random.default_rng(seed)
+    starts = rng.integers(0, len(_worker_human_genome) - chunk_size + 1, batch_size)
+    chunks = [_worker_human_genome.chunk(int(start), chunk_size) for start in starts]
+    active = [t for t in range(len(_worker_targets)) if active_targets >> t & 1]
+
+    if _worker_results is None:
+        matched = _match_chunks(chunks, active, timings)
+    else:
+        store_start = perf_counter()
+        chunk_words = np.stack([chunk.words for chunk in chunks])
+        known = np.stack(
+            [
+                _worker_results.lookup(
+                    _worker_target_keys[t], chunk_words, chunk_size, max_differences, both_strands, edit_distance
+                )
+                for t in active
+            ],
+            axis=1,
+        ).reshape(batch_size, len(active))
+        matched = known == 1
+        unknown = known == UNKNOWN
+        missing_chunks = np.flatnonzero(unknown.any(axis=1))
+        missing_targets = np.flatnonzero(unknown.any(axis=0))
+        timings.result_store_seconds = perf_counter() - store_start
+        if len(missing_chunks):
+            computed = _match_chunks([chunks[c] for c in missing_chunks], [active[j] for j in missing_targets], timings)
+            matched[np.ix_(missing_chunks, missing_targets)] = computed
+            store_start = perf_counter()
+            for j in missing_targets:
+                stored = unknown[:, j]
+                _worker_results.store(
+                    _worker_target_keys[active[j]],
+                    chunk_words[stored],
+                    chunk_size,
+                    max_differences,
+                    matched[stored, j],
+                    both_strands,
+                    edit_distance,
+                )
+            timings.result_store_seconds += perf_counter() - store_start
+
+    masks = matched.astype(np.int64) @ (np.int64(1) << np.array(active, dtype=np.int64))
+    timings.busy_seconds = perf_counter() - batch_start
+    return np.bincount(masks, minlength=2 ** len(_worker_targets)), timings
+
+
+# Shared-memory genomes and indexes of this process, reused by every run whose files haven't changed
+genome_registry = GenomeRegistry()
+atexit.register(genome_registry.clear)
+
+
+def _terminate_workers(worker_pids: SimpleQueue) -> None:
+    """Kill the local workers of a run mid-batch, by the PIDs they reported when they started; executors have no public
+    way to interrupt running tasks. Distributed workers can't be interrupted, so their running batches finish and are
+    dropped."""
+    while not worker_pids.empty():
+        try:
+            os.kill(worker_pids.get(), signal.SIGTERM)
+        except ProcessLookupError:
+            pass
 
 
 class Simulation:
     def __init__(self, config: SimulationConfig):
         self.config = config
-        self.state = SimulationState()
-        self.human_genome_shm: shared_memory.SharedMemory | None = None
-        self.genome1_shm: shared_memory.SharedMemory | None = None
-        self.genome2_shm: shared_memory.SharedMemory | None = None
-        self.genome3_shm: shared_memory.SharedMemory | None = None
-        self.human_genome_size: int = 0
-        self.genome1_size: int = 0
-        self.genome2_size: int = 0
-        self.genome3_size: int = 0
+        self.state = SimulationState.empty(config.target_names)
+        # Cached genomes pickle as their cache path, so workers map the cache file instead of receiving a copy
+        self.human_genome: "SharedGenome | CachedGenome | None" = None
+        self.targets: "list[SharedGenome | CachedGenome]" = []
+        self.indexes: list[SharedIndex] = []
+        self.registry_keys: list[tuple] = []  # released when the run ends
+        self.worker_pids: SimpleQueue | None = None  # local workers of the running run report their PIDs here
+        self.metrics = Metrics()
+        self.stopped = False
+        self.start_time = perf_counter()
 
     def load_genomes(self) -> None:
+        if self.config.engine not in ENGINES:
+            raise ValueError(f"Unknown engine {self.config.engine!r}, expected one of {ENGINES}")
+        if not 1 <= len(self.config.target_paths) <= MAX_TARGETS:
+            raise ValueError(f"Expected 1 to {MAX_TARGETS} target genomes, got {len(self.config.target_paths)}")
+        if len(self.config.target_names) != len(self.config.target_paths):
+            raise ValueError("Every target genome needs a name")
+        if self.config.workers and not self.config.cache_dir:
+            raise ValueError("Distributed workers map genomes from their genome cache, so cache_dir must be set")
+        if self.config.edit_distance and self.config.chunk_size > MAX_EDIT_CHUNK_SIZE:
+            raise ValueError(f"Edit distance supports chunks of at most {MAX_EDIT_CHUNK_SIZE} bases")
+        genome_registry.max_bytes = self.config.registry_max_bytes
         try:
-            print("Loading genomes")
-            print(f"Human genome path: {self.config.human_genome_path}")
-            human_genome = read_and_encode_genome(self.config.human_genome_path)
-            print("Human genome loaded")
-            print(f"Genome1 path: {self.config.genome1_path}")
-            genome1 = read_and_encode_genome(self.config.genome1_path)
-            print("Genome1 loaded")
-            print(f"Genome2 path: {self.config.genome2_path}")
-            genome2 = read_and_encode_genome(self.config.genome2_path)
-            print("Genome2 loaded")
-
-            self.human_genome_size = len(human_genome)
-            self.genome1_size = len(genome1)
-            self.genome2_size = len(genome2)
-
-            self.human_genome_shm = shared_memory.SharedMemory(create=True, size=self.human_genome_size)
-            self.genome1_shm = shared_memory.SharedMemory(create=True, size=self.genome1_size)
-            self.genome2_shm = shared_memory.SharedMemory(create=True, size=self.genome2_size)
-
-            self.human_genome_shm.buf[:] = human_genome.tobytes()
-            self.genome1_shm.buf[:] = genome1.tobytes()
-            self.genome2_shm.buf[:] = genome2.tobytes()
-
-            if self.config.genome3_path:
-                print(f"Genome3 path: {self.config.genome3_path}")
-                genome3 = read_and_encode_genome(self.config.genome3_path)
-                print("Genome3 loaded")
-                self.genome3_size = len(genome3)
-                self.genome3_shm = shared_memory.SharedMemory(create=True, size=self.genome3_size)
-                self.genome3_shm.buf[:] = genome3.tobytes()
+            self.human_genome = self._load_genome("Human", self.config.human_genome_path)
+            for name, path in zip(self.config.target_names, self.config.target_paths):
+                self.targets.append(self._load_genome(name, path))
+
+            # Distributed workers index the targets themselves
+            if self.config.engine == "index" and not self.config.workers:
+                seed_size = seed_size_for(self.config.chunk_size, self.config.max_differences)
+                for name, path, genome in zip(self.config.target_names, self.config.target_paths, self.targets):
+                    self.indexes.append(
+                        self._acquire(
+                            ("index", FileIdentity.of(path), seed_size),
+                            lambda: self._build_index(name, genome, seed_size),
+                            name,
+                        )
+                    )
         except Exception as e:
             print(f"Error loading genomes: {e}")
             raise e
+        self.metrics.set("simulation_registry_bytes", genome_registry.nbytes)
+
+    def _acquire(self, key: tuple, load: Callable[[], Any], name: str) -> Any:
+        block, reused = genome_registry.acquire(key, load)
+        self.registry_keys.append(key)
+        if reused:
+            self.metrics.inc("simulation_registry_reuses_total", kind=key[0], genome=name)
+            print(f"{name} {key[0]} reused from shared memory")
+        return block
+
+    def _load_genome(self, name: str, path: str) -> "SharedGenome | CachedGenome":
+        """Map the genome from the genome cache, or take it from the registry, encoding it into shared memory first if
+        this version of the file isn't registered yet."""
+        if self.config.cache_dir:
+            from genome_cache import load_cached_genome
+
+            with self.metrics.timer("simulation_stage_seconds", stage="cache_load", genome=name):
+                genome = load_cached_genome(path, Path(self.config.cache_dir))
+            print(f"{name} genome mapped from the cache: {path}")
+            return genome
+        return self._acquire(("genome", FileIdentity.of(path)), lambda: self._encode_genome(name, path), name)
+
+    def _encode_genome(self, name: str, path: str) -> SharedGenome:
+        """Read, encode and pack a genome into shared memory, timing each stage."""
+        encoded, _, stats = stream_encode_genome(path)
+        self.metrics.set("simulation_stage_seconds", stats.read_seconds, stage="fasta_read", genome=name)
+        self.metrics.set("simulation_stage_seconds", stats.encode_seconds, stage="fasta_parse_encode", genome=name)
+        with self.metrics.timer("simulation_stage_seconds", stage="pack", genome=name):
+            genome = SharedGenome.from_encoded(encoded)
+        print(f"{name} genome loaded: {path} ({stats})")
+        return genome
+
+    def _build_index(self, name: str, genome: "SharedGenome | CachedGenome", seed_size: int) -> SharedIndex:
+        with self.metrics.timer("simulation_stage_seconds", stage="index_build", genome=name):
+            index = GenomeIndex.build(genome.attach(), seed_size)
+        with self.metrics.timer("simulation_stage_seconds", stage="shared_memory_copy_index", genome=name):
+            return SharedIndex.create(index)
+
+    def _target_keys(self) -> list[bytes]:
+        """Result-store keys of the targets, hashed once here rather than in every worker."""
+        if not self.config.results_path:
+            return []
+        with self.metrics.timer("simulation_stage_seconds", stage="result_keys", genome="all"):
+            return [
+                genome.result_key if isinstance(genome, SharedGenome) else genome_key(genome) for genome in self.targets
+            ]
+
+    def _targets(self) -> "list[tuple[SharedGenome | CachedGenome, SharedIndex | None]]":
+        if self.indexes:
+            return list(zip(self.targets, self.indexes))
+        return [(genome, None) for genome in self.targets]
+
+    def _record_batch(self, batch_samples: int, timings: BatchTimings, busy_seconds: float, elapsed: float) -> None:
+        self.metrics.inc("simulation_samples_total", batch_samples)
+        self.metrics.inc("simulation_batches_total")
+        self.metrics.inc("simulation_worker_busy_seconds_total", timings.busy_seconds)
+        for target, seconds in timings.compare_seconds.items():
+            self.metrics.observe("simulation_compare_seconds", seconds, target=target)
+        if self.config.results_path:
+            self.metrics.observe("simulation_result_store_seconds", timings.result_store_seconds)
+        if timings.warm_up_seconds:
+            self.metrics.observe("simulation_worker_warm_up_seconds", timings.warm_up_seconds)
+        self.metrics.set(
+            "simulation_samples_per_second", self.metrics.get("simulation_samples_total") / max(elapsed, 1e-9)
+        )
+        self.metrics.set("simulation_worker_utilization", busy_seconds / max(elapsed * self.config.num_workers, 1e-9))
 
-    def run_comparison(self) -> tuple[bool, bool, bool]:
-        # human_genome_shm = shared_memory.SharedMemory(name=human_genome_name)
-        # genome1_shm = shared_memory.SharedMemory(name=genome1_name)
-        # genome2_shm = shared_memory.SharedMemory(name=genome2_name)
-
-        human_genome = np.frombuffer(self.human_genome_shm.buf[: self.human_genome_size], dtype=np.int8)
-        genome1 = np.frombuffer(self.genome1_shm.buf[: self.genome1_size], dtype=np.int8)
-        genome2 = np.frombuffer(self.genome2_shm.buf[: self.genome2_size], dtype=np.int8)
+    def run_simulation(
+        self, callback: Callable[[SimulationState], Any], stop: threading.Event | None = None
+    ) -> None:
+        """Sample until `num_samples` or the precision goal, calling `callback` every `update_interval` samples.
 
-        chunk_start = random.randint(0, len(human_genome) - self.config.chunk_size)
-        chunk = human_genome[chunk_start : chunk_start + self.config.chunk_size]
+        Setting `stop` ends the run early: queued batches are cancelled and running ones killed with their workers.
+        Registered genomes and indexes are released however the run ends.
+        """
+        self.start_time = perf_counter()
+        try:
+            self.load_genomes()
+            self._sample(callback, stop)
+        finally:
+            self._release()
+
+    def _executor(self) -> Executor:
+        if self.config.workers:
+            from distributed import RemoteExecutor, parse_address
+
+            return RemoteExecutor(
+                [parse_address(address) for address in self.config.workers],
+                self.config.num_processes,
+                _init_remote_worker,
+                (self.config, self._target_keys()),
+            )
+        self.worker_pids = mp.SimpleQueue()
+        return ProcessPoolExecutor(
+            max_workers=self.config.num_processes,
+            initializer=_init_worker,
+            initargs=(self.config, self.human_genome, self._targets(), self._target_keys(), self.worker_pids),
+        )
 
-        genome1_match = compare_chunk(chunk, genome1, self.config.max_differences)
-        genome2_match = compare_chunk(chunk, genome2, self.config.max_differences)
+    def _sample(self, callback: Callable[[SimulationState], Any], stop: threading.Event | None) -> None:
+        # Batches are seeded by (run seed, batch number), so a run that compares every batch against every target gets
+        # the same counts however its batches are scheduled
+        seed = self.config.seed if self.config.seed is not None else random.randrange(2**63)
+        tracker = SamplingTracker(
+            self.config.target_names,
+            category_names(self.config.target_names),
+            PrecisionGoal(
+                self.config.target_half_width,
+                self.config.target_relative_precision,
+                self.config.confidence,
+                self.config.min_samples,
+            ),
+            self.config.monitor,
+        )
+        active_targets = tracker.all_targets
+        samples, submitted, num_batches = 0, 0, 0
+        in_flight: dict[Future, int] = {}
+        run_start, busy_seconds = perf_counter(), 0.0
+        executor = self._executor()
+        try:
+            while True:
+                if stop is not None and stop.is_set():
+                    self.stopped = True
+                    break
+                # Keep two batches per worker queued; later batches are drawn with the latest allocation
+                while len(in_flight) < 2 * self.config.num_workers and submitted < self.config.num_samples:
+                    if self.state.converged:
+                        break
+                    batch_size = min(self.config.batch_size, self.config.num_samples - submitted)
+                    future = executor.submit(_sample_batch, batch_size, (seed, num_batches), active_targets)
+                    in_flight[future] = active_targets
+                    submitted += batch_size
+                    num_batches += 1
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, timeout=_STOP_POLL_SECONDS, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch_targets = in_flight.pop(future)
+                    counts, timings = future.result()
+                    if not samples:
+                        self.metrics.set("simulation_first_batch_seconds", perf_counter() - self.start_time)
+                    busy_seconds += timings.busy_seconds
+                    self._record_batch(int(counts.sum()), timings, busy_seconds, perf_counter() - run_start)
+                    tracker.add(counts, batch_targets)
+                    if batch_targets == tracker.all_targets:
+                        self.state.add(counts)
+                    self.state.samples, self.state.target_samples = tracker.samples, tracker.target_samples
+                    self.state.intervals = tracker.intervals(self.state.counts)
+                    self.state.converged = tracker.converged(self.state.intervals)
+                    active_targets = tracker.active_targets(self.state.intervals)
+
+                    previous_samples, samples = samples, samples + int(counts.sum())
+                    if samples // self.config.update_interval > previous_samples // self.config.update_interval:
+                        with self.metrics.timer("simulation_callback_seconds"):
+                            callback(self.state)
+        finally:
+            # Batches are still in flight only when the run was stopped or a batch failed
+            if in_flight and self.worker_pids is not None:
+                _terminate_workers(self.worker_pids)
+            executor.shutdown(wait=True, cancel_futures=True)
+            if self.worker_pids is not None:
+                self.worker_pids.close()
+                self.worker_pids = None
+        if samples % self.config.update_interval:
+            with self.metrics.timer("simulation_callback_seconds"):
+                callback(self.state)
+        if self.state.converged:
+            print(f"Precision goal met after {samples} samples")
+        if self.stopped:
+            print(f"Simulation stopped after {samples} samples")
+
+    def _release(self) -> None:
+        """Let go of the registered blocks, which stay in shared memory for the next run until they are evicted."""
+        for key in self.registry_keys:
+            genome_registry.release(key)
+        self.registry_keys = []
+
+
+class SimulationJob:
+    """A simulation running as a background task, watched by any number of Socket.IO clients.
+
+    The sampling loop only records the latest state in `callback`; a separate emitter task broadcasts it at most every
+    `update_seconds`, so slow clients never hold the run up and fast runs don't flood them.
+    """
 
-        genome3_match = False
-        if self.config.genome3_path:
-            genome3 = np.frombuffer(self.genome3_shm.buf[: self.genome3_size], dtype=np.int8)
-            genome3_match = compare_chunk(chunk, genome3, self.config.max_differences)
+    def __init__(self, config: SimulationConfig):
+        self.job_id = uuid.uuid4().hex
+        self.simulation = Simulation(config)
+        self.status = "running"
+        self.error: str | None = None
+        self.done = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._latest: dict[str, Any] | None = None
+        self._version = 0
+
+    def start(self) -> None:
+        socketio.start_background_task(self._run)
+        socketio.start_background_task(self._emit_updates)
+
+    def stop(self) -> None:
+        if self.status == "running":
+            self.status = "stopping"
+        self._stop.set()
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "error": self.error,
+            "total": self.simulation.state.total_comparisons,
+            "samples": self.simulation.state.samples,
+        }
 
-        print(
-            f"Chunk: {chunk}, Genome1 match: {genome1_match}, Genome2 match: {genome2_match}, Genome3 match: {genome3_match}"
-        )
+    def latest_update(self) -> dict[str, Any] | None:
+        with self._lock:
+            return self._latest
+
+    def callback(self, state: SimulationState) -> None:
+        update = {
+            "job_id": self.job_id,
+            "state": state.to_dict(),
+            "total": state.total_comparisons,
+            "samples": state.samples,
+            "target_samples": state.target_samples_dict(),
+            "intervals": [interval.to_dict() for interval in state.intervals],
+            "converged": state.converged,
+        }
+        if self.simulation.config.metrics_in_updates:
+            update["metrics"] = self.simulation.metrics.to_dict()
+        with self._lock:
+            self._latest = update
+            self._version += 1
 
-        return genome1_match, genome2_match, genome3_match
-
-    def update_state(self, genome1_match: bool, genome2_match: bool, genome3_match: bool) -> None:
-        new_state = {}
-        if self.config.genome3_path:
-            if genome1_match and genome2_match and genome3_match:
-                new_state["human_genome1_genome2_genome3"] = self.state.human_genome1_genome2_genome3 + 1
-            elif genome1_match and genome2_match:
-                new_state["human_genome1_genome2"] = self.state.human_genome1_genome2 + 1
-            elif genome1_match and genome3_match:
-                new_state["human_genome1_genome3"] = self.state.human_genome1_genome3 + 1
-            elif genome2_match and genome3_match:
-                new_state["human_genome2_genome3"] = self.state.human_genome2_genome3 + 1
-            elif genome1_match:
-                new_state["human_genome1"] = self.state.human_genome1 + 1
-            elif genome2_match:
-                new_state["human_genome2"] = self.state.human_genome2 + 1
-            elif genome3_match:
-                new_state["human_genome3"] = self.state.human_genome3 + 1
-            else:
-                new_state["human_only"] = self.state.human_only + 1
-        else:
-            if genome1_match and genome2_match:
-                new_state["human_genome1_genome2"] = self.state.human_genome1_genome2 + 1
-            elif genome1_match:
-                new_state["human_genome1"] = self.state.human_genome1 + 1
-            elif genome2_match:
-                new_state["human_genome2"] = self.state.human_genome2 + 1
-            else:
-                new_state["human_only"] = self.state.human_only + 1
-
-        new_state["total_comparisons"] = self.state.total_comparisons + 1
-        self.state = SimulationState(**{**self.state.__dict__, **new_state})
-
-    def run_simulation(self, callback: Callable[[SimulationState], Any]) -> None:
-        print("Starting simulation")
-        self.load_genomes()
-        print("Genomes loaded")
-
-        with ProcessPoolExecutor(max_workers=self.config.num_processes) as executor:
-            for future in as_completed(executor.submit(self.run_comparison) for _ in range(10_000)):
-                genome1_match, genome2_match, genome3_match = future.result()
-                print("Updating state")
-                self.update_state(genome1_match, genome2_match, genome3_match)
-                print("State updated")
-                if self.state.total_comparisons % self.config.update_interval == 0:
-                    print("Calling callback")
-                    callback(self.state)
-
-        # Clean up shared memory
-        self.human_genome_shm.close()
-        self.genome1_shm.close()
-        self.genome2_shm.close()
-        self.human_genome_shm.unlink()
-        self.genome1_shm.unlink()
-        self.genome2_shm.unlink()
-        if self.genome3_shm:
-            self.genome3_shm.close()
-            self.genome3_shm.unlink()
+    def _run(self) -> None:
+        try:
+            self.simulation.run_simulation(self.callback, self._stop)
+            self.status = "stopped" if self.simulation.stopped else "finished"
+        except FileNotFoundError as e:
+            self.status, self.error = "failed", f"File not found: {str(e)}"
+        except Exception as e:
+            self.status, self.error = "failed", f"An error occurred: {str(e)}"
+        finally:
+            self.done.set()
+
+    def _emit_updates(self) -> None:
+        socketio.emit("simulation_status", self.to_dict())
+        sent = 0
+        while True:
+            # Read `done` first so that the final state is sent once the run has ended
+            finished = self.done.is_set()
+            with self._lock:
+                version, update = self._version, self._latest
+            if version != sent:
+                with self.simulation.metrics.timer("simulation_emit_seconds"):
+                    socketio.emit("update", update)
+                sent = version
+            if finished:
+                break
+            # Wakes early when the run ends
+            self.done.wait(self.simulation.config.update_seconds)
+        if self.error:
+            socketio.emit("error", {"message": self.error})
+        socketio.emit("simulation_status", self.to_dict())
+
+
+# The last `MAX_KEPT_JOBS` jobs started, oldest first, and the one that is running or ran last
+MAX_KEPT_JOBS = 16
+jobs: dict[str, SimulationJob] = {}
+current_job: SimulationJob | None = None
+
+
+def start_job() -> SimulationJob:
+    """Start the configured simulation unless one is already running, forgetting the oldest finished jobs."""
+    global current_job
+    if current_job is not None and not current_job.done.is_set():
+        raise RuntimeError(f"Simulation {current_job.job_id} is still running")
+    current_job = SimulationJob(simulation.config)
+    jobs[current_job.job_id] = current_job
+    # Only the new job can be running, and it is the last one in
+    while len(jobs) > max(MAX_KEPT_JOBS, 1):
+        del jobs[next(iter(jobs))]
+    current_job.start()
+    return current_job
 
 
 # Add this function to load the configuration from a file
@@ -208,7 +774,7 @@ def load_config() -> SimulationConfig:
     try:
         with open("config.json", "r") as f:
             config_dict = json.load(f)
-        return SimulationConfig(**config_dict)
+        return SimulationConfig.from_dict(config_dict)
     except FileNotFoundError:
         return SimulationConfig()
 
@@ -225,43 +791,123 @@ simulation = Simulation(load_config())
 
 @app.route("/")
 def index() -> str:
-    return render_template("index.html", config=simulation.config)
+    targets = list(zip(simulation.config.target_paths, simulation.config.target_names))
+    return render_template("index.html", config=simulation.config, targets=targets)
 
 
 @app.route("/configure", methods=["POST"])
 def configure() -> str:
     global simulation
 
-    # Function to save uploaded file and return its path
-    def save_uploaded_file(file_key: str) -> str:
-        if file_key not in request.files:
-            return simulation.config.__dict__[file_key.replace("_file", "_path")]
-        file = request.files[file_key]
-        if file.filename == "":
-            return simulation.config.__dict__[file_key.replace("_file", "_path")]
+    # Function to save an uploaded file and return its path, or `current_path` if nothing was uploaded
+    def save_uploaded_file(file: FileStorage | None, current_path: str) -> str:
+        if file is None or file.filename == "":
+            return current_path
         filename = secure_filename(file.filename)
         save_path = os.path.join("uploads", filename)
         file.save(save_path)
         return save_path
 
+    # One form row per target genome; rows left without a file are dropped
+    target_paths, target_names = [], []
+    rows = zip_longest(
+        request.files.getlist("target_file"), request.form.getlist("target_path"), request.form.getlist("target_name")
+    )
+    for file, current_path, name in rows:
+        path = save_uploaded_file(file, current_path or "")
+        if path:
+            target_paths.append(path)
+            target_names.append(name or f"Genome{len(target_names) + 1}")
+
     config = SimulationConfig(
         chunk_size=int(request.form["chunk_size"]),
         max_differences=int(request.form["max_differences"]),
         num_processes=int(request.form["num_processes"]),
         update_interval=int(request.form["update_interval"]),
-        human_genome_path=save_uploaded_file("human_genome_file"),
-        genome1_path=save_uploaded_file("genome1_file"),
-        genome2_path=save_uploaded_file("genome2_file"),
-        genome3_path=save_uploaded_file("genome3_file"),
-        genome1_name=request.form["genome1_name"],
-        genome2_name=request.form["genome2_name"],
-        genome3_name=request.form["genome3_name"],
+        human_genome_path=save_uploaded_file(
+            request.files.get("human_genome_file"), simulation.config.human_genome_path
+        ),
+        target_paths=tuple(target_paths),
+        target_names=tuple(target_names),
+        engine=request.form.get("engine", simulation.config.engine),
+        both_strands="both_strands" in request.form,
+        edit_distance="edit_distance" in request.form,
+        metrics_in_updates="metrics_in_updates" in request.form,
+        cache_dir=simulation.config.cache_dir,
+        num_samples=simulation.config.num_samples,
+        batch_size=simulation.config.batch_size,
+        workers=tuple(address.strip() for address in request.form.get("workers", "").split(",") if address.strip()),
+        registry_max_bytes=simulation.config.registry_max_bytes,
+        sketch_scaled=simulation.config.sketch_scaled,
+        update_seconds=simulation.config.update_seconds,
+        seed=int(request.form["seed"]) if request.form.get("seed", "").strip() else None,
+        results_path=simulation.config.results_path,
+        target_half_width=float(request.form.get("target_half_width") or 0),
+        target_relative_precision=float(request.form.get("target_relative_precision") or 0),
+        confidence=float(request.form.get("confidence") or simulation.config.confidence),
+        min_samples=simulation.config.min_samples,
+        monitor=tuple(name.strip() for name in request.form.get("monitor", "").split(",") if name.strip()),
     )
     simulation = Simulation(config)
     save_config(config)  # Save the new configuration
     return jsonify({"message": "Configuration updated successfully", "config": config.__dict__})
 
 
+@app.route("/metrics")
+def export_metrics() -> Response:
+    """Metrics of the running (or last) simulation in the Prometheus text format, for scraping during a live run."""
+    metrics = current_job.simulation.metrics if current_job is not None else simulation.metrics
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/preflight", methods=["POST"])
+def preflight() -> tuple[Response, int]:
+    """Estimate from k-mer sketches how many of the human genome's chunks each target holds exactly, before a run.
+
+    Sketches are saved next to the genome cache, so once every genome has been sketched this takes milliseconds.
+    """
+    from genome_sketch import DEFAULT_SCALED, MAX_KMER_SIZE, load_sketch
+
+    config = simulation.config
+    if not config.human_genome_path or not config.target_paths:
+        return jsonify({"error": "Configure the human genome and at least one target first"}), 400
+    if config.chunk_size > MAX_KMER_SIZE:
+        return jsonify({"error": f"Sketches hold k-mers of at most {MAX_KMER_SIZE} bases"}), 400
+    cache_dir = Path(config.cache_dir) if config.cache_dir else None
+    scaled = config.sketch_scaled or DEFAULT_SCALED
+    options = (cache_dir, config.chunk_size, scaled, config.both_strands, config.num_processes)
+    human = load_sketch(config.human_genome_path, *options)
+    estimates = [
+        {"target": name, **human.compare(load_sketch(path, *options), config.confidence).to_dict()}
+        for path, name in zip(config.target_paths, config.target_names)
+    ]
+    return jsonify({"estimates": estimates}), 200
+
+
+@app.route("/simulations", methods=["POST"])
+def start_simulation() -> tuple[Response, int]:
+    try:
+        job = start_job()
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 409
+    return jsonify(job.to_dict()), 202
+
+
+@app.route("/simulations/<job_id>")
+def simulation_status(job_id: str) -> tuple[Response, int]:
+    if job_id not in jobs:
+        return jsonify({"error": f"No simulation {job_id}"}), 404
+    return jsonify(jobs[job_id].to_dict()), 200
+
+
+@app.route("/simulations/<job_id>/stop", methods=["POST"])
+def stop_simulation(job_id: str) -> tuple[Response, int]:
+    if job_id not in jobs:
+        return jsonify({"error": f"No simulation {job_id}"}), 404
+    jobs[job_id].stop()
+    return jsonify(jobs[job_id].to_dict()), 202
+
+
 @app.route("/browse", methods=["POST"])
 def browse_filesystem() -> dict[str, list[str] | str]:
     current_path = request.json.get("current_path", "/")
@@ -279,17 +925,30 @@ def browse_filesystem() -> dict[str, list[str] | str]:
         return {"error": str(e)}
 
 
+@socketio.on("connect")
+def handle_connect(auth: Any = None) -> None:
+    """Bring a client that joins mid-run up to date with the job and its latest state."""
+    if current_job is None:
+        return
+    socketio.emit("simulation_status", current_job.to_dict(), to=request.sid)
+    update = current_job.latest_update()
+    if update is not None:
+        socketio.emit("update", update, to=request.sid)
+
+
 @socketio.on("start_simulation")
 def handle_start_simulation() -> None:
-    def update_client(state: SimulationState) -> None:
-        socketio.emit("update", {"state": state.to_dict(), "total": state.total_comparisons})
-
     try:
-        simulation.run_simulation(update_client)
-    except FileNotFoundError as e:
-        socketio.emit("error", {"message": f"File not found: {str(e)}"})
-    except Exception as e:
-        socketio.emit("error", {"message": f"An error occurred: {str(e)}"})
+        start_job()
+    except RuntimeError as e:
+        socketio.emit("error", {"message": str(e)}, to=request.sid)
+
+
+@socketio.on("stop_simulation")
+def handle_stop_simulation(data: dict[str, str] | None = None) -> None:
+    job = jobs.get((data or {}).get("job_id", "")) or current_job
+    if job is not None:
+        job.stop()
 
 
 @socketio.on("kill_application")
@@ -0,0 +1,312 @@
+"""
+Coordinator/worker mode that spreads `find_matches` shards and simulation batches over several machines.
+
+A worker node runs `python -m scripts.distributed_worker`. It listens on plain TCP through `multiprocessing.connection`,
+which authenticates both ends with a shared key (`DISTRIBUTED_AUTHKEY`) and pickles the messages. A task is any
+pickled callable, so whoever holds the key can run code on the node: workers refuse to start without one, and it should
+be a long random secret. Each accepted connection is served by a forked process of its own, so a coordinator uses as
+many cores of a node as it opens connections to it. Workers map genomes from their own encoded-genome cache, by FASTA
+path: every node needs the FASTA files at the same paths (e.g. on a shared filesystem) and encodes them into its local
+cache on first use. Indexes are built into the cache as well, once per node, and mapped by every connection process
+rather than each holding a copy.
+
+On the coordinator, `RemoteExecutor` is a `concurrent.futures.Executor` over those connections. A task is a module-level
+function and its arguments. A task whose worker dies (or can't be reached) goes back to the front of the queue for
+another connection, and only an exception raised by the task itself fails its future. Shards and batches are
+deterministic functions of their arguments, so the merged counts are the same as on a single node whichever worker ran
+what.
+"""
+
+import multiprocessing as mp
+import os
+import threading
+from collections import deque
+from collections.abc import Callable, Sequence
+from concurrent.futures import Executor, Future
+from dataclasses import dataclass, field
+from multiprocessing.connection import AuthenticationError, Client, Connection, Listener
+from pathlib import Path
+from typing import Any
+
+from genome_cache import CACHE_DIR, load_cached_genome, load_cached_index
+from genome_comparison import ENGINES, find_matches, seed_size_for, split_range
+
+# Environment variable holding the secret that coordinators and workers authenticate each other with
+AUTHKEY_VARIABLE = "DISTRIBUTED_AUTHKEY"
+DEFAULT_PORT = 5050
+
+# A task is tried on this many connections before its future fails
+MAX_ATTEMPTS = 3
+
+# Shards per connection for `find_matches_sharded`: enough to keep fast workers busy while slow ones finish
+SHARDS_PER_CONNECTION = 8
+
+Address = tuple[str, int]
+
+# Key of the workers `start_local_workers` forks from this process, when no shared secret is set: only they know it
+_LOCAL_AUTHKEY = os.urandom(32)
+
+
+def default_authkey() -> bytes:
+    """The shared secret from the environment, or else the key of the local workers this process starts."""
+    key = os.environ.get(AUTHKEY_VARIABLE)
+    return key.encode() if key else _LOCAL_AUTHKEY
+
+
+def parse_address(address: str) -> Address:
+    """`host:port` (or just `host`, on the default port) as a `(host, port)` pair."""
+    host, _, port = address.strip().rpartition(":")
+    if not host:
+        return port, DEFAULT_PORT
+    return host, int(port)
+
+
+def _serve_connection(connection: Connection) -> None:
+    """Run the tasks of one coordinator connection until it closes."""
+    with connection:
+        while True:
+            try:
+                function, args, kwargs = connection.recv()
+            except EOFError:
+                return
+            try:
+                reply = True, function(*args, **kwargs)
+            except Exception as e:
+                reply = False, e
+            connection.send(reply)
+
+
+def serve_listener(listener: Listener) -> None:
+    """Serve coordinator connections forever, each in a forked process of its own."""
+    context = mp.get_context("fork")
+    while True:
+        try:
+            connection = listener.accept()
+        except (AuthenticationError, EOFError, OSError) as e:
+            print(f"Rejected a connection: {e!r}")
+            continue
+        context.Process(target=_serve_connection, args=(connection,)).start()
+        connection.close()
+        mp.active_children()  # reap the processes of closed connections
+
+
+def serve(address: Address, authkey: bytes) -> None:
+    """Serve coordinators on `address`, authenticated with `authkey`, which is required whatever the interface."""
+    if not authkey:
+        raise ValueError(f"A worker runs whatever its coordinators send: set {AUTHKEY_VARIABLE} to a shared secret")
+    with Listener(address, authkey=authkey) as listener:
+        print(f"Worker listening on {listener.address[0]}:{listener.address[1]}")
+        serve_listener(listener)
+
+
+def start_local_workers(count: int, authkey: bytes | None = None) -> tuple[list[Address], list[mp.Process]]:
+    """Start `count` worker nodes on localhost, each on a free port, with `default_authkey()` unless given a key;
+    terminate the processes when done."""
+    authkey = authkey or default_authkey()
+    context = mp.get_context("fork")
+    addresses, processes = [], []
+    for _ in range(count):
+        with Listener(("127.0.0.1", 0), authkey=authkey) as listener:
+            # Not a daemon: daemonic processes can't fork the processes that serve connections
+            process = context.Process(target=serve_listener, args=(listener,))
+            process.start()
+            addresses.append(listener.address)
+            processes.append(process)
+    return addresses, processes
+
+
+@dataclass
+class _Task:
+    future: Future
+    function: Callable[..., Any]
+    args: tuple
+    kwargs: dict[str, Any]
+    attempts: int = 0
+    errors: list[str] = field(default_factory=list)
+
+
+class RemoteExecutor(Executor):
+    """Runs tasks on worker nodes, over `connections_per_worker` connections to each address, authenticated with
+    `authkey` (by default `default_authkey()`).
+
+    `initializer(*initargs)` runs once in the worker process behind every connection before its first task, like the
+    initializer of a `ProcessPoolExecutor`.
+    """
+
+    def __init__(
+        self,
+        addresses: Sequence[Address],
+        connections_per_worker: int = 1,
+        initializer: Callable[..., Any] | None = None,
+        initargs: tuple = (),
+        authkey: bytes | None = None,
+        max_attempts: int = MAX_ATTEMPTS,
+    ):
+        if not addresses:
+            raise ValueError("RemoteExecutor needs at least one worker address")
+        self.initializer, self.initargs = initializer, initargs
+        self.authkey, self.max_attempts = authkey or default_authkey(), max_attempts
+        self._condition = threading.Condition()
+        self._tasks: deque[_Task] = deque()
+        self._shutdown = False
+        self.num_connections = len(addresses) * connections_per_worker
+        self._live_connections = self.num_connections
+        self._threads = [
+            threading.Thread(target=self._run_connection, args=(tuple(address),), daemon=True)
+            for address in addresses
+            for _ in range(connections_per_worker)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, fn: Callable[..., Any], /, *args: Any, **kwargs: Any) -> Future:
+        future: Future = Future()
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError("Cannot submit tasks after shutdown")
+            if not self._live_connections:
+                raise ConnectionError("No worker is reachable")
+            self._tasks.append(_Task(future, fn, args, kwargs))
+            self._condition.notify()
+        return future
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False) -> None:
+        """Stop taking tasks; queued ones still run unless cancelled, and `wait` waits for them."""
+        with self._condition:
+            self._shutdown = True
+            if cancel_futures:
+                for task in self._tasks:
+                    # Tasks queued again after losing their worker are already running and can't be cancelled
+                    if not task.future.cancel():
+                        task.future.set_exception(ConnectionError("Cancelled after its worker was lost"))
+                self._tasks.clear()
+            self._condition.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def _next_task(self) -> _Task | None:
+        with self._condition:
+            while not self._tasks and not self._shutdown:
+                self._condition.wait()
+            return self._tasks.popleft() if self._tasks else None
+
+    def _run_connection(self, address: Address) -> None:
+        name, task = f"{address[0]}:{address[1]}", None
+        try:
+            with Client(address, authkey=self.authkey) as connection:
+                if self.initializer is not None:
+                    ok, value = self._call(connection, self.initializer, self.initargs, {})
+                    if not ok:
+                        print(f"Worker {name} failed to initialize: {value!r}")
+                        self._connection_lost(None, f"{name}: {value!r}")
+                        return
+                while (task := self._next_task()) is not None:
+                    if not task.attempts and not task.future.set_running_or_notify_cancel():
+                        task = None
+                        continue
+                    task.attempts += 1
+                    ok, value = self._call(connection, task.function, task.args, task.kwargs)
+                    if ok:
+                        task.future.set_result(value)
+                    else:
+                        task.future.set_exception(value)
+                    task = None
+        except (AuthenticationError, EOFError, OSError) as e:
+            hint = f" (is {AUTHKEY_VARIABLE} the same as on the worker?)" if isinstance(e, AuthenticationError) else ""
+            print(f"Lost worker {name}: {e!r}{hint}")
+            self._connection_lost(task, f"{name}: {e!r}")
+
+    @staticmethod
+    def _call(
+        connection: Connection, function: Callable[..., Any], args: tuple, kwargs: dict[str, Any]
+    ) -> tuple[bool, Any]:
+        """Run a function on the worker; returns whether it succeeded and its result or exception."""
+        connection.send((function, args, kwargs))
+        return connection.recv()
+
+    def _connection_lost(self, task: _Task | None, error: str) -> None:
+        with self._condition:
+            self._live_connections -= 1
+            if task is not None:
+                task.errors.append(error)
+                if task.attempts < self.max_attempts:
+                    self._tasks.appendleft(task)
+                    self._condition.notify()
+                else:
+                    task.future.set_exception(
+                        ConnectionError(f"Task failed on {task.attempts} workers: " + "; ".join(task.errors))
+                    )
+            if not self._live_connections:
+                for pending in self._tasks:
+                    if pending.attempts or pending.future.set_running_or_notify_cancel():
+                        pending.future.set_exception(ConnectionError(f"No worker left to run the task: {error}"))
+                self._tasks.clear()
+
+
+def count_shard(
+    query_path: str,
+    target_path: str,
+    cache_dir: str,
+    begin: int,
+    end: int,
+    chunk_size: int,
+    max_differences: int,
+    engine: str = "scan",
+    both_strands: bool = False,
+    num_threads: int = 1,
+    edit_distance: bool = False,
+) -> int:
+    """On a worker: count the matching query chunks that start in `[begin, end)`."""
+    query = load_cached_genome(query_path, Path(cache_dir)).packed
+    shard = query.chunk(begin, end - begin + chunk_size - 1)
+    if engine == "index":
+        target = load_cached_genome(target_path, Path(cache_dir)).packed
+        seed_size = seed_size_for(chunk_size, max_differences)
+        index = load_cached_index(target_path, seed_size, Path(cache_dir)).attach(target)
+        matching_chunks, _ = index.find_matches(
+            shard, chunk_size, max_differences, num_threads, both_strands, edit_distance
+        )
+    else:
+        target = load_cached_genome(target_path, Path(cache_dir)).packed
+        matching_chunks, _ = find_matches(
+            shard, target, chunk_size, max_differences, num_threads, both_strands, edit_distance
+        )
+    return matching_chunks
+
+
+def find_matches_sharded(
+    executor: RemoteExecutor,
+    query_path: str,
+    target_path: str,
+    query_length: int,
+    chunk_size: int,
+    max_differences: int,
+    engine: str = "scan",
+    both_strands: bool = False,
+    cache_dir: str | Path = CACHE_DIR,
+    num_threads: int = 1,
+    edit_distance: bool = False,
+) -> tuple[int, int]:
+    """`find_matches` over the worker nodes of `executor`, which each count a range of query chunks."""
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine {engine!r}, expected one of {ENGINES}")
+    total_chunks = query_length - chunk_size + 1
+    futures = [
+        executor.submit(
+            count_shard,
+            str(query_path),
+            str(target_path),
+            str(cache_dir),
+            begin,
+            end,
+            chunk_size,
+            max_differences,
+            engine,
+            both_strands,
+            num_threads,
+            edit_distance,
+        )
+        for begin, end in split_range(total_chunks, SHARDS_PER_CONNECTION * executor.num_connections)
+    ]
+    return sum(future.result() for future in futures), total_chunks
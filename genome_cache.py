@@ -0,0 +1,433 @@
+"""
+On-disk cache of encoded genomes that is used straight from a memory map.
+
+Each cache entry is a single little-endian file:
+
+    header         `_HEADER` below: magic, format version, source identity (size, mtime, content hash), section sizes
+                   and the digest of the packed bases (`bases_digest`), which keys stored results
+    contig starts  `num_contigs` int64 encoded offsets
+    gaps           `num_gaps` int64 encoded starts, then as many lengths and as many record indexes
+    contig names   `names_size` bytes of newline-separated UTF-8 names
+    encoded        `num_bases` int8 bases (one per byte), 64-byte aligned
+    packed         `ceil(num_bases / 32)` uint64 words of the same bases, 64-byte aligned
+
+Nothing has to be deserialized: `open_cached_genome` maps the file once and hands out array views into the mapping,
+so every process that opens the same entry shares the same page-cache pages.
+
+A `GenomeIndex` of an entry is kept next to it, one file per seed size, in the same spirit:
+
+    header         `_INDEX_HEADER` below: magic, format version, seed size, content hash of the source and table sizes
+    offsets        `num_offsets` int64 seed offsets, 64-byte aligned
+    positions      `num_positions` uint32 (or int64, for genomes of 2**32 bases or more) seed positions, 64-byte aligned
+
+so the processes of a node map one copy of an index rather than each building its own.
+"""
+
+import fcntl
+import glob
+import hashlib
+import os
+import struct
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import numpy.typing as npt
+
+from genome_comparison import (
+    BASES_PER_WORD,
+    ContigTable,
+    GenomeIndex,
+    PackedGenome,
+    pack_genome,
+    stream_encode_genome,
+)
+
+CACHE_DIR = Path("cache")
+CACHE_SUFFIX = ".genome"
+CACHE_MAGIC = b"HHRGENOM"
+CACHE_VERSION = 3
+INDEX_SUFFIX = ".index"
+SKETCH_SUFFIX = ".sketch"  # written by `genome_sketch`, next to the entry of the genome they sketch
+INDEX_MAGIC = b"HHRINDEX"
+INDEX_VERSION = 1
+DEFAULT_MAX_CACHE_BYTES = 64 * 2**30
+
+# magic, version, reserved, source size, source mtime_ns, source hash, num bases, num contigs, num gaps, names size,
+# encoded offset, packed offset, bases digest
+_HEADER = struct.Struct("<8sIIQq32sQQQQQQ32s")
+# magic, version, seed size, source hash, num offsets, num positions, positions item size, offsets offset,
+# positions offset
+_INDEX_HEADER = struct.Struct("<8sII32sQQQQQ")
+_MTIME_FIELD = struct.Struct("<q")
+_MTIME_OFFSET = 24
+_ALIGNMENT = 64
+_HASH_BLOCK_SIZE = 1 << 22
+
+
+class CacheFormatError(ValueError):
+    """Raised when a file is not a cache entry this version of the code can read."""
+
+
+@dataclass(frozen=True)
+class SourceIdentity:
+    size: int
+    mtime_ns: int
+    content_hash: bytes
+
+    @classmethod
+    def of(cls, source_path: Path) -> "SourceIdentity":
+        stat = source_path.stat()
+        return cls(stat.st_size, stat.st_mtime_ns, hash_file(source_path))
+
+
+def content_digest() -> "hashlib.blake2b":
+    """Running digest of a source file's contents, fed block by block; `hash_file` is its final value for a file."""
+    return hashlib.blake2b(digest_size=32)
+
+
+def hash_file(path: Path) -> bytes:
+    """BLAKE2b-256 digest of the raw (possibly compressed) file contents."""
+    digest = content_digest()
+    with path.open("rb") as f:
+        while block := f.read(_HASH_BLOCK_SIZE):
+            digest.update(block)
+    return digest.digest()
+
+
+def bases_digest(genome: PackedGenome) -> bytes:
+    """BLAKE2b-256 digest of a genome's packed bases and length: the same bases give the same digest whatever file, or
+    compression, they were read from."""
+    digest = hashlib.blake2b(digest_size=32)
+    digest.update(memoryview(np.ascontiguousarray(genome.words)).cast("B"))
+    digest.update(len(genome).to_bytes(8, "little"))
+    return digest.digest()
+
+
+def _align(offset: int) -> int:
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+
+def cache_path_for(source_path: str | Path, cache_dir: Path = CACHE_DIR) -> Path:
+    """Cache entry for a FASTA file, keyed by its resolved path."""
+    source_path = Path(source_path).resolve()
+    key = hashlib.blake2b(str(source_path).encode(), digest_size=8).hexdigest()
+    stem = source_path.name.split(".")[0]
+    return cache_dir / f"{stem}-{key}{CACHE_SUFFIX}"
+
+
+@dataclass(frozen=True, eq=False)
+class CachedGenome:
+    """Read-only views of a memory-mapped cache entry.
+
+    Pickling sends only the entry path; unpickling maps the file again in the receiving process.
+    """
+
+    path: Path
+    source: SourceIdentity
+    encoded: npt.NDArray[np.int8]
+    packed: PackedGenome
+    contigs: ContigTable
+    bases_hash: bytes  # `bases_digest(packed)`, computed when the entry was written
+
+    def attach(self) -> PackedGenome:
+        return self.packed
+
+    def __len__(self) -> int:
+        return len(self.encoded)
+
+    def __reduce__(self) -> tuple:
+        return open_cached_genome, (self.path,)
+
+
+@lru_cache(maxsize=None)
+def open_cached_genome(cache_path: Path) -> CachedGenome:
+    """Map a cache entry; each entry is mapped at most once per process."""
+    mapped = np.memmap(cache_path, dtype=np.uint8, mode="r")
+    if len(mapped) < _HEADER.size:
+        raise CacheFormatError(f"{cache_path} is too short to be a genome cache entry")
+    (
+        magic,
+        version,
+        _,
+        source_size,
+        source_mtime_ns,
+        source_hash,
+        num_bases,
+        num_contigs,
+        num_gaps,
+        names_size,
+        encoded_offset,
+        packed_offset,
+        bases_hash,
+    ) = _HEADER.unpack(mapped[: _HEADER.size].tobytes())
+    if magic != CACHE_MAGIC:
+        raise CacheFormatError(f"{cache_path} is not a genome cache entry")
+    if version != CACHE_VERSION:
+        raise CacheFormatError(f"{cache_path} has cache format version {version}, expected {CACHE_VERSION}")
+
+    num_words = (num_bases + BASES_PER_WORD - 1) // BASES_PER_WORD
+    if len(mapped) < packed_offset + num_words * 8:
+        raise CacheFormatError(f"{cache_path} is truncated")
+
+    gaps_offset = _HEADER.size + num_contigs * 8
+    names_offset = gaps_offset + 3 * num_gaps * 8
+    starts = mapped[_HEADER.size : gaps_offset].view(np.int64)
+    gap_starts, gap_lengths, gap_contigs = mapped[gaps_offset:names_offset].view(np.int64).reshape(3, num_gaps)
+    names = mapped[names_offset : names_offset + names_size].tobytes().decode()
+    contigs = ContigTable(
+        tuple(names.split("\n")) if num_contigs else (), starts, gap_starts, gap_lengths, gap_contigs
+    )
+    encoded = mapped[encoded_offset : encoded_offset + num_bases].view(np.int8)
+    words = mapped[packed_offset : packed_offset + num_words * 8].view(np.uint64)
+    source = SourceIdentity(source_size, source_mtime_ns, source_hash)
+    return CachedGenome(cache_path, source, encoded, PackedGenome(words, num_bases), contigs, bases_hash)
+
+
+def write_cached_genome(
+    cache_path: Path, source: SourceIdentity, encoded: npt.NDArray[np.int8], contigs: ContigTable
+) -> None:
+    """Write a cache entry atomically: readers see either the old entry or the complete new one."""
+    names = "\n".join(contigs.names).encode()
+    words = pack_genome(encoded)
+    gaps = np.concatenate([contigs.gap_starts, contigs.gap_lengths, contigs.gap_contigs]).astype("<i8")
+    encoded_offset = _align(_HEADER.size + len(contigs.starts) * 8 + gaps.nbytes + len(names))
+    packed_offset = _align(encoded_offset + len(encoded))
+    header = _HEADER.pack(
+        CACHE_MAGIC,
+        CACHE_VERSION,
+        0,
+        source.size,
+        source.mtime_ns,
+        source.content_hash,
+        len(encoded),
+        len(contigs.starts),
+        len(contigs.gap_starts),
+        len(names),
+        encoded_offset,
+        packed_offset,
+        bases_digest(PackedGenome(words, len(encoded))),
+    )
+
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+    with tmp_path.open("wb") as f:
+        f.write(header)
+        f.write(contigs.starts.astype("<i8").tobytes())
+        f.write(gaps.tobytes())
+        f.write(names)
+        f.seek(encoded_offset)
+        f.write(memoryview(np.ascontiguousarray(encoded)).cast("B"))
+        f.seek(packed_offset)
+        f.write(memoryview(words).cast("B"))
+    os.replace(tmp_path, cache_path)
+
+
+def _is_fresh(entry: CachedGenome, source_path: Path) -> bool:
+    stat = source_path.stat()
+    if stat.st_size != entry.source.size:
+        return False
+    if stat.st_mtime_ns == entry.source.mtime_ns:
+        return True
+    # Touched but possibly unchanged (e.g. copied or re-downloaded): fall back to the content hash, and remember the
+    # new mtime so the next lookup is cheap again
+    if hash_file(source_path) != entry.source.content_hash:
+        return False
+    with entry.path.open("r+b") as f:
+        f.seek(_MTIME_OFFSET)
+        f.write(_MTIME_FIELD.pack(stat.st_mtime_ns))
+    return True
+
+
+def invalidate(source_path: str | Path, cache_dir: Path = CACHE_DIR) -> None:
+    """Drop the cache entry of a FASTA file, if any, along with its indexes and sketches."""
+    cache_path = cache_path_for(source_path, cache_dir)
+    open_cached_genome.cache_clear()
+    open_cached_index.cache_clear()
+    cache_path.unlink(missing_ok=True)
+    for path in cache_dir.glob(f"{glob.escape(cache_path.stem)}.*"):
+        path.unlink(missing_ok=True)
+
+
+def evict(
+    cache_dir: Path = CACHE_DIR, max_bytes: int = DEFAULT_MAX_CACHE_BYTES, keep: tuple[Path, ...] = ()
+) -> list[Path]:
+    """Delete least recently used entries, indexes and sketches until the cache fits in `max_bytes`, never deleting
+    `keep`.
+
+    Entries still mapped by a running process stay readable after deletion; their space is freed once it unmaps them.
+    """
+    entries = sorted(
+        (path for suffix in (CACHE_SUFFIX, INDEX_SUFFIX, SKETCH_SUFFIX) for path in cache_dir.glob(f"*{suffix}")),
+        key=lambda path: path.stat().st_mtime,
+    )
+    total = sum(path.stat().st_size for path in entries)
+    kept = {path.resolve() for path in keep}
+    evicted = []
+    for path in entries:
+        if total <= max_bytes:
+            break
+        if path.resolve() in kept:
+            continue
+        total -= path.stat().st_size
+        path.unlink(missing_ok=True)
+        evicted.append(path)
+    return evicted
+
+
+def load_cached_genome(
+    source_path: str | Path, cache_dir: Path = CACHE_DIR, max_cache_bytes: int = DEFAULT_MAX_CACHE_BYTES
+) -> CachedGenome:
+    """Open the cache entry of a FASTA file, encoding the file into a new entry if it is missing or stale."""
+    source_path = Path(source_path)
+    cache_path = cache_path_for(source_path, cache_dir)
+    if cache_path.exists():
+        try:
+            entry = open_cached_genome(cache_path)
+            if _is_fresh(entry, source_path):
+                os.utime(cache_path)  # entry mtime doubles as its last-use time for eviction
+                if entry.source.mtime_ns != source_path.stat().st_mtime_ns:
+                    open_cached_genome.cache_clear()
+                    return open_cached_genome(cache_path)
+                return entry
+            print(f"Cached genome for {source_path} is stale, re-encoding")
+        except CacheFormatError as e:
+            print(f"Ignoring unreadable cache entry: {e}")
+        open_cached_genome.cache_clear()
+
+    source = SourceIdentity.of(source_path)
+    encoded, contigs, stats = stream_encode_genome(str(source_path))
+    print(f"Encoded {source_path}: {stats}")
+    write_cached_genome(cache_path, source, encoded, contigs)
+    del encoded
+    evict(cache_dir, max_cache_bytes, keep=(cache_path,))
+    return open_cached_genome(cache_path)
+
+
+def index_path_for(source_path: str | Path, cache_dir: Path, seed_size: int) -> Path:
+    """Index file of a FASTA file, next to its genome cache entry."""
+    entry = cache_path_for(source_path, cache_dir)
+    return entry.with_name(f"{entry.stem}.seed{seed_size}{INDEX_SUFFIX}")
+
+
+@dataclass(frozen=True, eq=False)
+class CachedIndex:
+    """Read-only views of the tables of a memory-mapped index file.
+
+    Pickling sends only the file path; unpickling maps the file again in the receiving process.
+    """
+
+    path: Path
+    source_hash: bytes
+    offsets: npt.NDArray[np.int64]
+    positions: npt.NDArray[np.uint32]
+    seed_size: int
+
+    def attach(self, genome: PackedGenome) -> GenomeIndex:
+        return GenomeIndex(genome, self.offsets, self.positions, self.seed_size)
+
+    def __reduce__(self) -> tuple:
+        return open_cached_index, (self.path,)
+
+
+def write_cached_index(index_path: Path, source_hash: bytes, index: GenomeIndex) -> None:
+    """Write an index file atomically."""
+    offsets_offset = _align(_INDEX_HEADER.size)
+    positions_offset = _align(offsets_offset + index.offsets.nbytes)
+    header = _INDEX_HEADER.pack(
+        INDEX_MAGIC,
+        INDEX_VERSION,
+        index.seed_size,
+        source_hash,
+        len(index.offsets),
+        len(index.positions),
+        index.positions.itemsize,
+        offsets_offset,
+        positions_offset,
+    )
+    index_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = index_path.with_name(f"{index_path.name}.{os.getpid()}.tmp")
+    with tmp_path.open("wb") as f:
+        f.write(header)
+        f.seek(offsets_offset)
+        f.write(memoryview(np.ascontiguousarray(index.offsets, dtype="<i8")).cast("B"))
+        f.seek(positions_offset)
+        f.write(memoryview(np.ascontiguousarray(index.positions)).cast("B"))
+    os.replace(tmp_path, index_path)
+
+
+@lru_cache(maxsize=None)
+def open_cached_index(index_path: Path) -> CachedIndex:
+    """Map an index file; each file is mapped at most once per process."""
+    mapped = np.memmap(index_path, dtype=np.uint8, mode="r")
+    if len(mapped) < _INDEX_HEADER.size:
+        raise CacheFormatError(f"{index_path} is too short to be a genome index")
+    (
+        magic,
+        version,
+        seed_size,
+        source_hash,
+        num_offsets,
+        num_positions,
+        positions_itemsize,
+        offsets_offset,
+        positions_offset,
+    ) = _INDEX_HEADER.unpack(mapped[: _INDEX_HEADER.size].tobytes())
+    if magic != INDEX_MAGIC:
+        raise CacheFormatError(f"{index_path} is not a genome index")
+    if version != INDEX_VERSION:
+        raise CacheFormatError(f"{index_path} has index format version {version}, expected {INDEX_VERSION}")
+    if len(mapped) < positions_offset + num_positions * positions_itemsize:
+        raise CacheFormatError(f"{index_path} is truncated")
+
+    offsets = mapped[offsets_offset : offsets_offset + num_offsets * 8].view(np.int64)
+    positions_dtype = np.uint32 if positions_itemsize == 4 else np.int64
+    positions = mapped[positions_offset : positions_offset + num_positions * positions_itemsize].view(positions_dtype)
+    return CachedIndex(index_path, source_hash, offsets, positions, seed_size)
+
+
+@contextmanager
+def _exclusive(path: Path) -> Iterator[None]:
+    """Hold an exclusive lock on `path` (created if needed), across processes."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def load_cached_index(
+    source_path: str | Path,
+    seed_size: int,
+    cache_dir: Path = CACHE_DIR,
+    max_cache_bytes: int = DEFAULT_MAX_CACHE_BYTES,
+) -> CachedIndex:
+    """Map the index of a FASTA file's cache entry, building it into a new index file if it is missing or was built
+    from other contents. Concurrent callers wait for the one that builds it, so a node builds each index once."""
+    entry = load_cached_genome(source_path, cache_dir, max_cache_bytes)
+    index_path = index_path_for(source_path, cache_dir, seed_size)
+    with _exclusive(index_path.with_name(f"{index_path.name}.lock")):
+        if index_path.exists():
+            try:
+                cached = open_cached_index(index_path)
+                if cached.source_hash != entry.source.content_hash:
+                    # The file may have been rebuilt by another process since this one mapped it
+                    open_cached_index.cache_clear()
+                    cached = open_cached_index(index_path)
+                if cached.source_hash == entry.source.content_hash:
+                    os.utime(index_path)
+                    return cached
+                print(f"Cached index for {source_path} is stale, rebuilding")
+            except CacheFormatError as e:
+                print(f"Ignoring unreadable index: {e}")
+            open_cached_index.cache_clear()
+        index = GenomeIndex.build(entry.packed, seed_size)
+        write_cached_index(index_path, entry.source.content_hash, index)
+        del index
+    evict(cache_dir, max_cache_bytes, keep=(entry.path, index_path))
+    return open_cached_index(index_path)
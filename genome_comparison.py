@@ -1,14 +1,55 @@
+import gzip
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import cached_property
 from pathlib import Path
+from time import perf_counter
+from typing import Any, BinaryIO
 
 import numpy as np
 import numpy.typing as npt
 from numba import njit
 
+# Every kernel is compiled lazily and cached in __pycache__ (`cache=True`), so processes after the first, including
+# every simulation worker, load the machine code from disk instead of compiling it again. Lazy dispatch rather than
+# explicit signatures, because kernels see both writable (shared memory) and read-only (memory-mapped) arrays.
+
 # Constants for 2-bit encoding
 A, C, G, T = 0, 1, 2, 3
 
+# Matching engines: "scan" slides every chunk across the whole target, "index" looks seeds up in a `GenomeIndex`
+ENGINES = ("scan", "index")
+
+# With `edit_distance`, `max_differences` counts substitutions, insertions and deletions rather than only substitutions:
+# a chunk matches where some substring of the target is that many edits away from it. The edit kernels keep a whole
+# column of the alignment matrix in one word (Myers' bit-parallel algorithm), so chunks are at most this long
+MAX_EDIT_CHUNK_SIZE = 64
+
+# 4**12 buckets keeps the offsets table at 128 MB while leaving ~180 hits per bucket on a 3 Gbp target
+MAX_SEED_SIZE = 12
+
+# FASTA input is decoded in blocks of this many bytes
+DEFAULT_BLOCK_SIZE = 1 << 22
+GZIP_MAGIC = b"\x1f\x8b"
+
+# Byte-to-base lookup used by the streaming reader; everything other than A/C/G/T (N, newlines, ...) maps to -1
+_ENCODE_TABLE = np.full(256, -1, dtype=np.int8)
+for _code, _letters in enumerate((b"Aa", b"Cc", b"Gg", b"Tt")):
+    _ENCODE_TABLE[list(_letters)] = _code
 
-@njit(nogil=True, nopython=True)
+# Threads scanning slices of one target check whether another thread already found a match this often
+_STOP_CHECK_INTERVAL = 4096
+
+# Packed genomes hold 32 bases per uint64 word, two bits per base
+BASES_PER_WORD = 32
+_LOW_LANE_BITS = np.uint64(0x5555555555555555)
+_M2 = np.uint64(0x3333333333333333)
+_M4 = np.uint64(0x0F0F0F0F0F0F0F0F)
+_H01 = np.uint64(0x0101010101010101)
+
+
+@njit(nogil=True, nopython=True, cache=True)
 def encode_base(base: int) -> int:
     if base == 65 or base == 97:  # 'A' or 'a'
         return A
@@ -21,16 +62,244 @@ def encode_base(base: int) -> int:
     return -1  # For 'N' or any other character
 
 
-def read_and_encode_genome(file_path: str) -> npt.NDArray[np.int8]:
-    """Read a genome from a FASTA file and encode it as a 2-bit representation."""
-    with Path(file_path).open("rb") as f:
-        genome = b"".join(line.strip() for line in f if not line.startswith(b">"))
+@dataclass(frozen=True)
+class ReadStats:
+    """Throughput of one `stream_encode_genome` call, split into time spent reading and time spent encoding."""
+
+    source_bytes: int
+    bases: int
+    read_seconds: float
+    encode_seconds: float
+
+    @property
+    def seconds(self) -> float:
+        return self.read_seconds + self.encode_seconds
+
+    @property
+    def bases_per_second(self) -> float:
+        return self.bases / self.seconds if self.seconds else 0.0
+
+    def __str__(self) -> str:
+        read_share = self.read_seconds / self.seconds * 100 if self.seconds else 0.0
+        return (
+            f"{self.bases:,} bases from {self.source_bytes / 1e6:,.1f} MB in {self.seconds:.2f}s "
+            f"({self.bases_per_second / 1e6:,.1f} Mbases/s, {read_share:.0f}% reading)"
+        )
+
+
+def open_fasta(file_path: str) -> BinaryIO:
+    """Open a FASTA file for reading, transparently decompressing gzip and bgzip input."""
+    path = Path(file_path)
+    with path.open("rb") as f:
+        magic = f.read(len(GZIP_MAGIC))
+    return gzip.open(path, "rb") if magic == GZIP_MAGIC else path.open("rb")
+
+
+def _empty_positions() -> npt.NDArray[np.int64]:
+    return np.empty(0, dtype=np.int64)
+
+
+@dataclass(frozen=True, eq=False)
+class ContigTable:
+    """Names of a genome's FASTA records and the encoded offset at which each record starts, plus the gaps: runs of
+    `N`s (or any other non-ACGT letters) that the encoding drops. Gap `g` held `gap_lengths[g]` letters of record
+    `gap_contigs[g]` (-1 before the first header) just before encoded position `gap_starts[g]`."""
+
+    names: tuple[str, ...]
+    starts: npt.NDArray[np.int64]
+    gap_starts: npt.NDArray[np.int64] = field(default_factory=_empty_positions)
+    gap_lengths: npt.NDArray[np.int64] = field(default_factory=_empty_positions)
+    gap_contigs: npt.NDArray[np.int64] = field(default_factory=_empty_positions)
 
-    encoded = np.frombuffer(genome, dtype=np.int8)
-    return _encode_genome(encoded)
+    def contig_at(self, position: int) -> int:
+        """Index of the record containing encoded position `position`, or -1 before the first header."""
+        return int(np.searchsorted(self.starts, position, side="right")) - 1
+
+    @cached_property
+    def breaks(self) -> npt.NDArray[np.int64]:
+        """Encoded positions whose base doesn't follow the previous encoded base in the FASTA file: record starts and
+        ends of gaps."""
+        return np.union1d(self.starts, self.gap_starts)
+
+    def contiguous(self, starts: npt.NDArray[np.int64], chunk_size: int) -> npt.NDArray[np.bool_]:
+        """Whether each chunk starting at an encoded position in `starts` lies within one record and no gap."""
+        breaks = self.breaks
+        return np.searchsorted(breaks, starts, side="right") == np.searchsorted(breaks, starts + chunk_size)
+
+    def contig_gaps(self, contig: int) -> tuple[npt.NDArray[np.int64], npt.NDArray[np.int64]]:
+        """Offsets within the record (counting gap letters) at which the gaps of record `contig` start, and their
+        lengths."""
+        # Gaps are in file order, so those of a record are consecutive
+        begin, end = np.searchsorted(self.gap_contigs, [contig, contig + 1])
+        lengths = self.gap_lengths[begin:end]
+        before = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+        return self.gap_starts[begin:end] - self.starts[contig] + before, lengths
+
+    def to_encoded(self, contig: int, offsets: npt.NDArray[np.int64]) -> npt.NDArray[np.int64]:
+        """Encoded positions of offsets within record `contig` as it appears in the FASTA file, gap letters included;
+        an offset inside a gap maps to the first base after it."""
+        gap_offsets, gap_lengths = self.contig_gaps(contig)
+        if not len(gap_offsets):
+            return self.starts[contig] + offsets
+        # Every letter of the gaps starting at or before an offset was dropped, except those of a gap the offset is in
+        # that come after it
+        num_gaps = np.searchsorted(gap_offsets, offsets, side="right")
+        dropped = np.concatenate([[0], np.cumsum(gap_lengths)])[num_gaps]
+        last = np.maximum(num_gaps - 1, 0)
+        dropped -= np.where(num_gaps > 0, np.maximum(gap_offsets[last] + gap_lengths[last] - offsets, 0), 0)
+        return self.starts[contig] + offsets - dropped
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+
+@njit(nogil=True, nopython=True, cache=True)
+def _encode_block(
+    block: npt.NDArray[np.uint8],
+    encoded: npt.NDArray[np.int8],
+    length: int,
+    in_header: bool,
+    gap_length: int,
+    contig: int,
+    header_bytes: npt.NDArray[np.uint8],
+    contig_starts: npt.NDArray[np.int64],
+    gaps: npt.NDArray[np.int64],
+) -> tuple[int, bool, int, int, int, int]:
+    """Encode one block, carrying the header and open-gap state over from the previous one; every gap closed in the
+    block is written to a row of `gaps` as (encoded start, length, record)."""
+    num_header_bytes = 0
+    num_contigs = 0
+    num_gaps = 0
+    for byte in block:
+        if in_header:
+            in_header = byte != 10  # a header runs to the end of its line
+            if in_header and byte != 13:
+                header_bytes[num_header_bytes] = byte
+                num_header_bytes += 1
+        elif byte == 62:  # '>'
+            if gap_length:
+                gaps[num_gaps, 0], gaps[num_gaps, 1], gaps[num_gaps, 2] = length, gap_length, contig
+                num_gaps += 1
+                gap_length = 0
+            in_header = True
+            header_bytes[num_header_bytes] = 10  # separates consecutive headers
+            num_header_bytes += 1
+            contig_starts[num_contigs] = length
+            num_contigs += 1
+            contig += 1
+        else:
+            code = _ENCODE_TABLE[byte]
+            if code >= 0:
+                if gap_length:
+                    gaps[num_gaps, 0], gaps[num_gaps, 1], gaps[num_gaps, 2] = length, gap_length, contig
+                    num_gaps += 1
+                    gap_length = 0
+                encoded[length] = code
+                length += 1
+            elif byte > 32:  # N or another non-ACGT letter, rather than whitespace
+                gap_length += 1
+    return length, in_header, num_header_bytes, num_contigs, gap_length, num_gaps
+
+
+class GenomeEncoder:
+    """Incremental form of `stream_encode_genome`: encodes the bytes of a FASTA file as they are fed to it, whatever
+    they come from (a file, a decompressor, a download).
+
+    The buffer starts at `capacity` bases and grows geometrically, so with a good estimate of the genome size peak
+    memory stays close to the size of the encoded genome.
+    """
+
+    def __init__(self, capacity: int = 0, block_size: int = DEFAULT_BLOCK_SIZE):
+        self.block_size = block_size
+        self.encode_seconds = 0.0
+        self._encoded = np.empty(capacity, dtype=np.int8)
+        self._block_headers = np.empty(block_size, dtype=np.uint8)
+        self._block_contig_starts = np.empty(block_size // 2 + 1, dtype=np.int64)
+        self._block_gaps = np.empty((block_size // 2 + 1, 3), dtype=np.int64)
+        self._headers = bytearray()
+        self._contig_starts: list[int] = []
+        self._gaps: list[npt.NDArray[np.int64]] = []
+        self._length, self._in_header, self._gap_length = 0, False, 0
+
+    def feed(self, data: bytes | bytearray | memoryview) -> None:
+        """Encode the next bytes of the file."""
+        data = np.frombuffer(data, dtype=np.uint8)
+        for offset in range(0, len(data), self.block_size):
+            self._encode_block(data[offset : offset + self.block_size])
+
+    def _encode_block(self, block: npt.NDArray[np.uint8]) -> None:
+        if self._length + len(block) > len(self._encoded):
+            grown = np.empty(max(len(self._encoded) * 3 // 2, self._length + len(block)), dtype=np.int8)
+            grown[: self._length] = self._encoded[: self._length]
+            self._encoded = grown
+        start = perf_counter()
+        self._length, self._in_header, num_header_bytes, num_contigs, self._gap_length, num_gaps = _encode_block(
+            block,
+            self._encoded,
+            self._length,
+            self._in_header,
+            self._gap_length,
+            len(self._contig_starts) - 1,
+            self._block_headers,
+            self._block_contig_starts,
+            self._block_gaps,
+        )
+        self._headers += self._block_headers[:num_header_bytes].tobytes()
+        self._contig_starts.extend(self._block_contig_starts[:num_contigs].tolist())
+        self._gaps.append(self._block_gaps[:num_gaps].copy())
+        self.encode_seconds += perf_counter() - start
+
+    def finish(
+        self, source_bytes: int, read_seconds: float = 0.0
+    ) -> tuple[npt.NDArray[np.int8], ContigTable, ReadStats]:
+        """The encoded genome and its records, once every byte has been fed; `source_bytes` and `read_seconds` describe
+        the input for the stats."""
+        gaps = self._gaps
+        if self._gap_length:
+            gaps.append(np.array([[self._length, self._gap_length, len(self._contig_starts) - 1]], dtype=np.int64))
+        # Keep the buffer unless trimming would free a sizeable amount of it
+        length, encoded = self._length, self._encoded
+        genome = encoded[:length] if length >= len(encoded) * 7 // 8 else encoded[:length].copy()
+        names = tuple(
+            (header.split(maxsplit=1) or [b""])[0].decode(errors="replace") for header in self._headers.split(b"\n")[1:]
+        )
+        gaps = np.concatenate(gaps) if gaps else np.empty((0, 3), dtype=np.int64)
+        contigs = ContigTable(
+            names, np.array(self._contig_starts, dtype=np.int64), *(gaps[:, i].copy() for i in range(3))
+        )
+        return genome, contigs, ReadStats(source_bytes, length, read_seconds, self.encode_seconds)
+
+
+def stream_encode_genome(
+    file_path: str, block_size: int = DEFAULT_BLOCK_SIZE
+) -> tuple[npt.NDArray[np.int8], ContigTable, ReadStats]:
+    """Decode a plain or gzipped FASTA file block by block straight into an encoded genome buffer.
+
+    Plain files are decoded into a buffer the size of the file. Compressed files start from an estimate of the
+    decompressed size and grow the buffer geometrically, so peak memory stays close to the size of the encoded genome.
+    """
+    source_bytes = Path(file_path).stat().st_size
+    with open_fasta(file_path) as f:
+        encoder = GenomeEncoder(source_bytes * 4 if isinstance(f, gzip.GzipFile) else source_bytes, block_size)
+        block = bytearray(block_size)
+        read_seconds = 0.0
+        while True:
+            start = perf_counter()
+            num_read = f.readinto(block)
+            read_seconds += perf_counter() - start
+            if not num_read:
+                break
+            encoder.feed(memoryview(block)[:num_read])
+    return encoder.finish(source_bytes, read_seconds)
+
+
+def read_and_encode_genome(file_path: str) -> npt.NDArray[np.int8]:
+    """Read a genome from a plain or gzipped FASTA file and encode it as a 2-bit representation."""
+    genome, _, _ = stream_encode_genome(file_path)
+    return genome
 
 
-@njit(nogil=True, nopython=True)
+@njit(nogil=True, nopython=True, cache=True)
 def _encode_genome(genome: npt.NDArray[np.int8]) -> npt.NDArray[np.int8]:
     encoded = np.empty(genome.shape, dtype=np.int8)
     for i in range(len(genome)):
@@ -38,28 +307,843 @@ def _encode_genome(genome: npt.NDArray[np.int8]) -> npt.NDArray[np.int8]:
     return encoded[encoded != -1]
 
 
-@njit(nogil=True, nopython=True)
-def compare_chunk(chunk: npt.NDArray[np.int8], target_genome: npt.NDArray[np.int8], max_differences: int) -> bool:
-    """Check if the chunk matches anywhere in the target genome using bitwise XOR."""
+@njit(nogil=True, nopython=True, cache=True)
+def pack_genome_into(genome: npt.NDArray[np.int8], words: npt.NDArray[np.uint64]) -> None:
+    """Pack an encoded genome into a caller-provided buffer (e.g. shared memory) of `ceil(len(genome) / 32)` words."""
+    words[:] = 0
+    for i in range(len(genome)):
+        words[i >> 5] |= np.uint64(genome[i]) << np.uint64((i & 31) * 2)
+
+
+@njit(nogil=True, nopython=True, cache=True)
+def pack_genome(genome: npt.NDArray[np.int8]) -> npt.NDArray[np.uint64]:
+    """Pack an encoded genome 32 bases per word, base `i` in bits `2 * (i % 32)` of word `i // 32`."""
+    words = np.empty((len(genome) + BASES_PER_WORD - 1) // BASES_PER_WORD, dtype=np.uint64)
+    pack_genome_into(genome, words)
+    return words
+
+
+@njit(nogil=True, nopython=True, cache=True)
+def _unpack_genome(words: npt.NDArray[np.uint64], length: int) -> npt.NDArray[np.int8]:
+    genome = np.empty(length, dtype=np.int8)
+    for i in range(length):
+        genome[i] = np.int8((words[i >> 5] >> np.uint64((i & 31) * 2)) & np.uint64(3))
+    return genome
+
+
+@njit(nogil=True, nopython=True, cache=True)
+def _reverse_complement_words(words: npt.NDArray[np.uint64], length: int) -> npt.NDArray[np.uint64]:
+    """Pack the reverse complement of the first `length` bases; complementing a 2-bit base is XOR with 3 (A-T, C-G)."""
+    result = np.zeros((length + BASES_PER_WORD - 1) // BASES_PER_WORD, dtype=np.uint64)
+    for i in range(length):
+        j = length - 1 - i
+        base = (words[j >> 5] >> np.uint64((j & 31) * 2)) & np.uint64(3)
+        result[i >> 5] |= (base ^ np.uint64(3)) << np.uint64((i & 31) * 2)
+    return result
+
+
+@njit(nogil=True, nopython=True, cache=True)
+def _strand_words(chunk_words: npt.NDArray[np.uint64], chunk_size: int, both_strands: bool) -> npt.NDArray[np.uint64]:
+    """One row of packed words per strand to search: the chunk, then its reverse complement if `both_strands`.
+
+    A chunk lies on the reverse strand of the target exactly where its reverse complement lies on the forward strand,
+    so comparing both rows against the same forward windows covers both strands in one pass.
+    """
+    strands = np.empty((2 if both_strands else 1, len(chunk_words)), dtype=np.uint64)
+    strands[0] = chunk_words
+    if both_strands:
+        strands[1] = _reverse_complement_words(chunk_words, chunk_size)
+    return strands
+
+
+@njit(nogil=True, nopython=True, cache=True)
+def _window(words: npt.NDArray[np.uint64], start: int, num_bases: int) -> np.uint64:
+    """Read up to 32 bases starting at base `start` as a single word, first base in the lowest bits."""
+    q = start >> 5
+    shift = (start & 31) * 2
+    value = words[q] >> np.uint64(shift)
+    if shift != 0 and q + 1 < len(words):
+        value |= words[q + 1] << np.uint64(64 - shift)
+    if num_bases < BASES_PER_WORD:
+        value &= (np.uint64(1) << np.uint64(2 * num_bases)) - np.uint64(1)
+    return value
+
+
+@njit(nogil=True, nopython=True, cache=True)
+def _chunk_words(words: npt.NDArray[np.uint64], start: int, size: int) -> npt.NDArray[np.uint64]:
+    chunk = np.empty((size + BASES_PER_WORD - 1) // BASES_PER_WORD, dtype=np.uint64)
+    for w in range(len(chunk)):
+        chunk[w] = _window(words, start + w * BASES_PER_WORD, min(BASES_PER_WORD, size - w * BASES_PER_WORD))
+    return chunk
+
+
+@njit(nogil=True, nopython=True, cache=True)
+def _popcount(x: np.uint64) -> int:
+    x = x - ((x >> np.uint64(1)) & _LOW_LANE_BITS)
+    x = (x & _M2) + ((x >> np.uint64(2)) & _M2)
+    x = (x + (x >> np.uint64(4))) & _M4
+    return np.int64((x * _H01) >> np.uint64(56))
+
+
+@njit(nogil=True, nopython=True, cache=True)
+def _differing_bases(a: np.uint64, b: np.uint64) -> int:
+    """Count the 2-bit lanes that differ: XOR, fold each lane onto its low bit, popcount."""
+    x = a ^ b
+    return _popcount((x | (x >> np.uint64(1))) & _LOW_LANE_BITS)
+
+
+@njit(nogil=True, nopython=True, cache=True)
+def _distance_packed(
+    chunk_words: npt.NDArray[np.uint64],
+    chunk_size: int,
+    words: npt.NDArray[np.uint64],
+    start: int,
+    max_differences: int,
+) -> int:
+    """Hamming distance between the chunk and the target window at `start`, giving up once it exceeds the limit."""
+    differences = 0
+    for w in range(len(chunk_words)):
+        num_bases = min(BASES_PER_WORD, chunk_size - w * BASES_PER_WORD)
+        differences += _differing_bases(chunk_words[w], _window(words, start + w * BASES_PER_WORD, num_bases))
+        if differences > max_differences:
+            break
+    return differences
+
+
+@njit(nogil=True, nopython=True, cache=True)
+def _within_distance_packed(
+    chunk_words: npt.NDArray[np.uint64],
+    chunk_size: int,
+    words: npt.NDArray[np.uint64],
+    start: int,
+    max_differences: int,
+) -> bool:
+    return _distance_packed(chunk_words, chunk_size, words, start, max_differences) <= max_differences
+
+
+@njit(nogil=True, nopython=True, cache=True)
+def _pattern_masks(chunk_words: npt.NDArray[np.uint64], chunk_size: int) -> npt.NDArray[np.uint64]:
+    """Bit `j` of mask `b` is set when base `j` of the chunk is `b`."""
+    masks = np.zeros(4, dtype=np.uint64)
+    for j in range(chunk_size):
+        base = (chunk_words[j >> 5] >> np.uint64((j & 31) * 2)) & np.uint64(3)
+        masks[base] |= np.uint64(1) << np.uint64(j)
+    return masks
+
+
+@njit(nogil=True, nopython=True, cache=True)
+def _strand_masks(strand_words: npt.NDArray[np.uint64], chunk_size: int) -> npt.NDArray[np.uint64]:
+    """`_pattern_masks` of every row of `strand_words`."""
+    masks = np.empty((strand_words.shape[0], 4), dtype=np.uint64)
+    for s in range(strand_words.shape[0]):
+        masks[s] = _pattern_masks(strand_words[s], chunk_size)
+    return masks
+
+
+@njit(nogil=True, nopython=True, cache=True)
+def _edit_step(
+    match_mask: np.uint64, vertical_plus: np.uint64, vertical_minus: np.uint64, score: int, last_bit: np.uint64
+) -> tuple[np.uint64, np.uint64, int]:
+    """Advance Myers' search by one target base, given the chunk positions that hold that base.
+
+    The column of edit distances between every chunk prefix and the best substring ending at the current target base
+    is kept as its vertical deltas, +1 and -1 bit vectors; `score` is the distance of the whole chunk. Every new column
+    starts from 0, so a match may start anywhere in the target.
+    """
+    xv = match_mask | vertical_minus
+    xh = (((match_mask & vertical_plus) + vertical_plus) ^ vertical_plus) | match_mask
+    horizontal_plus = vertical_minus | ~(xh | vertical_plus)
+    horizontal_minus = vertical_plus & xh
+    if horizontal_plus & last_bit:
+        score += 1
+    elif horizontal_minus & last_bit:
+        score -= 1
+    horizontal_plus <<= np.uint64(1)
+    horizontal_minus <<= np.uint64(1)
+    return horizontal_minus | ~(xv | horizontal_plus), horizontal_plus & xv, score
+
+
+@njit(nogil=True, nopython=True, cache=True)
+def _band_edit_distance(
+    masks: npt.NDArray[np.uint64],
+    chunk_size: int,
+    words: npt.NDArray[np.uint64],
+    begin: int,
+    end: int,
+    max_differences: int,
+) -> int:
+    """Fewest edits between the chunk (as `_pattern_masks`) and any substring of target bases `[begin, end)`; any
+    result above `max_differences` only means that there is no closer substring."""
+    last_bit = np.uint64(1) << np.uint64(chunk_size - 1)
+    vertical_plus, vertical_minus = ~np.uint64(0), np.uint64(0)
+    score = best = chunk_size
+    for i in range(begin, end):
+        base = (words[i >> 5] >> np.uint64((i & 31) * 2)) & np.uint64(3)
+        vertical_plus, vertical_minus, score = _edit_step(masks[base], vertical_plus, vertical_minus, score, last_bit)
+        if score < best:
+            best = score
+            if best == 0:
+                break
+        # The score drops by at most one per base, so give up once the rest of the band can't bring it within the limit
+        if score - (end - 1 - i) > max_differences:
+            break
+    return best
+
+
+@njit(nogil=True, nopython=True, cache=True)
+def _edit_scan_slice(
+    strand_masks: npt.NDArray[np.uint64],
+    chunk_size: int,
+    words: npt.NDArray[np.uint64],
+    max_differences: int,
+    begin: int,
+    end: int,
+    stop: npt.NDArray[np.uint8],
+) -> bool:
+    """Edit-distance counterpart of `_compare_slice_packed` over matches that end at target bases `[begin, end)`, for
+    every row of `strand_masks` (see `_strand_masks`); raises `stop[0]` on a match and gives up once it is set."""
+    if end <= begin:
+        return False
+    if max_differences >= chunk_size:
+        stop[0] = 1
+        return True
+    num_strands = strand_masks.shape[0]
+    last_bit = np.uint64(1) << np.uint64(chunk_size - 1)
+    vertical_plus = np.full(num_strands, ~np.uint64(0), dtype=np.uint64)
+    vertical_minus = np.zeros(num_strands, dtype=np.uint64)
+    scores = np.full(num_strands, chunk_size, dtype=np.int64)
+    # Matches span at most `chunk_size + max_differences` bases; starting that far back catches those ending at `begin`
+    first = max(begin - chunk_size - max_differences, 0)
+    for i in range(first, end):
+        if (i - first) % _STOP_CHECK_INTERVAL == 0 and i > first and stop[0]:
+            return False
+        base = (words[i >> 5] >> np.uint64((i & 31) * 2)) & np.uint64(3)
+        for s in range(num_strands):
+            vertical_plus[s], vertical_minus[s], scores[s] = _edit_step(
+                strand_masks[s, base], vertical_plus[s], vertical_minus[s], scores[s], last_bit
+            )
+            if scores[s] <= max_differences:
+                stop[0] = 1
+                return True
+    return False
+
+
+def _check_edit_chunk_size(chunk_size: int) -> None:
+    if chunk_size > MAX_EDIT_CHUNK_SIZE:
+        raise ValueError(f"Edit distance supports chunks of at most {MAX_EDIT_CHUNK_SIZE} bases, got {chunk_size}")
+
+
+@dataclass(frozen=True, eq=False)
+class PackedGenome:
+    """Encoded genome packed 32 bases per `uint64` word; `length` is the number of bases."""
+
+    words: npt.NDArray[np.uint64]
+    length: int
+
+    @classmethod
+    def from_encoded(cls, genome: npt.NDArray[np.int8]) -> "PackedGenome":
+        return cls(pack_genome(genome), len(genome))
+
+    def unpack(self) -> npt.NDArray[np.int8]:
+        return _unpack_genome(self.words, self.length)
+
+    def chunk(self, start: int, size: int) -> "PackedGenome":
+        return PackedGenome(_chunk_words(self.words, start, size), size)
+
+    def reverse_complement(self) -> "PackedGenome":
+        return PackedGenome(_reverse_complement_words(self.words, self.length), self.length)
+
+    def __len__(self) -> int:
+        return self.length
+
+
+Genome = npt.NDArray[np.int8] | PackedGenome
+
+
+def _as_packed(genome: Genome) -> PackedGenome:
+    return genome if isinstance(genome, PackedGenome) else PackedGenome.from_encoded(genome)
+
+
+@njit(nogil=True, nopython=True, cache=True)
+def _within_distance(
+    chunk: npt.NDArray[np.int8], target_genome: npt.NDArray[np.int8], start: int, max_differences: int
+) -> bool:
+    differences = 0
+    for j in range(len(chunk)):
+        if chunk[j] != target_genome[start + j]:
+            differences += 1
+            if differences > max_differences:
+                return False
+    return True
+
+
+@njit(nogil=True, nopython=True, cache=True)
+def _compare_chunk(chunk: npt.NDArray[np.int8], target_genome: npt.NDArray[np.int8], max_differences: int) -> bool:
     chunk_size = len(chunk)
     for i in range(len(target_genome) - chunk_size + 1):
-        differences = np.sum(chunk != target_genome[i : i + chunk_size])
-        if differences <= max_differences:
+        if _within_distance(chunk, target_genome, i, max_differences):
             return True
     return False
 
 
-@njit(nogil=True, nopython=True)
-def find_matches(
+@njit(nogil=True, nopython=True, cache=True)
+def _compare_slice_packed(
+    strand_words: npt.NDArray[np.uint64],
+    chunk_size: int,
+    words: npt.NDArray[np.uint64],
+    max_differences: int,
+    begin: int,
+    end: int,
+    stop: npt.NDArray[np.uint8],
+) -> bool:
+    """Check the target windows starting in `[begin, end)` against every row of `strand_words` (see `_strand_words`);
+    raises `stop[0]` on a match and gives up once it is set."""
+    if end <= begin:
+        return False
+    # Slide one rolling register per chunk word across the target: each step shifts out a base and shifts in the next
+    num_strands, num_words = strand_words.shape
+    top_shifts = np.empty(num_words, dtype=np.uint64)
+    windows = np.empty(num_words, dtype=np.uint64)
+    for w in range(num_words):
+        num_bases = min(BASES_PER_WORD, chunk_size - w * BASES_PER_WORD)
+        top_shifts[w] = 2 * (num_bases - 1)
+        windows[w] = _window(words, begin + w * BASES_PER_WORD, num_bases)
+
+    for i in range(begin, end):
+        if i > begin:
+            for w in range(num_words):
+                last = i + w * BASES_PER_WORD + np.int64(top_shifts[w] >> np.uint64(1))
+                base = (words[last >> 5] >> np.uint64((last & 31) * 2)) & np.uint64(3)
+                windows[w] = (windows[w] >> np.uint64(2)) | (base << top_shifts[w])
+            if (i - begin) % _STOP_CHECK_INTERVAL == 0 and stop[0]:
+                return False
+        for s in range(num_strands):
+            differences = 0
+            for w in range(num_words):
+                differences += _differing_bases(strand_words[s, w], windows[w])
+                if differences > max_differences:
+                    break
+            if differences <= max_differences:
+                stop[0] = 1
+                return True
+    return False
+
+
+@njit(nogil=True, nopython=True, cache=True)
+def _compare_chunk_packed(
+    chunk_words: npt.NDArray[np.uint64],
+    chunk_size: int,
+    words: npt.NDArray[np.uint64],
+    length: int,
+    max_differences: int,
+    both_strands: bool = False,
+) -> bool:
+    stop = np.zeros(1, dtype=np.uint8)
+    strand_words = _strand_words(chunk_words, chunk_size, both_strands)
+    return _compare_slice_packed(strand_words, chunk_size, words, max_differences, 0, length - chunk_size + 1, stop)
+
+
+def split_range(total: int, parts: int) -> list[tuple[int, int]]:
+    """Split `range(total)` into at most `parts` contiguous, non-empty `(begin, end)` slices of near-equal size."""
+    bounds = np.linspace(0, max(total, 0), max(min(parts, total), 1) + 1).astype(np.int64)
+    return [(int(begin), int(end)) for begin, end in zip(bounds[:-1], bounds[1:]) if begin < end]
+
+
+def map_slices(function: Callable[[int, int], Any], slices: list[tuple[int, int]]) -> list[Any]:
+    """Call `function(begin, end)` for every slice, on one thread per slice when there are several.
+
+    The kernels release the GIL, so the threads run on separate cores.
+    """
+    if len(slices) <= 1:
+        return [function(begin, end) for begin, end in slices]
+    with ThreadPoolExecutor(max_workers=len(slices)) as executor:
+        return list(executor.map(lambda bounds: function(*bounds), slices))
+
+
+def compare_chunk(
+    chunk: Genome,
+    target_genome: Genome,
+    max_differences: int,
+    num_threads: int = 1,
+    both_strands: bool = False,
+    edit_distance: bool = False,
+) -> bool:
+    """Check if the chunk matches anywhere in the target genome; packed inputs use the popcount kernel.
+
+    With several threads the target is split into slices whose windows overlap by `len(chunk) - 1` bases, and every
+    thread stops shortly after any of them finds a match. With `both_strands` the chunk also matches where its reverse
+    complement does, in the same pass over the target. With `edit_distance` insertions and deletions count as
+    differences too.
+    """
+    packed = isinstance(chunk, PackedGenome) or isinstance(target_genome, PackedGenome)
+    if num_threads > 1 or both_strands or edit_distance or packed:
+        chunk, target_genome = _as_packed(chunk), _as_packed(target_genome)
+        strand_words = _strand_words(chunk.words, chunk.length, both_strands)
+        stop = np.zeros(1, dtype=np.uint8)
+        if edit_distance:
+            _check_edit_chunk_size(chunk.length)
+            strand_masks = _strand_masks(strand_words, chunk.length)
+
+            def compare_slice(begin: int, end: int) -> bool:
+                return _edit_scan_slice(
+                    strand_masks, chunk.length, target_genome.words, max_differences, begin, end, stop
+                )
+
+            return any(map_slices(compare_slice, split_range(target_genome.length, num_threads)))
+
+        def compare_slice(begin: int, end: int) -> bool:
+            return _compare_slice_packed(
+                strand_words, chunk.length, target_genome.words, max_differences, begin, end, stop
+            )
+
+        return any(map_slices(compare_slice, split_range(target_genome.length - chunk.length + 1, num_threads)))
+    return _compare_chunk(chunk, target_genome, max_differences)
+
+
+@njit(nogil=True, nopython=True, cache=True)
+def _find_matches(
     query_genome: npt.NDArray[np.int8], target_genome: npt.NDArray[np.int8], chunk_size: int, max_differences: int
 ) -> tuple[int, int]:
-    """Find matching chunks between query and target genomes."""
     total_chunks = len(query_genome) - chunk_size + 1
     matching_chunks = 0
 
     for i in range(total_chunks):
         chunk = query_genome[i : i + chunk_size]
-        if compare_chunk(chunk, target_genome, max_differences):
+        if _compare_chunk(chunk, target_genome, max_differences):
             matching_chunks += 1
 
     return matching_chunks, total_chunks
+
+
+@njit(nogil=True, nopython=True, cache=True)
+def _count_matches_packed(
+    query_words: npt.NDArray[np.uint64],
+    words: npt.NDArray[np.uint64],
+    length: int,
+    chunk_size: int,
+    max_differences: int,
+    begin: int,
+    end: int,
+    both_strands: bool,
+    edit_distance: bool = False,
+) -> int:
+    """Count the query chunks starting in `[begin, end)` that match somewhere in the target."""
+    matching_chunks = 0
+    stop = np.zeros(1, dtype=np.uint8)
+    for i in range(begin, end):
+        strand_words = _strand_words(_chunk_words(query_words, i, chunk_size), chunk_size, both_strands)
+        stop[0] = 0
+        if edit_distance:
+            matched = _edit_scan_slice(
+                _strand_masks(strand_words, chunk_size), chunk_size, words, max_differences, 0, length, stop
+            )
+        else:
+            matched = _compare_slice_packed(
+                strand_words, chunk_size, words, max_differences, 0, length - chunk_size + 1, stop
+            )
+        if matched:
+            matching_chunks += 1
+    return matching_chunks
+
+
+def find_matches(
+    query_genome: Genome,
+    target_genome: Genome,
+    chunk_size: int,
+    max_differences: int,
+    num_threads: int = 1,
+    both_strands: bool = False,
+    edit_distance: bool = False,
+) -> tuple[int, int]:
+    """Find matching chunks between query and target genomes, splitting the query chunks across threads.
+
+    With `both_strands` a chunk also counts when it matches the reverse strand of the target, and with `edit_distance`
+    when it matches with insertions and deletions.
+    """
+    if edit_distance:
+        _check_edit_chunk_size(chunk_size)
+    packed = isinstance(query_genome, PackedGenome) or isinstance(target_genome, PackedGenome)
+    if num_threads > 1 or both_strands or edit_distance or packed:
+        query_genome, target_genome = _as_packed(query_genome), _as_packed(target_genome)
+        total_chunks = query_genome.length - chunk_size + 1
+
+        def count_slice(begin: int, end: int) -> int:
+            return _count_matches_packed(
+                query_genome.words,
+                target_genome.words,
+                target_genome.length,
+                chunk_size,
+                max_differences,
+                begin,
+                end,
+                both_strands,
+                edit_distance,
+            )
+
+        return sum(map_slices(count_slice, split_range(total_chunks, num_threads))), total_chunks
+    return _find_matches(query_genome, target_genome, chunk_size, max_differences)
+
+
+@njit(nogil=True, nopython=True, cache=True)
+def _match_masks(
+    chunk_words: npt.NDArray[np.uint64],
+    chunk_size: int,
+    targets: tuple[npt.NDArray[np.uint64], ...],
+    lengths: npt.NDArray[np.int64],
+    max_differences: int,
+    num_strands: int,
+) -> npt.NDArray[np.int64]:
+    """Strand `s` of chunk `b` is row `s * num_chunks + b` of `chunk_words`."""
+    num_rows, num_words = chunk_words.shape
+    num_chunks = num_rows // num_strands
+    num_targets = len(lengths)
+    masks = np.zeros(num_chunks, dtype=np.int64)
+
+    # One rolling register per (target, chunk word); a target drops out once every chunk has matched it
+    top_shifts = np.empty(num_words, dtype=np.uint64)
+    for w in range(num_words):
+        top_shifts[w] = 2 * (min(BASES_PER_WORD, chunk_size - w * BASES_PER_WORD) - 1)
+    windows = np.empty((num_targets, num_words), dtype=np.uint64)
+    pending = np.zeros(num_targets, dtype=np.int64)
+    for t in range(num_targets):
+        if lengths[t] >= chunk_size:
+            pending[t] = num_chunks
+            for w in range(num_words):
+                windows[t, w] = _window(targets[t], w * BASES_PER_WORD, np.int64(top_shifts[w] >> np.uint64(1)) + 1)
+    remaining = pending.sum()
+
+    for i in range(lengths.max() - chunk_size + 1):
+        for t in range(num_targets):
+            if pending[t] == 0 or i > lengths[t] - chunk_size:
+                continue
+            words = targets[t]
+            if i > 0:
+                for w in range(num_words):
+                    last = i + w * BASES_PER_WORD + np.int64(top_shifts[w] >> np.uint64(1))
+                    base = (words[last >> 5] >> np.uint64((last & 31) * 2)) & np.uint64(3)
+                    windows[t, w] = (windows[t, w] >> np.uint64(2)) | (base << top_shifts[w])
+            bit = np.int64(1) << t
+            for b in range(num_chunks):
+                if masks[b] & bit:
+                    continue
+                for s in range(num_strands):
+                    differences = 0
+                    for w in range(num_words):
+                        differences += _differing_bases(chunk_words[s * num_chunks + b, w], windows[t, w])
+                        if differences > max_differences:
+                            break
+                    if differences <= max_differences:
+                        masks[b] |= bit
+                        pending[t] -= 1
+                        remaining -= 1
+                        break
+        if remaining == 0:
+            break
+    return masks
+
+
+@njit(nogil=True, nopython=True, cache=True)
+def _match_masks_edit(
+    chunk_words: npt.NDArray[np.uint64],
+    chunk_size: int,
+    targets: tuple[npt.NDArray[np.uint64], ...],
+    lengths: npt.NDArray[np.int64],
+    max_differences: int,
+    num_strands: int,
+) -> npt.NDArray[np.int64]:
+    """Edit-distance counterpart of `_match_masks`, with one Myers search state per (target, chunk row)."""
+    num_rows = chunk_words.shape[0]
+    num_chunks = num_rows // num_strands
+    num_targets = len(lengths)
+    masks = np.zeros(num_chunks, dtype=np.int64)
+    if max_differences >= chunk_size:
+        masks[:] = (np.int64(1) << num_targets) - 1
+        return masks
+
+    strand_masks = _strand_masks(chunk_words, chunk_size)
+    last_bit = np.uint64(1) << np.uint64(chunk_size - 1)
+    vertical_plus = np.full((num_targets, num_rows), ~np.uint64(0), dtype=np.uint64)
+    vertical_minus = np.zeros((num_targets, num_rows), dtype=np.uint64)
+    scores = np.full((num_targets, num_rows), chunk_size, dtype=np.int64)
+    pending = np.full(num_targets, num_chunks, dtype=np.int64)
+    remaining = pending.sum()
+
+    for i in range(lengths.max()):
+        for t in range(num_targets):
+            if pending[t] == 0 or i >= lengths[t]:
+                continue
+            words = targets[t]
+            base = (words[i >> 5] >> np.uint64((i & 31) * 2)) & np.uint64(3)
+            bit = np.int64(1) << t
+            for b in range(num_chunks):
+                if masks[b] & bit:
+                    continue
+                for s in range(num_strands):
+                    r = s * num_chunks + b
+                    vertical_plus[t, r], vertical_minus[t, r], scores[t, r] = _edit_step(
+                        strand_masks[r, base], vertical_plus[t, r], vertical_minus[t, r], scores[t, r], last_bit
+                    )
+                    if scores[t, r] <= max_differences:
+                        masks[b] |= bit
+                        pending[t] -= 1
+                        remaining -= 1
+                        break
+        if remaining == 0:
+            break
+    return masks
+
+
+def match_masks(
+    chunks: Genome | list[Genome],
+    targets: list[Genome],
+    max_differences: int,
+    both_strands: bool = False,
+    edit_distance: bool = False,
+) -> npt.NDArray[np.int64]:
+    """Compare a batch of chunks against every target in one interleaved pass.
+
+    Bit `t` of the mask of each chunk is set when the chunk matches somewhere in `targets[t]`, on either strand if
+    `both_strands`, and allowing insertions and deletions if `edit_distance`. Every window of every target is read once
+    for the whole batch, and the pass ends as soon as every chunk has matched every target.
+    """
+    if len(targets) > 63:
+        raise ValueError(f"At most 63 targets fit in a match mask, got {len(targets)}")
+    chunks = [_as_packed(chunk) for chunk in (chunks if isinstance(chunks, list) else [chunks])]
+    if not targets:
+        return np.zeros(len(chunks), dtype=np.int64)
+    if len({len(chunk) for chunk in chunks}) > 1:
+        raise ValueError("All chunks in a batch must have the same length")
+    chunk_words = np.stack([chunk.words for chunk in chunks])
+    if both_strands:
+        chunk_words = np.concatenate([chunk_words, np.stack([chunk.reverse_complement().words for chunk in chunks])])
+
+    # Present every target as the same (read-only) array type so that they fit in one homogeneous tuple
+    target_words = []
+    for target in targets:
+        words = _as_packed(target).words.view(np.ndarray)
+        words.flags.writeable = False
+        target_words.append(words)
+    lengths = np.array([len(target) for target in targets], dtype=np.int64)
+    num_strands = 2 if both_strands else 1
+    if edit_distance:
+        _check_edit_chunk_size(len(chunks[0]))
+        return _match_masks_edit(
+            chunk_words, len(chunks[0]), tuple(target_words), lengths, max_differences, num_strands
+        )
+    return _match_masks(chunk_words, len(chunks[0]), tuple(target_words), lengths, max_differences, num_strands)
+
+
+def seed_size_for(chunk_size: int, max_differences: int) -> int:
+    """Seed length for a pigeonhole search: one of `max_differences + 1` disjoint seeds must match exactly."""
+    return max(1, min(chunk_size // (max_differences + 1), MAX_SEED_SIZE))
+
+
+@njit(nogil=True, nopython=True, cache=True)
+def _build_index(
+    words: npt.NDArray[np.uint64],
+    length: int,
+    seed_size: int,
+    offsets: npt.NDArray[np.int64],
+    positions: npt.NDArray[np.uint32],
+) -> None:
+    num_seeds = length - seed_size + 1
+    for i in range(num_seeds):
+        offsets[np.int64(_window(words, i, seed_size)) + 1] += 1
+    for key in range(1, len(offsets)):
+        offsets[key] += offsets[key - 1]
+    fill = offsets[:-1].copy()
+    for i in range(num_seeds):
+        key = np.int64(_window(words, i, seed_size))
+        positions[fill[key]] = i
+        fill[key] += 1
+
+
+@njit(nogil=True, nopython=True, cache=True)
+def compare_chunk_indexed(
+    chunk_words: npt.NDArray[np.uint64],
+    chunk_size: int,
+    words: npt.NDArray[np.uint64],
+    length: int,
+    offsets: npt.NDArray[np.int64],
+    positions: npt.NDArray[np.uint32],
+    seed_size: int,
+    max_differences: int,
+    edit_distance: bool = False,
+) -> bool:
+    """Check if the packed chunk matches anywhere in the packed target, verifying only at seed hits.
+
+    The pigeonhole argument holds for edits too: one of the `max_differences + 1` segments is untouched, and the match
+    then lies within `max_differences` bases of where the seed hit puts the chunk, so only that band is searched.
+    """
+    last_start = length - chunk_size
+    if last_start < 0 and not edit_distance:
+        return False
+    if max_differences >= chunk_size:
+        return True
+    segment_size = chunk_size // (max_differences + 1)
+    if seed_size > segment_size:
+        raise ValueError("Index seed size is longer than a pigeonhole segment")
+    masks = _pattern_masks(chunk_words, chunk_size) if edit_distance else np.zeros(4, dtype=np.uint64)
+
+    for j in range(max_differences + 1):
+        seed_start = j * segment_size
+        key = np.int64(_window(chunk_words, seed_start, seed_size))
+        for k in range(offsets[key], offsets[key + 1]):
+            start = np.int64(positions[k]) - seed_start
+            if edit_distance:
+                begin = max(start - max_differences, 0)
+                end = min(start + chunk_size + max_differences, length)
+                if _band_edit_distance(masks, chunk_size, words, begin, end, max_differences) <= max_differences:
+                    return True
+            elif 0 <= start <= last_start and _within_distance_packed(
+                chunk_words, chunk_size, words, start, max_differences
+            ):
+                return True
+    return False
+
+
+@njit(nogil=True, nopython=True, cache=True)
+def _count_matches_indexed(
+    query_words: npt.NDArray[np.uint64],
+    words: npt.NDArray[np.uint64],
+    length: int,
+    offsets: npt.NDArray[np.int64],
+    positions: npt.NDArray[np.uint32],
+    seed_size: int,
+    chunk_size: int,
+    max_differences: int,
+    begin: int,
+    end: int,
+    both_strands: bool,
+    edit_distance: bool = False,
+) -> int:
+    matching_chunks = 0
+    for i in range(begin, end):
+        strand_words = _strand_words(_chunk_words(query_words, i, chunk_size), chunk_size, both_strands)
+        for s in range(len(strand_words)):
+            if compare_chunk_indexed(
+                strand_words[s],
+                chunk_size,
+                words,
+                length,
+                offsets,
+                positions,
+                seed_size,
+                max_differences,
+                edit_distance,
+            ):
+                matching_chunks += 1
+                break
+    return matching_chunks
+
+
+@njit(nogil=True, nopython=True, cache=True)
+def find_matches_indexed(
+    query_words: npt.NDArray[np.uint64],
+    query_length: int,
+    words: npt.NDArray[np.uint64],
+    length: int,
+    offsets: npt.NDArray[np.int64],
+    positions: npt.NDArray[np.uint32],
+    seed_size: int,
+    chunk_size: int,
+    max_differences: int,
+    both_strands: bool = False,
+    edit_distance: bool = False,
+) -> tuple[int, int]:
+    """Find matching chunks between packed query and target genomes using the target's seed index."""
+    total_chunks = query_length - chunk_size + 1
+    matching_chunks = _count_matches_indexed(
+        query_words,
+        words,
+        length,
+        offsets,
+        positions,
+        seed_size,
+        chunk_size,
+        max_differences,
+        0,
+        total_chunks,
+        both_strands,
+        edit_distance,
+    )
+    return matching_chunks, total_chunks
+
+
+@dataclass(frozen=True, eq=False)
+class GenomeIndex:
+    """CSR seed table over a packed target genome.
+
+    The positions of every seed with key `key` are `positions[offsets[key] : offsets[key + 1]]`, where a seed key is
+    the packed word of its `seed_size` bases. The table covers the forward strand only; reverse-strand matches are
+    found by looking up the reverse complement of the chunk.
+    """
+
+    genome: PackedGenome
+    offsets: npt.NDArray[np.int64]
+    positions: npt.NDArray[np.uint32]
+    seed_size: int
+
+    @classmethod
+    def build(cls, genome: Genome, seed_size: int) -> "GenomeIndex":
+        if not 1 <= seed_size <= MAX_SEED_SIZE:
+            raise ValueError(f"Seed size must be between 1 and {MAX_SEED_SIZE}, got {seed_size}")
+        genome = _as_packed(genome)
+        offsets = np.zeros(4**seed_size + 1, dtype=np.int64)
+        positions = np.empty(max(len(genome) - seed_size + 1, 0), dtype=np.uint32 if len(genome) < 2**32 else np.int64)
+        _build_index(genome.words, genome.length, seed_size, offsets, positions)
+        return cls(genome, offsets, positions, seed_size)
+
+    def compare_chunk(
+        self, chunk: Genome, max_differences: int, both_strands: bool = False, edit_distance: bool = False
+    ) -> bool:
+        chunk = _as_packed(chunk)
+        if edit_distance:
+            _check_edit_chunk_size(chunk.length)
+        strands = (chunk, chunk.reverse_complement()) if both_strands else (chunk,)
+        return any(
+            compare_chunk_indexed(
+                strand.words,
+                strand.length,
+                self.genome.words,
+                self.genome.length,
+                self.offsets,
+                self.positions,
+                self.seed_size,
+                max_differences,
+                edit_distance,
+            )
+            for strand in strands
+        )
+
+    def find_matches(
+        self,
+        query_genome: Genome,
+        chunk_size: int,
+        max_differences: int,
+        num_threads: int = 1,
+        both_strands: bool = False,
+        edit_distance: bool = False,
+    ) -> tuple[int, int]:
+        if edit_distance:
+            _check_edit_chunk_size(chunk_size)
+        query_genome = _as_packed(query_genome)
+        total_chunks = query_genome.length - chunk_size + 1
+
+        def count_slice(begin: int, end: int) -> int:
+            return _count_matches_indexed(
+                query_genome.words,
+                self.genome.words,
+                self.genome.length,
+                self.offsets,
+                self.positions,
+                self.seed_size,
+                chunk_size,
+                max_differences,
+                begin,
+                end,
+                both_strands,
+                edit_distance,
+            )
+
+        return sum(map_slices(count_slice, split_range(total_chunks, num_threads))), total_chunks
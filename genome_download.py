@@ -0,0 +1,274 @@
+"""
+Streaming, resumable genome downloads that finish as ready-to-map genome cache entries.
+
+A download is written to `<output>.part` block by block as it arrives, so memory stays bounded however large the file.
+An interrupted download resumes from the end of the partial file, with an HTTP Range request or the FTP REST command;
+a server that ignores the range sends the whole file again and the partial file starts over. Over HTTP, the ETag or
+Last-Modified of the response that started the partial file is kept in `<output>.part.validator` and sent back as
+If-Range, so a file that changed on the server since is downloaded again rather than appended to the old bytes.
+
+On its way to disk every block is also
+
+    hashed       for the checksum, and for the content hash that keys the genome cache entry
+    decoded      gunzipped (bgzip's concatenated members included) and fed to a `GenomeEncoder`
+
+so once the last block is in and the size and checksum check out, the encoded genome goes straight into the genome cache
+and `load_cached_genome` maps it without reading the file again. A resumed download feeds the partial file through the
+same pipeline first, which costs a local read rather than a second download.
+"""
+
+import ftplib
+import hashlib
+import os
+import zlib
+from collections.abc import Iterator
+from contextlib import AbstractContextManager, contextmanager
+from pathlib import Path
+from time import perf_counter
+from urllib.parse import unquote, urlsplit
+
+import numpy as np
+import numpy.typing as npt
+import requests
+
+from genome_cache import CACHE_DIR, SourceIdentity, cache_path_for, content_digest, evict, write_cached_genome
+from genome_comparison import GZIP_MAGIC, ContigTable, GenomeEncoder, ReadStats
+
+# Bytes read from the network, and written to disk, at a time; also the most decompressed bytes held at once
+DOWNLOAD_BLOCK_SIZE = 1 << 20
+DEFAULT_TIMEOUT = 300.0
+DEFAULT_RETRIES = 5
+
+# Transient failures after which the download resumes from what it already has
+_RETRIABLE = (
+    requests.ConnectionError,
+    requests.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+    ConnectionError,
+    TimeoutError,
+    EOFError,
+    ftplib.error_temp,
+)
+
+
+class IncompleteDownload(ConnectionError):
+    """Raised when a server ends a transfer before the expected size; the download can resume."""
+
+
+class _GunzipStream:
+    """Gzip decompression of a byte stream, fed block by block; concatenated gzip members (bgzip) follow each other."""
+
+    def __init__(self, max_output: int):
+        self.max_output = max_output
+        self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def decompress(self, data: bytes) -> Iterator[bytes]:
+        """Decompressed bytes of the next block, in pieces of at most `max_output` bytes: a run of `N`s compresses a
+        thousandfold, so a block may expand to far more than fits in memory."""
+        while True:
+            out = self._decompressor.decompress(data, self.max_output)
+            if out:
+                yield out
+            if self._decompressor.eof and self._decompressor.unused_data:
+                data = self._decompressor.unused_data
+                self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                continue
+            data = self._decompressor.unconsumed_tail
+            # A full piece may leave output pending even when all the input is consumed
+            if not data and len(out) < self.max_output:
+                return
+
+    @property
+    def finished(self) -> bool:
+        return self._decompressor.eof
+
+
+class _Pipeline:
+    """Everything a downloaded block goes through besides the disk: the checksum and content hashes, and the encoder."""
+
+    def __init__(self, md5: str | None, encode: bool, expected_size: int | None, block_size: int):
+        self.size = 0
+        self.md5 = hashlib.md5(usedforsecurity=False) if md5 else None
+        self.content = content_digest()
+        self.encode = encode
+        self.expected_size = expected_size or 0
+        self.block_size = block_size
+        self.encoder: GenomeEncoder | None = None
+        self.gunzip: _GunzipStream | None = None
+        self._head = b""
+
+    def feed(self, block: bytes) -> None:
+        self.size += len(block)
+        self.content.update(block)
+        if self.md5 is not None:
+            self.md5.update(block)
+        if not self.encode:
+            return
+        if self.encoder is None:
+            # Gzipped or not is only known from the first two bytes
+            self._head += block
+            if len(self._head) < len(GZIP_MAGIC):
+                return
+            block, self._head = self._head, b""
+            compressed = block.startswith(GZIP_MAGIC)
+            self.gunzip = _GunzipStream(self.block_size) if compressed else None
+            self.encoder = GenomeEncoder(self.expected_size * 4 if compressed else self.expected_size)
+        if self.gunzip is None:
+            self.encoder.feed(block)
+            return
+        for piece in self.gunzip.decompress(block):
+            self.encoder.feed(piece)
+
+    def finish(self, read_seconds: float) -> tuple[npt.NDArray[np.int8], ContigTable, ReadStats]:
+        if self.encoder is None:
+            self.encoder = GenomeEncoder()
+            self.encoder.feed(self._head)
+        if self.gunzip is not None and not self.gunzip.finished:
+            raise ValueError("Download ends in the middle of a gzip member")
+        return self.encoder.finish(self.size, read_seconds)
+
+
+def _http_validator(response: requests.Response) -> str:
+    """What If-Range can send back to resume `response`'s file: its ETag unless weak, else its Last-Modified, if any."""
+    etag = response.headers.get("ETag", "")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return response.headers.get("Last-Modified", "")
+
+
+@contextmanager
+def _http_stream(
+    url: str, offset: int, validator_path: Path, block_size: int, timeout: float
+) -> Iterator[tuple[int, Iterator[bytes]]]:
+    # A partial file without a validator is of unknown origin, so it isn't resumed
+    headers = {}
+    if offset and validator_path.exists():
+        headers["Range"] = f"bytes={offset}-"
+        if validator := validator_path.read_text():
+            headers["If-Range"] = validator
+    response = requests.get(url, headers=headers, stream=True, timeout=timeout)
+    if response.status_code == 416:
+        response.close()
+        if response.headers.get("Content-Range") == f"bytes */{offset}":  # the partial file already holds everything
+            yield offset, iter(())
+            return
+        # The partial file is longer than the file, so it isn't a part of it
+        response = requests.get(url, stream=True, timeout=timeout)
+    with response:
+        response.raise_for_status()
+        if response.status_code != 206:
+            validator_path.write_text(_http_validator(response))
+        yield (offset if response.status_code == 206 else 0), response.iter_content(block_size)
+
+
+@contextmanager
+def _ftp_stream(url: str, offset: int, block_size: int, timeout: float) -> Iterator[tuple[int, Iterator[bytes]]]:
+    parts = urlsplit(url)
+    with ftplib.FTP(timeout=timeout) as ftp:
+        ftp.connect(parts.hostname, parts.port or 21)
+        ftp.login(parts.username or "anonymous", parts.password or "")
+        ftp.voidcmd("TYPE I")
+        with ftp.transfercmd(f"RETR {unquote(parts.path)}", rest=offset or None) as connection:
+            yield offset, iter(lambda: connection.recv(block_size), b"")
+        ftp.voidresp()
+
+
+def _open_stream(
+    url: str, offset: int, validator_path: Path, block_size: int, timeout: float
+) -> AbstractContextManager[tuple[int, Iterator[bytes]]]:
+    """`(first byte, blocks)` of `url` from byte `offset`, or from byte 0 if the server can't start elsewhere or the
+    file changed since the validator in `validator_path` was stored (HTTP only)."""
+    scheme = urlsplit(url).scheme
+    if scheme == "ftp":
+        return _ftp_stream(url, offset, block_size, timeout)
+    if scheme in ("http", "https"):
+        return _http_stream(url, offset, validator_path, block_size, timeout)
+    raise ValueError(f"Unsupported URL scheme {scheme!r} in {url}")
+
+
+def _download_once(
+    url: str,
+    part_path: Path,
+    validator_path: Path,
+    pipeline: _Pipeline,
+    expected_size: int | None,
+    block_size: int,
+    timeout: float,
+) -> float:
+    """Bring the partial file up to date and feed all of it through the pipeline; returns the seconds spent waiting
+    for the network."""
+    part_path.touch()
+    offset = part_path.stat().st_size
+    if expected_size is not None and offset > expected_size:
+        offset = 0
+    read_seconds = 0.0
+    with _open_stream(url, offset, validator_path, block_size, timeout) as (start, blocks), part_path.open("r+b") as f:
+        f.truncate(start)
+        while f.tell() < start:
+            pipeline.feed(f.read(min(block_size, start - f.tell())))
+        iterator = iter(blocks)
+        while True:
+            begin = perf_counter()
+            block = next(iterator, None)
+            read_seconds += perf_counter() - begin
+            if block is None:
+                break
+            f.write(block)
+            pipeline.feed(block)
+    if expected_size is not None and pipeline.size < expected_size:
+        raise IncompleteDownload(f"{url} ended after {pipeline.size} of {expected_size} bytes")
+    return read_seconds
+
+
+def download_genome(
+    url: str,
+    output_path: Path,
+    expected_size: int | None = None,
+    md5: str | None = None,
+    cache_dir: Path | None = CACHE_DIR,
+    block_size: int = DOWNLOAD_BLOCK_SIZE,
+    timeout: float = DEFAULT_TIMEOUT,
+    retries: int = DEFAULT_RETRIES,
+) -> ReadStats | None:
+    """Download a FASTA file, plain or gzipped, to `output_path` over HTTP(S) or FTP, resuming a partial download,
+    and encode it into the genome cache in `cache_dir` on the way (unless `cache_dir` is None).
+
+    The size and, when given, the MD5 checksum are checked before the file is moved into place; a file that fails them
+    is deleted, since resuming it would only append to bad data. Returns the encoding stats, or None without a cache.
+    """
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    part_path = output_path.with_name(f"{output_path.name}.part")
+    validator_path = output_path.with_name(f"{part_path.name}.validator")
+    for attempt in range(retries + 1):
+        pipeline = _Pipeline(md5, cache_dir is not None, expected_size, block_size)
+        try:
+            read_seconds = _download_once(url, part_path, validator_path, pipeline, expected_size, block_size, timeout)
+            break
+        except _RETRIABLE as e:
+            if attempt == retries:
+                raise
+            print(f"Download of {url} interrupted ({e}), resuming")
+    validator_path.unlink(missing_ok=True)
+
+    if expected_size is not None and pipeline.size != expected_size:
+        part_path.unlink()
+        raise ValueError(f"Expected size {expected_size} doesn't match actual size {pipeline.size}")
+    if md5 and pipeline.md5.hexdigest() != md5.lower():
+        part_path.unlink()
+        raise ValueError(f"MD5 checksum {pipeline.md5.hexdigest()} of {url} doesn't match the expected {md5}")
+    if cache_dir is None:
+        os.replace(part_path, output_path)
+        return None
+
+    try:
+        encoded, contigs, stats = pipeline.finish(read_seconds)
+    except ValueError:
+        part_path.unlink()
+        raise
+    os.replace(part_path, output_path)
+    cache_path = cache_path_for(output_path, cache_dir)
+    source = SourceIdentity(pipeline.size, output_path.stat().st_mtime_ns, pipeline.content.digest())
+    write_cached_genome(cache_path, source, encoded, contigs)
+    del encoded
+    evict(cache_dir, keep=(cache_path,))
+    return stats
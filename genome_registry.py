@@ -0,0 +1,123 @@
+"""
+Process-wide registry of the shared-memory genomes and indexes that simulations attach to.
+
+A simulation used to encode every genome into a fresh shared-memory block and unlink it at the end of the run, so each
+run paid for reading and encoding every genome again. The registry keeps blocks alive between runs instead: each is
+keyed by the identity of the file it was built from (device, inode, size and modification time, plus whatever else
+changes its contents, such as an index's seed size), and reference-counted by the simulations using it. A run that only
+changes one target, or a parameter that doesn't affect the blocks, attaches to the others straight away.
+
+Blocks no simulation uses stay registered until the registry outgrows its memory budget, when the least recently used
+ones are unlinked first. Blocks in use are never evicted, so the budget can be exceeded while a run needs them.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Protocol, TypeVar
+
+DEFAULT_MAX_REGISTRY_BYTES = 16 * 2**30
+
+
+class SharedBlock(Protocol):
+    """Anything the registry can hold: it knows its size and how to free its memory."""
+
+    @property
+    def nbytes(self) -> int: ...
+
+    def release(self) -> None: ...
+
+
+Block = TypeVar("Block", bound=SharedBlock)
+
+
+@dataclass(frozen=True)
+class FileIdentity:
+    """Which file, and which version of it: rewriting or replacing a file changes its identity."""
+
+    path: str
+    device: int
+    inode: int
+    size: int
+    mtime_ns: int
+
+    @classmethod
+    def of(cls, path: str | Path) -> "FileIdentity":
+        resolved = Path(path).resolve()
+        stat = os.stat(resolved)
+        return cls(str(resolved), stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+@dataclass
+class _Entry:
+    block: SharedBlock
+    references: int = 0
+
+
+class GenomeRegistry:
+    def __init__(self, max_bytes: int = DEFAULT_MAX_REGISTRY_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # Least recently acquired first
+        self._entries: OrderedDict[Hashable, _Entry] = OrderedDict()
+
+    def acquire(self, key: Hashable, load: Callable[[], Block]) -> tuple[Block, bool]:
+        """Take a reference to the block of `key`, calling `load` to create it if it isn't registered yet; returns the
+        block and whether it was reused."""
+        with self._lock:
+            entry = self._entries.get(key)
+            reused = entry is not None
+            if entry is None:
+                # Loading holds the lock, so two simulations never build the same block twice
+                entry = self._entries[key] = _Entry(load())
+            self._entries.move_to_end(key)
+            entry.references += 1
+            self._evict()
+            return entry.block, reused
+
+    def release(self, key: Hashable) -> None:
+        """Drop a reference taken by `acquire`; the block stays registered until it is evicted."""
+        with self._lock:
+            entry = self._entries[key]
+            if entry.references <= 0:
+                raise ValueError(f"{key!r} is not in use")
+            entry.references -= 1
+            self._evict()
+
+    def references(self, key: Hashable) -> int:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry.references if entry is not None else 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    @property
+    def nbytes(self) -> int:
+        with self._lock:
+            return self._nbytes()
+
+    def _nbytes(self) -> int:
+        return sum(entry.block.nbytes for entry in self._entries.values())
+
+    def _evict(self) -> None:
+        total = self._nbytes()
+        for key, entry in list(self._entries.items()):
+            if total <= self.max_bytes:
+                break
+            if entry.references:
+                continue
+            total -= entry.block.nbytes
+            entry.block.release()
+            del self._entries[key]
+
+    def clear(self) -> None:
+        """Free every block, in use or not; for shutdown, when no worker can still be attached."""
+        with self._lock:
+            for entry in self._entries.values():
+                entry.block.release()
+            self._entries.clear()
@@ -0,0 +1,340 @@
+"""
+FracMinHash sketches of a genome's k-mers, for estimating how similar two genomes are in milliseconds.
+
+A sketch keeps the hash of every distinct k-mer whose hash falls in the lowest `1 / scaled` of the hash range, so it
+holds about `distinct k-mers / scaled` hashes whatever the genome, and the k-mers it keeps are a uniform sample that
+two sketches with the same parameters draw alike: a k-mer in both genomes is either in both sketches or in neither.
+Intersecting two sketches therefore estimates
+
+    containment   the fraction of the query's k-mers that are in the target, a lower bound on the fraction of its
+                  chunks that `find_matches` finds with `chunk_size` k-mers, since those are the exact matches
+    Jaccard       shared k-mers over the k-mers of either genome
+
+each with a Wilson score interval over the sampled k-mers. With `canonical`, a k-mer and its reverse complement hash
+alike, which is what comparisons over both strands count.
+
+Sketches are built by streaming the encoded genome in blocks, without k-mers across record junctions or gaps, and are
+saved next to the genome cache entry they were built from, keyed by its source's content hash, so comparing cached
+genomes only reads two small files.
+"""
+
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from statistics import NormalDist
+
+import numpy as np
+import numpy.typing as npt
+from numba import njit
+
+from adaptive_sampling import wilson_interval
+from genome_cache import CACHE_DIR, SKETCH_SUFFIX, CacheFormatError, cache_path_for, evict, load_cached_genome
+from genome_comparison import ContigTable, stream_encode_genome
+
+# One hash in a thousand: ~3 million hashes (24 MB) for a mammalian genome, and a relative error on containment of
+# about 1 / sqrt(shared hashes)
+DEFAULT_SCALED = 1_000
+
+# K-mers are rolled in two words of 32 bases
+MAX_KMER_SIZE = 64
+
+SKETCH_MAGIC = b"HHRSKTCH"
+SKETCH_VERSION = 1
+
+# magic, version, k-mer size, scaled, canonical, source hash, num k-mers, num hashes
+_HEADER = struct.Struct("<8sIIQI32sQQ")
+
+# Each thread hashes blocks of this many k-mers at a time
+_BLOCK_SIZE = 1 << 22
+
+_HASH_SEED = np.uint64(0x9E3779B97F4A7C15)
+_MIX_1 = np.uint64(0xFF51AFD7ED558CCD)
+_MIX_2 = np.uint64(0xC4CEB9FE1A85EC53)
+
+
+@njit(nogil=True, nopython=True, cache=True)
+def _mix(x: np.uint64) -> np.uint64:
+    """MurmurHash3's 64-bit finalizer."""
+    x ^= x >> np.uint64(33)
+    x *= _MIX_1
+    x ^= x >> np.uint64(33)
+    x *= _MIX_2
+    x ^= x >> np.uint64(33)
+    return x
+
+
+@njit(nogil=True, nopython=True, cache=True)
+def _hash_kmer(high: np.uint64, low: np.uint64) -> np.uint64:
+    return _mix(low ^ _mix(high ^ _HASH_SEED))
+
+
+@njit(nogil=True, nopython=True, cache=True)
+def _base_mask(num_bases: int) -> np.uint64:
+    if num_bases >= 32:
+        return ~np.uint64(0)
+    return (np.uint64(1) << np.uint64(2 * num_bases)) - np.uint64(1)
+
+
+@njit(nogil=True, nopython=True, cache=True)
+def _sketch_block(
+    encoded: npt.NDArray[np.int8],
+    begin: int,
+    end: int,
+    kmer_size: int,
+    canonical: bool,
+    max_hash: np.uint64,
+    out: npt.NDArray[np.uint64],
+) -> int:
+    """Write the hashes at most `max_hash` of the k-mers within contiguous bases `[begin, end)` to `out`; returns how
+    many there are.
+
+    A k-mer is read as a `2 * kmer_size`-bit number, first base most significant, split into its last 32 bases (`low`)
+    and the bases before them (`high`). Its reverse complement is rolled alongside, a complemented base entering at the
+    top as the forward one enters at the bottom.
+    """
+    low_bases = min(kmer_size, 32)
+    high_bases = kmer_size - low_bases
+    low_mask, high_mask = _base_mask(low_bases), _base_mask(high_bases)
+    low_top = np.uint64(2 * low_bases - 2)
+    high_top = np.uint64(max(2 * high_bases - 2, 0))
+    high = low = rc_high = rc_low = np.uint64(0)
+    num_hashes = 0
+    for i in range(begin, end):
+        base = np.uint64(encoded[i])
+        high = ((high << np.uint64(2)) | (low >> low_top)) & high_mask
+        low = ((low << np.uint64(2)) | base) & low_mask
+        if high_bases:
+            rc_low = (rc_low >> np.uint64(2)) | ((rc_high & np.uint64(3)) << low_top)
+            rc_high = (rc_high >> np.uint64(2)) | ((base ^ np.uint64(3)) << high_top)
+        else:
+            rc_low = (rc_low >> np.uint64(2)) | ((base ^ np.uint64(3)) << low_top)
+        if i - begin + 1 < kmer_size:
+            continue
+        # Select with masks rather than branch: which strand is smaller is a coin flip that the CPU can't predict
+        reverse = np.uint64(canonical & ((rc_high < high) | ((rc_high == high) & (rc_low < low))))
+        select = np.uint64(0) - reverse
+        value = _hash_kmer((rc_high & select) | (high & ~select), (rc_low & select) | (low & ~select))
+        if value <= max_hash:
+            out[num_hashes] = value
+            num_hashes += 1
+    return num_hashes
+
+
+@njit(nogil=True, nopython=True, cache=True)
+def _count_shared(a: npt.NDArray[np.uint64], b: npt.NDArray[np.uint64]) -> int:
+    """Number of values in both of two sorted arrays of distinct values."""
+    i = j = shared = 0
+    while i < len(a) and j < len(b):
+        if a[i] < b[j]:
+            i += 1
+        elif a[i] > b[j]:
+            j += 1
+        else:
+            shared += 1
+            i += 1
+            j += 1
+    return shared
+
+
+def _max_hash(scaled: int) -> np.uint64:
+    return np.uint64(2**64 // scaled - 1)
+
+
+@dataclass(frozen=True)
+class Estimate:
+    """A proportion estimated from sketches, with a confidence interval."""
+
+    estimate: float
+    low: float
+    high: float
+
+
+@dataclass(frozen=True)
+class SketchComparison:
+    """How much of a query genome's k-mers a target genome holds, estimated from their sketches."""
+
+    query_hashes: int
+    target_hashes: int
+    shared_hashes: int
+    containment: Estimate  # of the query in the target
+    jaccard: Estimate
+
+    def to_dict(self) -> dict[str, float | int]:
+        row = {
+            "query_hashes": self.query_hashes,
+            "target_hashes": self.target_hashes,
+            "shared_hashes": self.shared_hashes,
+        }
+        for name, estimate in (("containment", self.containment), ("jaccard", self.jaccard)):
+            row.update({name: estimate.estimate, f"{name}_low": estimate.low, f"{name}_high": estimate.high})
+        return row
+
+
+def _estimate(hits: int, samples: int, z: float) -> Estimate:
+    return Estimate(hits / samples if samples else 0.0, *wilson_interval(hits, samples, z))
+
+
+@dataclass(frozen=True, eq=False)
+class Sketch:
+    """Sorted distinct hashes of the sampled k-mers of a genome, out of `num_kmers` k-mers (counted with
+    multiplicity)."""
+
+    hashes: npt.NDArray[np.uint64]
+    kmer_size: int
+    scaled: int
+    canonical: bool
+    num_kmers: int
+
+    @classmethod
+    def build(
+        cls,
+        encoded: npt.NDArray[np.int8],
+        contigs: ContigTable,
+        kmer_size: int = 40,
+        scaled: int = DEFAULT_SCALED,
+        canonical: bool = False,
+        num_threads: int = 1,
+    ) -> "Sketch":
+        """Sketch the k-mers of an encoded genome, in blocks hashed by `num_threads` threads."""
+        if not 1 <= kmer_size <= MAX_KMER_SIZE:
+            raise ValueError(f"Sketches support k-mers of 1 to {MAX_KMER_SIZE} bases, got {kmer_size}")
+        if scaled < 1:
+            raise ValueError(f"scaled must be at least 1, got {scaled}")
+        bounds = [0, *contigs.breaks[(contigs.breaks > 0) & (contigs.breaks < len(encoded))].tolist(), len(encoded)]
+        blocks = [
+            (start, min(start + _BLOCK_SIZE + kmer_size - 1, run_end))
+            for run_begin, run_end in zip(bounds[:-1], bounds[1:])
+            for start in range(run_begin, run_end - kmer_size + 1, _BLOCK_SIZE)
+        ]
+        max_hash = _max_hash(scaled)
+
+        def sketch_block(block: tuple[int, int]) -> npt.NDArray[np.uint64]:
+            begin, end = block
+            out = np.empty(end - begin - kmer_size + 1, dtype=np.uint64)
+            # Distinct within the block already, so the per-block arrays stay about `1 / scaled` of the block
+            return np.unique(out[: _sketch_block(encoded, begin, end, kmer_size, canonical, max_hash, out)])
+
+        # The hashing kernel releases the GIL, so threads hash blocks in parallel
+        with ThreadPoolExecutor(max_workers=num_threads) as executor:
+            parts = list(executor.map(sketch_block, blocks))
+        hashes = np.unique(np.concatenate(parts)) if parts else np.empty(0, dtype=np.uint64)
+        num_kmers = sum(end - begin - kmer_size + 1 for begin, end in blocks)
+        return cls(hashes, kmer_size, scaled, canonical, num_kmers)
+
+    @property
+    def distinct_kmers(self) -> int:
+        """Estimated number of distinct k-mers in the genome."""
+        return len(self.hashes) * self.scaled
+
+    def downsample(self, scaled: int) -> "Sketch":
+        """The sketch that a coarser `scaled` would have built: a FracMinHash sketch keeps its lowest hashes."""
+        if scaled < self.scaled:
+            raise ValueError(f"Cannot downsample a sketch with scaled={self.scaled} to a finer scaled={scaled}")
+        if scaled == self.scaled:
+            return self
+        hashes = self.hashes[: np.searchsorted(self.hashes, _max_hash(scaled), side="right")]
+        return Sketch(hashes, self.kmer_size, scaled, self.canonical, self.num_kmers)
+
+    def compare(self, target: "Sketch", confidence: float = 0.95) -> SketchComparison:
+        """Estimate the containment of this genome's k-mers in `target`'s, and their Jaccard similarity.
+
+        Sketches built with different `scaled` are compared at the coarser one; the intervals treat the query's (or the
+        union's) sampled k-mers as independent draws, which holds for all but tiny genomes.
+        """
+        if (self.kmer_size, self.canonical) != (target.kmer_size, target.canonical):
+            raise ValueError(
+                f"Cannot compare a sketch of {self.kmer_size}-mers (canonical={self.canonical}) with one of "
+                f"{target.kmer_size}-mers (canonical={target.canonical})"
+            )
+        scaled = max(self.scaled, target.scaled)
+        query, target = self.downsample(scaled), target.downsample(scaled)
+        shared = _count_shared(query.hashes, target.hashes)
+        z = NormalDist().inv_cdf((1 + confidence) / 2)
+        union = len(query.hashes) + len(target.hashes) - shared
+        return SketchComparison(
+            len(query.hashes),
+            len(target.hashes),
+            shared,
+            _estimate(shared, len(query.hashes), z),
+            _estimate(shared, union, z),
+        )
+
+
+def sketch_path_for(
+    source_path: str | Path, cache_dir: Path, kmer_size: int, scaled: int, canonical: bool
+) -> Path:
+    """Sketch file of a FASTA file, next to its genome cache entry."""
+    entry = cache_path_for(source_path, cache_dir)
+    strands = "-canonical" if canonical else ""
+    return entry.with_name(f"{entry.stem}.k{kmer_size}-s{scaled}{strands}{SKETCH_SUFFIX}")
+
+
+def write_sketch(path: Path, sketch: Sketch, source_hash: bytes) -> None:
+    """Write a sketch file atomically."""
+    header = _HEADER.pack(
+        SKETCH_MAGIC,
+        SKETCH_VERSION,
+        sketch.kmer_size,
+        sketch.scaled,
+        sketch.canonical,
+        source_hash,
+        sketch.num_kmers,
+        len(sketch.hashes),
+    )
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with tmp_path.open("wb") as f:
+        f.write(header)
+        f.write(sketch.hashes.astype("<u8").tobytes())
+    os.replace(tmp_path, path)
+
+
+def read_sketch(path: Path) -> tuple[Sketch, bytes]:
+    """A sketch file's sketch and the content hash of the FASTA file it was built from."""
+    with path.open("rb") as f:
+        header = f.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            raise CacheFormatError(f"{path} is too short to be a sketch")
+        magic, version, kmer_size, scaled, canonical, source_hash, num_kmers, num_hashes = _HEADER.unpack(header)
+        if magic != SKETCH_MAGIC:
+            raise CacheFormatError(f"{path} is not a sketch")
+        if version != SKETCH_VERSION:
+            raise CacheFormatError(f"{path} has sketch format version {version}, expected {SKETCH_VERSION}")
+        hashes = np.fromfile(f, dtype="<u8", count=num_hashes).astype(np.uint64, copy=False)
+    if len(hashes) != num_hashes:
+        raise CacheFormatError(f"{path} is truncated")
+    return Sketch(hashes, kmer_size, scaled, bool(canonical), num_kmers), source_hash
+
+
+def load_sketch(
+    source_path: str | Path,
+    cache_dir: Path | None = CACHE_DIR,
+    kmer_size: int = 40,
+    scaled: int = DEFAULT_SCALED,
+    canonical: bool = False,
+    num_threads: int = 1,
+) -> Sketch:
+    """Sketch of a FASTA file: read from next to its genome cache entry if it was built from the same contents, or
+    built from the (possibly newly encoded) entry and saved there. Without a `cache_dir`, the file is encoded in memory
+    and the sketch isn't saved."""
+    if not cache_dir:
+        encoded, contigs, _ = stream_encode_genome(str(source_path))
+        return Sketch.build(encoded, contigs, kmer_size, scaled, canonical, num_threads)
+
+    entry = load_cached_genome(source_path, Path(cache_dir))
+    path = sketch_path_for(source_path, Path(cache_dir), kmer_size, scaled, canonical)
+    if path.exists():
+        try:
+            sketch, source_hash = read_sketch(path)
+            if source_hash == entry.source.content_hash:
+                os.utime(path)  # like a cache entry's, its mtime is its last-use time for eviction
+                return sketch
+        except CacheFormatError as e:
+            print(f"Ignoring unreadable sketch: {e}")
+    sketch = Sketch.build(entry.encoded, entry.contigs, kmer_size, scaled, canonical, num_threads)
+    write_sketch(path, sketch, entry.source.content_hash)
+    evict(Path(cache_dir), keep=(entry.path, path))
+    return sketch
+
@@ -0,0 +1,149 @@
+"""
+Counters, gauges and histograms of a simulation run, rendered in the Prometheus text exposition format.
+
+Every metric is declared once in `METRICS` with its type and help text, and a series is a metric name plus its label
+values. Workers time their own stages and send the timings back with each batch, so all series live in the process
+that serves `/metrics`.
+"""
+
+import threading
+from collections.abc import Iterator
+from contextlib import contextmanager
+from time import perf_counter
+
+# Upper bounds of the histogram buckets in seconds: 1 ms, 4 ms, ..., 65 s
+HISTOGRAM_BUCKETS = tuple(0.001 * 4**i for i in range(9))
+
+METRICS = {
+    "simulation_stage_seconds": ("gauge", "Seconds the latest run spent in each genome loading stage"),
+    "simulation_registry_reuses_total": ("counter", "Genomes and indexes reused from the shared-memory registry"),
+    "simulation_registry_bytes": ("gauge", "Shared memory held by the genome registry once the run's genomes loaded"),
+    "simulation_first_batch_seconds": (
+        "gauge",
+        "Seconds from the start of the run, genome loading included, until the first batch of samples came back",
+    ),
+    "simulation_worker_warm_up_seconds": ("histogram", "Seconds a worker spent loading its kernels before sampling"),
+    "simulation_compare_seconds": ("histogram", "Seconds one batch spent comparing its chunks against a target"),
+    "simulation_result_store_seconds": ("histogram", "Seconds one batch spent reading and writing the result store"),
+    "simulation_callback_seconds": ("histogram", "Seconds the sampling loop spent in its update callback"),
+    "simulation_emit_seconds": ("histogram", "Seconds spent broadcasting one coalesced update to the clients"),
+    "simulation_samples_total": ("counter", "Human chunks sampled"),
+    "simulation_batches_total": ("counter", "Batches completed by the workers"),
+    "simulation_samples_per_second": ("gauge", "Human chunks sampled per second since the run started"),
+    "simulation_worker_busy_seconds_total": ("counter", "Seconds the workers spent sampling batches"),
+    "simulation_worker_utilization": ("gauge", "Share of the worker pool's time spent sampling since the run started"),
+}
+
+Labels = tuple[tuple[str, str], ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Labels, extra: tuple[str, str] | None = None) -> str:
+    pairs = labels + ((extra,) if extra else ())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count of the observed values of one series."""
+
+    def __init__(self) -> None:
+        self.buckets = [0] * len(HISTOGRAM_BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        for b, bound in enumerate(HISTOGRAM_BUCKETS):
+            if value <= bound:
+                self.buckets[b] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """The series of `METRICS`; safe to update from the simulation thread while a request renders them."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._values: dict[tuple[str, Labels], float] = {}
+        self._histograms: dict[tuple[str, Labels], Histogram] = {}
+
+    @staticmethod
+    def _key(name: str, labels: dict[str, str], kind: str) -> tuple[str, Labels]:
+        if METRICS.get(name, (None,))[0] != kind:
+            raise ValueError(f"{name!r} is not a declared {kind}")
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def inc(self, name: str, value: float = 1.0, **labels: str) -> None:
+        key = self._key(name, labels, "counter")
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + value
+
+    def set(self, name: str, value: float, **labels: str) -> None:
+        key = self._key(name, labels, "gauge")
+        with self._lock:
+            self._values[key] = value
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        key = self._key(name, labels, "histogram")
+        with self._lock:
+            self._histograms.setdefault(key, Histogram()).observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels: str) -> Iterator[None]:
+        """Observe (histograms) or set (gauges) the seconds spent in the block."""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            seconds = perf_counter() - start
+            if METRICS.get(name, (None,))[0] == "histogram":
+                self.observe(name, seconds, **labels)
+            else:
+                self.set(name, seconds, **labels)
+
+    def get(self, name: str, **labels: str) -> float:
+        """Current value of a counter or gauge series, 0 if it was never updated."""
+        key = self._key(name, labels, METRICS.get(name, ("counter",))[0])
+        with self._lock:
+            return self._values.get(key, 0.0)
+
+    def render(self) -> str:
+        """All series in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, (kind, help_text) in METRICS.items():
+                if kind == "histogram":
+                    series = sorted((labels, h) for (n, labels), h in self._histograms.items() if n == name)
+                else:
+                    series = sorted((labels, v) for (n, labels), v in self._values.items() if n == name)
+                if not series:
+                    continue
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+                for labels, value in series:
+                    if kind != "histogram":
+                        lines.append(f"{name}{_format_labels(labels)} {value:g}")
+                        continue
+                    for bound, count in zip(HISTOGRAM_BUCKETS, value.buckets):
+                        lines.append(f"{name}_bucket{_format_labels(labels, ('le', f'{bound:g}'))} {count}")
+                    lines.append(f"{name}_bucket{_format_labels(labels, ('le', '+Inf'))} {value.count}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {value.sum:g}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {value.count}")
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self) -> dict[str, float | dict[str, float]]:
+        """Compact JSON form for Socket.IO updates: series values, and the count and mean of each histogram."""
+        with self._lock:
+            summary: dict[str, float | dict[str, float]] = {
+                f"{name}{_format_labels(labels)}": value for (name, labels), value in self._values.items()
+            }
+            for (name, labels), histogram in self._histograms.items():
+                summary[f"{name}{_format_labels(labels)}"] = {
+                    "count": histogram.count,
+                    "mean": histogram.sum / histogram.count,
+                }
+        return summary
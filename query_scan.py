@@ -0,0 +1,278 @@
+"""
+Single-pass scan of a target genome against an indexed set of fixed-length queries.
+
+This is the BOOMSTICK workflow: instead of scanning the whole target once per query, every query is split into
+`max_differences + 1` pigeonhole seeds, all seeds go into one CSR table, and the target is streamed once. At every
+target position the rolling seed key selects the queries that could match there, and only those are verified.
+"""
+
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+import numpy.typing as npt
+from numba import njit
+
+from genome_comparison import (
+    BASES_PER_WORD,
+    PackedGenome,
+    _band_edit_distance,
+    _check_edit_chunk_size,
+    _chunk_words,
+    _distance_packed,
+    _reverse_complement_words,
+    _strand_masks,
+    _window,
+    map_slices,
+    pack_genome,
+    seed_size_for,
+    split_range,
+    stream_encode_genome,
+)
+
+# Distance recorded for queries that do not match anywhere
+NO_HIT = -1
+
+_BASE_LETTERS = np.frombuffer(b"ACGT", dtype=np.uint8)
+
+
+@njit(nogil=True, nopython=True, cache=True)
+def _gather_chunks(
+    words: npt.NDArray[np.uint64], starts: npt.NDArray[np.int64], chunk_size: int
+) -> npt.NDArray[np.uint64]:
+    queries = np.empty((len(starts), (chunk_size + BASES_PER_WORD - 1) // BASES_PER_WORD), dtype=np.uint64)
+    for q in range(len(starts)):
+        queries[q] = _chunk_words(words, starts[q], chunk_size)
+    return queries
+
+
+@njit(nogil=True, nopython=True, cache=True)
+def _with_reverse_complements(query_words: npt.NDArray[np.uint64], chunk_size: int) -> npt.NDArray[np.uint64]:
+    num_queries = query_words.shape[0]
+    strands = np.empty((2 * num_queries, query_words.shape[1]), dtype=np.uint64)
+    for q in range(num_queries):
+        strands[q] = query_words[q]
+        strands[num_queries + q] = _reverse_complement_words(query_words[q], chunk_size)
+    return strands
+
+
+def merge_distances(a: npt.NDArray[np.int8], b: npt.NDArray[np.int8]) -> npt.NDArray[np.int8]:
+    """Best distance of each query in either array; misses are -1, so take the minimum over hits only."""
+    both = (a != NO_HIT) & (b != NO_HIT)
+    return np.where(both, np.minimum(a, b), np.maximum(a, b))
+
+
+@njit(nogil=True, nopython=True, cache=True)
+def _build_query_index(
+    query_words: npt.NDArray[np.uint64],
+    seed_size: int,
+    segment_size: int,
+    num_seeds: int,
+    offsets: npt.NDArray[np.int64],
+    entries: npt.NDArray[np.int64],
+) -> None:
+    for q in range(query_words.shape[0]):
+        for j in range(num_seeds):
+            offsets[np.int64(_window(query_words[q], j * segment_size, seed_size)) + 1] += 1
+    for key in range(1, len(offsets)):
+        offsets[key] += offsets[key - 1]
+    fill = offsets[:-1].copy()
+    for q in range(query_words.shape[0]):
+        for j in range(num_seeds):
+            key = np.int64(_window(query_words[q], j * segment_size, seed_size))
+            entries[fill[key]] = q * num_seeds + j
+            fill[key] += 1
+
+
+@njit(nogil=True, nopython=True, cache=True)
+def _scan_slice(
+    words: npt.NDArray[np.uint64],
+    length: int,
+    query_words: npt.NDArray[np.uint64],
+    chunk_size: int,
+    max_differences: int,
+    seed_size: int,
+    segment_size: int,
+    num_seeds: int,
+    offsets: npt.NDArray[np.int64],
+    entries: npt.NDArray[np.int64],
+    begin: int,
+    end: int,
+    distances: npt.NDArray[np.int8],
+    pattern_masks: npt.NDArray[np.uint64],
+) -> None:
+    """Verify every query whose seed occurs at a target seed position in `[begin, end)`, keeping the best distance.
+
+    With a row of `pattern_masks` per query, distances are edit distances, searched within `max_differences` bases of
+    where the seed puts the query.
+    """
+    edit_distance = pattern_masks.shape[0] > 0
+    last_start = length - chunk_size
+    top_shift = np.uint64(2 * (seed_size - 1))
+    key = _window(words, begin, seed_size)
+    for p in range(begin, end):
+        if p > begin:
+            last = p + seed_size - 1
+            base = (words[last >> 5] >> np.uint64((last & 31) * 2)) & np.uint64(3)
+            key = (key >> np.uint64(2)) | (base << top_shift)
+        bucket = np.int64(key)
+        for e in range(offsets[bucket], offsets[bucket + 1]):
+            q = entries[e] // num_seeds
+            if distances[q] == 0:
+                continue
+            start = p - (entries[e] % num_seeds) * segment_size
+            if edit_distance:
+                window_begin = max(start - max_differences, 0)
+                window_end = min(start + chunk_size + max_differences, length)
+                differences = _band_edit_distance(
+                    pattern_masks[q], chunk_size, words, window_begin, window_end, max_differences
+                )
+            elif start < 0 or start > last_start:
+                continue
+            else:
+                differences = _distance_packed(query_words[q], chunk_size, words, start, max_differences)
+            if differences <= max_differences and (distances[q] == NO_HIT or differences < distances[q]):
+                distances[q] = differences
+
+
+@dataclass(frozen=True, eq=False)
+class QuerySet:
+    """Packed fixed-length queries with one CSR seed table over all of them.
+
+    Entry `q * num_seeds + j` in `entries[offsets[key] : offsets[key + 1]]` says that seed `j` of query `q`, which
+    starts `j * segment_size` bases into the query, has key `key`. A set built for both strands also indexes the
+    reverse complement of query `q` as row `len(self) + q`, so one pass over the forward target finds both strands. A
+    set built for edit distance keeps the `_pattern_masks` of every row in `pattern_masks`, which is empty otherwise.
+    """
+
+    words: npt.NDArray[np.uint64]
+    chunk_size: int
+    max_differences: int
+    seed_size: int
+    offsets: npt.NDArray[np.int64]
+    entries: npt.NDArray[np.int64]
+    num_strands: int = 1
+    pattern_masks: npt.NDArray[np.uint64] = field(default_factory=lambda: np.empty((0, 4), dtype=np.uint64))
+
+    @property
+    def edit_distance(self) -> bool:
+        return len(self.pattern_masks) > 0
+
+    @property
+    def num_seeds(self) -> int:
+        return self.max_differences + 1
+
+    @property
+    def segment_size(self) -> int:
+        return self.chunk_size // self.num_seeds
+
+    def __len__(self) -> int:
+        return self.words.shape[0] // self.num_strands
+
+    @classmethod
+    def build(
+        cls,
+        query_words: npt.NDArray[np.uint64],
+        chunk_size: int,
+        max_differences: int,
+        both_strands: bool = False,
+        edit_distance: bool = False,
+    ) -> "QuerySet":
+        """Index packed queries, one row of `ceil(chunk_size / 32)` words per query."""
+        if edit_distance:
+            _check_edit_chunk_size(chunk_size)
+        seed_size = seed_size_for(chunk_size, max_differences)
+        if seed_size > chunk_size // (max_differences + 1):
+            raise ValueError(f"Chunks of {chunk_size} bases are too short for {max_differences} differences")
+        if both_strands:
+            query_words = _with_reverse_complements(query_words, chunk_size)
+        num_seeds = max_differences + 1
+        offsets = np.zeros(4**seed_size + 1, dtype=np.int64)
+        entries = np.empty(query_words.shape[0] * num_seeds, dtype=np.int64)
+        _build_query_index(query_words, seed_size, chunk_size // num_seeds, num_seeds, offsets, entries)
+        pattern_masks = _strand_masks(query_words, chunk_size) if edit_distance else np.empty((0, 4), dtype=np.uint64)
+        num_strands = 2 if both_strands else 1
+        return cls(query_words, chunk_size, max_differences, seed_size, offsets, entries, num_strands, pattern_masks)
+
+    @classmethod
+    def sample(
+        cls,
+        genome: PackedGenome,
+        num_queries: int,
+        chunk_size: int,
+        max_differences: int,
+        seed: int | None = None,
+        both_strands: bool = False,
+        edit_distance: bool = False,
+    ) -> tuple["QuerySet", npt.NDArray[np.int64]]:
+        """Index `num_queries` chunks drawn uniformly from the genome; also returns where each one starts."""
+        starts = np.random.default_rng(seed).integers(0, len(genome) - chunk_size + 1, num_queries)
+        query_words = _gather_chunks(genome.words, starts, chunk_size)
+        return cls.build(query_words, chunk_size, max_differences, both_strands, edit_distance), starts
+
+    @classmethod
+    def from_fasta(
+        cls,
+        file_path: str,
+        chunk_size: int,
+        max_differences: int,
+        both_strands: bool = False,
+        edit_distance: bool = False,
+    ) -> "QuerySet":
+        """Index a FASTA file with one query per record; records that are not `chunk_size` bases long are skipped."""
+        encoded, contigs, _ = stream_encode_genome(file_path)
+        ends = np.append(contigs.starts[1:], len(encoded))
+        starts = contigs.starts[ends - contigs.starts == chunk_size]
+        if len(starts) < len(contigs):
+            print(f"Skipped {len(contigs) - len(starts)} queries that are not {chunk_size} bases long")
+        query_words = _gather_chunks(pack_genome(encoded), starts, chunk_size)
+        return cls.build(query_words, chunk_size, max_differences, both_strands, edit_distance)
+
+    def write_fasta(self, file_path: str | Path) -> None:
+        """Write the queries one record apiece, so that a sampled set can be reused with `from_fasta`."""
+        with Path(file_path).open("w") as f:
+            for q in range(len(self)):
+                bases = _BASE_LETTERS[PackedGenome(self.words[q], self.chunk_size).unpack()]
+                f.write(f">query{q}\n{bases.tobytes().decode()}\n")
+
+    def scan(self, target: PackedGenome, num_threads: int = 1) -> npt.NDArray[np.int8]:
+        """Stream the target once and return each query's best distance, or `NO_HIT`.
+
+        The target's seed positions are split into one contiguous slice per thread; the kernels release the GIL, and
+        each thread keeps its own distances so the merge is a single elementwise minimum.
+        """
+        def scan_slice(begin: int, end: int) -> npt.NDArray[np.int8]:
+            distances = np.full(self.words.shape[0], NO_HIT, dtype=np.int8)
+            _scan_slice(
+                target.words,
+                len(target),
+                self.words,
+                self.chunk_size,
+                self.max_differences,
+                self.seed_size,
+                self.segment_size,
+                self.num_seeds,
+                self.offsets,
+                self.entries,
+                begin,
+                end,
+                distances,
+                self.pattern_masks,
+            )
+            return distances
+
+        partials = map_slices(scan_slice, split_range(len(target) - self.seed_size + 1, num_threads))
+        if not partials:
+            return np.full(len(self), NO_HIT, dtype=np.int8)
+
+        distances = partials[0]
+        for partial in partials[1:]:
+            distances = merge_distances(distances, partial)
+        if self.num_strands == 2:
+            distances = merge_distances(distances[: len(self)], distances[len(self) :])
+        return distances
+
+
+def hit_bitmap(distances: npt.NDArray[np.int8]) -> npt.NDArray[np.uint8]:
+    """Pack per-query hits into a bitmap, query `q` in bit `7 - q % 8` of byte `q // 8`."""
+    return np.packbits(distances != NO_HIT)
@@ -0,0 +1,221 @@
+"""
+Persistent, content-addressed store of comparison results, so that re-running with the same genomes (or adding one
+more outgroup) only scans what was never scanned before.
+
+Results live in one SQLite database that any number of worker processes share:
+
+    chunks   whether a chunk matches a target, keyed by (target key, packed chunk words, chunk size, max differences,
+             strands searched, edit distance or not)
+    totals   `find_matches` counts, keyed by (target key, query key, chunk size, max differences, strands searched, edit
+             distance or not)
+
+Target and query keys identify genome contents (see `genome_key`), so a result is reused whatever file path or
+engine produced it. Rows carry their last-use time and the least recently used ones are deleted once the database
+outgrows its size cap. A database written with another `RESULTS_VERSION` is emptied when opened, since its results
+can't be told apart.
+"""
+
+import sqlite3
+import time
+from pathlib import Path
+
+import numpy as np
+import numpy.typing as npt
+
+from genome_cache import CACHE_DIR, CachedGenome, bases_digest
+from genome_comparison import PackedGenome
+
+RESULTS_PATH = CACHE_DIR / "results.sqlite"
+# Bump whenever the meaning of stored results or the schema changes
+RESULTS_VERSION = 4
+DEFAULT_MAX_RESULTS_BYTES = 4 * 2**30
+
+# Result of a chunk that is not in the store
+UNKNOWN = -1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    target BLOB NOT NULL,
+    chunk BLOB NOT NULL,
+    chunk_size INTEGER NOT NULL,
+    max_differences INTEGER NOT NULL,
+    both_strands INTEGER NOT NULL,
+    edit_distance INTEGER NOT NULL,
+    matched INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (target, chunk, chunk_size, max_differences, both_strands, edit_distance)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS chunks_last_used ON chunks (last_used);
+CREATE TABLE IF NOT EXISTS totals (
+    target BLOB NOT NULL,
+    query BLOB NOT NULL,
+    chunk_size INTEGER NOT NULL,
+    max_differences INTEGER NOT NULL,
+    both_strands INTEGER NOT NULL,
+    edit_distance INTEGER NOT NULL,
+    matching_chunks INTEGER NOT NULL,
+    total_chunks INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (target, query, chunk_size, max_differences, both_strands, edit_distance)
+) WITHOUT ROWID;
+"""
+_CHUNK_COLUMNS = "target, chunk, chunk_size, max_differences, both_strands, edit_distance"
+_CHUNK_KEY = (
+    "target = ? AND chunk = ? AND chunk_size = ? AND max_differences = ? AND both_strands = ? AND edit_distance = ?"
+)
+_TOTALS_KEY = (
+    "target = ? AND query = ? AND chunk_size = ? AND max_differences = ? AND both_strands = ? AND edit_distance = ?"
+)
+# Inserts between size checks
+_EVICT_CHECK_INTERVAL = 10_000
+# Fraction of the size cap left free after an eviction
+_EVICT_FRACTION = 0.1
+
+
+def genome_key(genome: CachedGenome | PackedGenome) -> bytes:
+    """Content key of a genome: the digest of its packed bases, read from the header of a genome cache entry (free)
+    or hashed otherwise, so a genome gets the same results whether it is cached or encoded in memory."""
+    if isinstance(genome, CachedGenome):
+        return genome.bases_hash
+    return bases_digest(genome)
+
+
+class ResultCache:
+    """Connection to a result store; pickling sends only the path and unpickling reconnects."""
+
+    def __init__(self, path: str | Path = RESULTS_PATH, max_bytes: int = DEFAULT_MAX_RESULTS_BYTES):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(self.path, timeout=60)
+        # Readers and the one writer at a time don't block each other
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        (version,) = self._connection.execute("PRAGMA user_version").fetchone()
+        if version != RESULTS_VERSION:
+            self._connection.executescript(
+                "DROP TABLE IF EXISTS chunks; DROP TABLE IF EXISTS totals; "
+                f"PRAGMA user_version = {RESULTS_VERSION};"
+            )
+        self._connection.executescript(_SCHEMA)
+        self._inserts = 0
+
+    def __reduce__(self) -> tuple:
+        return ResultCache, (self.path, self.max_bytes)
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def lookup(
+        self,
+        target: bytes,
+        chunk_words: npt.NDArray[np.uint64],
+        chunk_size: int,
+        max_differences: int,
+        both_strands: bool = False,
+        edit_distance: bool = False,
+    ) -> npt.NDArray[np.int8]:
+        """Stored result of every chunk, one row of packed words per chunk: 1 if it matches, 0 if not, or `UNKNOWN`."""
+        results = np.full(len(chunk_words), UNKNOWN, dtype=np.int8)
+        keys = [row.tobytes() for row in chunk_words]
+        hits = []
+        for c, chunk in enumerate(keys):
+            key = (target, chunk, chunk_size, max_differences, both_strands, edit_distance)
+            row = self._connection.execute(f"SELECT matched FROM chunks WHERE {_CHUNK_KEY}", key).fetchone()
+            if row is not None:
+                results[c] = row[0]
+                hits.append((time.time(), *key))
+        if hits:
+            with self._connection:
+                self._connection.executemany(f"UPDATE chunks SET last_used = ? WHERE {_CHUNK_KEY}", hits)
+        return results
+
+    def store(
+        self,
+        target: bytes,
+        chunk_words: npt.NDArray[np.uint64],
+        chunk_size: int,
+        max_differences: int,
+        matched: npt.NDArray[np.bool_],
+        both_strands: bool = False,
+        edit_distance: bool = False,
+    ) -> None:
+        now = time.time()
+        rows = [
+            (target, words.tobytes(), chunk_size, max_differences, both_strands, edit_distance, int(match), now)
+            for words, match in zip(chunk_words, matched)
+        ]
+        with self._connection:
+            self._connection.executemany("INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        self._inserts += len(rows)
+        if self._inserts >= _EVICT_CHECK_INTERVAL:
+            self._inserts = 0
+            self.evict()
+
+    def lookup_totals(
+        self,
+        target: bytes,
+        query: bytes,
+        chunk_size: int,
+        max_differences: int,
+        both_strands: bool = False,
+        edit_distance: bool = False,
+    ) -> tuple[int, int] | None:
+        """Stored `(matching_chunks, total_chunks)` of a whole-genome comparison, if any."""
+        key = (target, query, chunk_size, max_differences, both_strands, edit_distance)
+        row = self._connection.execute(
+            f"SELECT matching_chunks, total_chunks FROM totals WHERE {_TOTALS_KEY}", key
+        ).fetchone()
+        if row is None:
+            return None
+        with self._connection:
+            self._connection.execute(f"UPDATE totals SET last_used = ? WHERE {_TOTALS_KEY}", (time.time(), *key))
+        return row[0], row[1]
+
+    def store_totals(
+        self,
+        target: bytes,
+        query: bytes,
+        chunk_size: int,
+        max_differences: int,
+        matching_chunks: int,
+        total_chunks: int,
+        both_strands: bool = False,
+        edit_distance: bool = False,
+    ) -> None:
+        row = (target, query, chunk_size, max_differences, both_strands, edit_distance, matching_chunks, total_chunks)
+        with self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO totals VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", (*row, time.time())
+            )
+
+    def size(self) -> int:
+        """Bytes of the database that hold rows; freed pages are reused before the file grows again."""
+        page_size, page_count, free_pages = (
+            self._connection.execute(f"PRAGMA {pragma}").fetchone()[0]
+            for pragma in ("page_size", "page_count", "freelist_count")
+        )
+        return page_size * (page_count - free_pages)
+
+    def evict(self) -> int:
+        """Delete least recently used chunk results until the store fits in `max_bytes`; returns the rows deleted.
+
+        Deleted rows leave their pages partly empty rather than free, so the number of rows to delete is estimated from
+        the average row size, and the database is vacuumed afterwards to give the space back.
+        """
+        size = self.size()
+        if size <= self.max_bytes:
+            return 0
+        (num_rows,) = self._connection.execute("SELECT count(*) FROM chunks").fetchone()
+        if num_rows == 0:
+            return 0
+        # Leave some headroom below the cap so the next inserts don't evict again straight away
+        keep = int(num_rows * self.max_bytes * (1 - _EVICT_FRACTION) / size)
+        with self._connection:
+            deleted = self._connection.execute(
+                f"DELETE FROM chunks WHERE ({_CHUNK_COLUMNS}) IN "
+                f"(SELECT {_CHUNK_COLUMNS} FROM chunks ORDER BY last_used LIMIT ?)",
+                (num_rows - keep,),
+            ).rowcount
+        self._connection.execute("VACUUM")
+        return deleted
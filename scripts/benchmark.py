@@ -0,0 +1,332 @@
+import argparse
+import json
+import os
+import resource
+import tempfile
+from collections.abc import Callable
+from pathlib import Path
+from time import perf_counter
+from typing import Any
+
+import numpy as np
+
+from genome_comparison import (
+    ENGINES,
+    GenomeIndex,
+    PackedGenome,
+    _encode_genome,
+    compare_chunk,
+    find_matches,
+    seed_size_for,
+    stream_encode_genome,
+)
+from synthetic_genomes import PlantedMatches, write_synthetic_fasta
+
+# Metrics where a larger value is a regression, and how far they may grow in absolute terms before it counts, so that
+# noise on tiny values (a 20 ms kernel load) doesn't fail the run. `first_call_seconds` is the first call on a tiny
+# input: loading the kernels from the Numba cache (`cache=True`), or compiling them when the cache is cold, so a
+# baseline is recorded with a warm cache. `peak_rss_mb` is the peak resident set size during the stage, and
+# `worker_peak_rss_mb` that of the largest worker process of the simulation.
+LOWER_IS_BETTER = {"first_call_seconds": 0.5, "peak_rss_mb": 50.0, "worker_peak_rss_mb": 50.0}
+HIGHER_IS_BETTER = ("bases_per_second", "queries_per_second")
+
+# Recorded with `--threads 1 --output scripts/benchmark_baseline.json` and the default parameters otherwise; the speeds
+# are those of the machine it was recorded on, so record a baseline of your own before comparing on other hardware.
+# A run with `--baseline` takes the parameters it isn't given from the baseline, so that the two are comparable.
+BASELINE_PATH = Path(__file__).with_name("benchmark_baseline.json")
+
+# Parameters that must match the baseline for the numbers to be comparable
+_COMPARED_PARAMETERS = (
+    "bases",
+    "mutation_rate",
+    "planted",
+    "queries",
+    "chunk_size",
+    "max_differences",
+    "both_strands",
+    "find_bases",
+    "samples",
+    "threads",
+    "seed",
+)
+
+
+def timed(function: Callable[[], Any]) -> tuple[Any, float]:
+    start = perf_counter()
+    result = function()
+    return result, perf_counter() - start
+
+
+def reset_peak_rss() -> None:
+    """Start a new stage's peak resident set size, on Linux; elsewhere the peak stays that of the whole process."""
+    try:
+        Path("/proc/self/clear_refs").write_text("5")
+    except OSError:
+        pass
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process since `reset_peak_rss`; Linux reports kB."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def worker_peak_rss_mb() -> float:
+    """Peak resident set size of the largest child process that has exited."""
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+
+
+def find_regressions(stages: dict[str, dict], baseline: dict[str, dict], threshold: float) -> list[str]:
+    """Describe every metric that is more than `threshold` (a fraction) worse than its baseline value."""
+    regressions = []
+    for stage, metrics in stages.items():
+        for name, value in metrics.items():
+            previous = baseline.get(stage, {}).get(name)
+            if previous is None:
+                continue
+            if name in HIGHER_IS_BETTER and value < previous * (1 - threshold):
+                regressions.append(f"{stage} {name}: {value:,.1f} < {previous:,.1f}")
+            elif name in LOWER_IS_BETTER and value > max(previous * (1 + threshold), previous + LOWER_IS_BETTER[name]):
+                regressions.append(f"{stage} {name}: {value:,.2f} > {previous:,.2f}")
+    return regressions
+
+
+def benchmark_encoding(target_path: Path, warmup_path: Path) -> dict[str, dict]:
+    reset_peak_rss()
+    _, first_call_seconds = timed(lambda: stream_encode_genome(str(warmup_path)))
+    _, _, stats = stream_encode_genome(str(target_path))
+    stages = {
+        "read_and_encode_genome": {
+            "bases_per_second": stats.bases_per_second,
+            "first_call_seconds": first_call_seconds,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+    }
+
+    raw = np.fromfile(target_path, dtype=np.int8, count=64 * 2**20)
+    reset_peak_rss()
+    _, first_call_seconds = timed(lambda: _encode_genome(raw[:100]))
+    encoded, seconds = timed(lambda: _encode_genome(raw))
+    stages["_encode_genome"] = {
+        "bases_per_second": len(encoded) / seconds,
+        "first_call_seconds": first_call_seconds,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    return stages
+
+
+def benchmark_engine(
+    engine: str,
+    query: PackedGenome,
+    target: PackedGenome,
+    planted: PlantedMatches,
+    args: argparse.Namespace,
+    failures: list[str],
+) -> dict[str, dict]:
+    """Time `compare_chunk` on the planted chunks plus random query chunks, then `find_matches` on a query prefix."""
+    chunk_size, max_differences = args.chunk_size, args.max_differences
+    tiny = PackedGenome.from_encoded(np.zeros(2 * chunk_size, dtype=np.int8))
+    stages = {}
+
+    if engine == "index":
+        seed_size = seed_size_for(chunk_size, max_differences)
+        reset_peak_rss()
+        _, first_call_seconds = timed(lambda: GenomeIndex.build(tiny, seed_size))
+        searched, seconds = timed(lambda: GenomeIndex.build(target, seed_size))
+        searched_tiny = GenomeIndex.build(tiny, seed_size)
+        stages["GenomeIndex.build"] = {
+            "bases_per_second": len(target) / seconds,
+            "first_call_seconds": first_call_seconds,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+
+        def compare(chunk: PackedGenome, index: GenomeIndex) -> bool:
+            return index.compare_chunk(chunk, max_differences, args.both_strands)
+
+        def count(query_genome: PackedGenome, index: GenomeIndex) -> tuple[int, int]:
+            return index.find_matches(query_genome, chunk_size, max_differences, args.threads, args.both_strands)
+
+    else:
+        searched, searched_tiny = target, tiny
+
+        def compare(chunk: PackedGenome, target_genome: PackedGenome) -> bool:
+            return compare_chunk(chunk, target_genome, max_differences, args.threads, args.both_strands)
+
+        def count(query_genome: PackedGenome, target_genome: PackedGenome) -> tuple[int, int]:
+            return find_matches(
+                query_genome, target_genome, chunk_size, max_differences, args.threads, args.both_strands
+            )
+
+    starts = np.random.default_rng(args.seed).integers(0, len(query) - chunk_size + 1, args.queries)
+    planted_chunks = [query.chunk(int(start), chunk_size) for start in planted.query_starts]
+    random_chunks = [query.chunk(int(start), chunk_size) for start in starts]
+    reset_peak_rss()
+    _, first_call_seconds = timed(lambda: compare(tiny.chunk(0, chunk_size), searched_tiny))
+    hits, seconds = timed(lambda: [compare(chunk, searched) for chunk in planted_chunks + random_chunks])
+    stages[f"compare_chunk/{engine}"] = {
+        "queries_per_second": len(hits) / seconds if hits else 0.0,
+        "first_call_seconds": first_call_seconds,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    missed = len(planted) - sum(hits[: len(planted)])
+    if missed:
+        failures.append(f"compare_chunk/{engine} missed {missed} of {len(planted)} planted matches")
+    print(f"  compare_chunk/{engine}: {sum(hits[len(planted):])} of {args.queries} random query chunks match")
+
+    prefix = query.chunk(0, min(args.find_bases, len(query)))
+    reset_peak_rss()
+    _, first_call_seconds = timed(lambda: count(tiny, searched_tiny))
+    (matching_chunks, total_chunks), seconds = timed(lambda: count(prefix, searched))
+    stages[f"find_matches/{engine}"] = {
+        "queries_per_second": total_chunks / seconds if total_chunks > 0 else 0.0,
+        "first_call_seconds": first_call_seconds,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    planted_in_prefix = int((planted.query_starts + chunk_size <= len(prefix)).sum())
+    if matching_chunks < planted_in_prefix:
+        failures.append(
+            f"find_matches/{engine} found {matching_chunks} matching chunks but {planted_in_prefix} were planted"
+        )
+    return stages
+
+
+def benchmark_simulation(query_path: Path, target_path: Path, args: argparse.Namespace) -> dict[str, dict]:
+    # The Flask app is only needed for this stage
+    from app import Simulation, SimulationConfig
+
+    config = SimulationConfig(
+        chunk_size=args.chunk_size,
+        max_differences=args.max_differences,
+        num_processes=args.threads,
+        human_genome_path=str(query_path),
+        target_paths=(str(target_path),),
+        target_names=("Target",),
+        both_strands=args.both_strands,
+        cache_dir="",
+        results_path="",
+        num_samples=args.samples,
+        update_interval=args.samples,
+        seed=args.seed,
+    )
+    simulation = Simulation(config)
+    reset_peak_rss()
+    _, seconds = timed(lambda: simulation.run_simulation(lambda state: None))
+    return {
+        "Simulation.run_simulation": {
+            "queries_per_second": simulation.state.total_comparisons / seconds,
+            "peak_rss_mb": peak_rss_mb(),
+            # The workers are the only child processes of the benchmark
+            "worker_peak_rss_mb": worker_peak_rss_mb(),
+        }
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the encoding and matching stages on synthetic genomes with planted matches."
+    )
+    parser.add_argument("--bases", type=float, default=1e6, help="Bases per synthetic genome (default: 1e6)")
+    parser.add_argument(
+        "--mutation-rate",
+        type=float,
+        default=1.0,
+        help="Probability that a query base is redrawn; 1.0 makes the query unrelated to the target (default: 1.0)",
+    )
+    parser.add_argument("--planted", type=int, default=100, help="Near-matches planted in the query (default: 100)")
+    parser.add_argument("--queries", type=int, default=100, help="Random query chunks for compare_chunk (default: 100)")
+    parser.add_argument("--chunk-size", type=int, default=40, help="Size of genome chunks (default: 40)")
+    parser.add_argument("--max-differences", type=int, default=5, help="Maximum allowed differences (default: 5)")
+    parser.add_argument("--both-strands", action="store_true", help="Plant and match reverse-strand chunks too")
+    parser.add_argument(
+        "--find-bases", type=int, default=5_000, help="Query bases compared by find_matches (default: 5000)"
+    )
+    parser.add_argument("--samples", type=int, default=2_000, help="Simulation samples, 0 to skip (default: 2000)")
+    parser.add_argument(
+        "--engines", nargs="+", choices=ENGINES, default=list(ENGINES), help="Engines to benchmark (default: all)"
+    )
+    parser.add_argument("--threads", type=int, default=os.cpu_count(), help="Threads and processes (default: all)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic genomes (default: 0)")
+    parser.add_argument(
+        "--work-dir", type=str, help="Directory for the synthetic FASTA files, reused if present (default: a temp dir)"
+    )
+    parser.add_argument("--output", type=str, help="Write the results to this JSON file")
+    parser.add_argument(
+        "--baseline",
+        type=str,
+        help=f"Fail if any metric regressed against this JSON results file, e.g. scripts/{BASELINE_PATH.name}; "
+        "parameters that aren't given are taken from it",
+    )
+    parser.add_argument(
+        "--threshold", type=float, default=0.2, help="Allowed fraction of regression against the baseline (0.2)"
+    )
+
+    known, _ = parser.parse_known_args()
+    if known.baseline:
+        baseline = json.loads(Path(known.baseline).read_text())
+        parser.set_defaults(**baseline["parameters"])
+    args = parser.parse_args()
+    args.bases = int(args.bases)
+    parameters = {name: getattr(args, name) for name in _COMPARED_PARAMETERS}
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        work_dir = Path(args.work_dir or temp_dir)
+        work_dir.mkdir(parents=True, exist_ok=True)
+        name = f"synthetic_{args.bases}_{args.mutation_rate}_{args.planted}_{int(args.both_strands)}_{args.seed}"
+        query_path, target_path = work_dir / f"{name}_query.fa", work_dir / f"{name}_target.fa"
+        planted_path = work_dir / f"{name}_planted.npz"
+        if planted_path.exists():
+            planted = PlantedMatches.load(planted_path)
+        else:
+            print(f"Writing synthetic genomes of {args.bases:,} bases to {work_dir}")
+            planted = write_synthetic_fasta(
+                query_path,
+                target_path,
+                args.bases,
+                args.mutation_rate,
+                args.planted,
+                args.chunk_size,
+                args.max_differences,
+                args.seed,
+                args.both_strands,
+            )
+            planted.save(planted_path)
+        warmup_path = work_dir / "warmup.fa"
+        warmup_path.write_text(">warmup\nACGT\n")
+
+        failures: list[str] = []
+        print("Benchmarking encoding...")
+        stages = benchmark_encoding(target_path, warmup_path)
+        query = PackedGenome.from_encoded(stream_encode_genome(str(query_path))[0])
+        target = PackedGenome.from_encoded(stream_encode_genome(str(target_path))[0])
+        for engine in args.engines:
+            print(f"Benchmarking the {engine} engine...")
+            stages.update(benchmark_engine(engine, query, target, planted, args, failures))
+        if args.samples:
+            print("Benchmarking the simulation...")
+            stages.update(benchmark_simulation(query_path, target_path, args))
+
+    for stage, metrics in stages.items():
+        print(f"{stage}: " + ", ".join(f"{name} {value:,.2f}" for name, value in metrics.items()))
+
+    results = {"parameters": parameters, "stages": stages}
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2) + "\n")
+        print(f"Results saved to {args.output}")
+
+    if args.baseline:
+        if baseline["parameters"] != parameters:
+            raise SystemExit(f"Baseline {args.baseline} was run with other parameters: {baseline['parameters']}")
+        failures += find_regressions(stages, baseline["stages"], args.threshold)
+
+    if failures:
+        raise SystemExit("Benchmark failed:\n  " + "\n  ".join(failures))
+
+
+if __name__ == "__main__":
+    main()
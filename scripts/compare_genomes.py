@@ -1,24 +1,111 @@
 import argparse
+import os
+from collections.abc import Iterator
+from contextlib import contextmanager
 from pathlib import Path
 from time import perf_counter
+from typing import TYPE_CHECKING
 
 import numpy as np
-import polars as pl
-from tqdm import tqdm
 
-from genome_comparison import read_and_encode_genome, find_matches
+from distributed import AUTHKEY_VARIABLE, RemoteExecutor, find_matches_sharded, parse_address, start_local_workers
+from genome_cache import CACHE_DIR, CachedGenome, load_cached_genome
+from genome_comparison import (
+    ENGINES,
+    MAX_EDIT_CHUNK_SIZE,
+    Genome,
+    GenomeIndex,
+    PackedGenome,
+    find_matches,
+    seed_size_for,
+    stream_encode_genome,
+)
+from genome_sketch import DEFAULT_SCALED, MAX_KMER_SIZE, load_sketch
+from query_scan import NO_HIT, QuerySet
+from result_cache import RESULTS_PATH, ResultCache, genome_key
+
+if TYPE_CHECKING:
+    # Importing Polars takes a quarter of a second, and the frames are only built once the comparison is done
+    import polars as pl
 
 
 def compare_genomes(
     species1: str,
-    genome1: np.ndarray,
+    genome1: Genome | CachedGenome,
     species2: str,
-    genome2: np.ndarray,
+    genome2: Genome | CachedGenome,
     chunk_size: int = 40,
     max_differences: int = 5,
-) -> pl.DataFrame:
-    """Compare two genomes and return matches as a Polars DataFrame."""
-    matching_chunks, total_chunks = find_matches(genome1, genome2, chunk_size, max_differences)
+    engine: str = "scan",
+    num_threads: int = 1,
+    results: ResultCache | None = None,
+    both_strands: bool = False,
+    executor: RemoteExecutor | None = None,
+    genome_paths: tuple[str, str] = ("", ""),
+    cache_dir: str = str(CACHE_DIR),
+    index: GenomeIndex | None = None,
+    edit_distance: bool = False,
+) -> "pl.DataFrame":
+    """Compare two genomes and return matches as a Polars DataFrame; counts stored in `results` are reused.
+
+    With an `executor`, the query chunks are split into shards counted by distributed workers, which map the genomes
+    at `genome_paths` from their own caches in `cache_dir`. An `index` of genome2 is reused instead of built again.
+    With `edit_distance`, insertions and deletions count towards `max_differences` too. Cached genomes are keyed in
+    `results` by the digest of their bases stored in the cache entry, rather than by hashing their bases again.
+    """
+    keys = None
+    if results is not None:
+        keys = genome_key(genome2), genome_key(genome1), chunk_size, max_differences
+        stored = results.lookup_totals(*keys, both_strands, edit_distance)
+        if stored is not None:
+            print("Reusing stored comparison result")
+            return _result_frame(species1, species2, *stored)
+    genome1, genome2 = _packed(genome1), _packed(genome2)
+
+    if executor is not None:
+        matching_chunks, total_chunks = find_matches_sharded(
+            executor,
+            *genome_paths,
+            len(genome1),
+            chunk_size,
+            max_differences,
+            engine,
+            both_strands,
+            cache_dir,
+            num_threads,
+            edit_distance,
+        )
+    elif engine == "index":
+        if index is None:
+            index = GenomeIndex.build(genome2, seed_size_for(chunk_size, max_differences))
+        matching_chunks, total_chunks = index.find_matches(
+            genome1, chunk_size, max_differences, num_threads, both_strands, edit_distance
+        )
+    else:
+        matching_chunks, total_chunks = find_matches(
+            genome1, genome2, chunk_size, max_differences, num_threads, both_strands, edit_distance
+        )
+
+    if results is not None:
+        results.store_totals(*keys, matching_chunks, total_chunks, both_strands, edit_distance)
+
+    return _result_frame(species1, species2, matching_chunks, total_chunks)
+
+
+def compare_query_set(
+    species1: str, queries: QuerySet, species2: str, genome2: PackedGenome, num_threads: int = 1
+) -> tuple["pl.DataFrame", "pl.DataFrame"]:
+    """Scan the target once against an indexed query set; returns the summary row and the per-query hits."""
+    import polars as pl
+
+    distances = queries.scan(genome2, num_threads)
+    hits = np.flatnonzero(distances != NO_HIT)
+    hits_frame = pl.DataFrame({"query": hits, "distance": distances[hits]})
+    return _result_frame(species1, species2, len(hits), len(queries)), hits_frame
+
+
+def _result_frame(species1: str, species2: str, matching_chunks: int, total_chunks: int) -> "pl.DataFrame":
+    import polars as pl
 
     return pl.DataFrame(
         {
@@ -31,31 +118,382 @@ def compare_genomes(
     )
 
 
+# Columns that identify a row of the comparison matrix: a pair compared with given parameters
+MATRIX_KEY = ("query_species", "target_species", "chunk_size", "max_differences", "both_strands", "edit_distance")
+
+
+def read_manifest(path: str | Path) -> list[tuple[str, str]]:
+    """`(name, path)` of every genome in a CSV manifest with `name` and `path` columns; relative paths are relative to
+    the manifest."""
+    import polars as pl
+
+    manifest = pl.read_csv(path)
+    missing = {"name", "path"} - set(manifest.columns)
+    if missing:
+        raise ValueError(f"Manifest {path} has no {', '.join(sorted(missing))} column")
+    names = manifest["name"].to_list()
+    if len(set(names)) != len(names):
+        raise ValueError(f"Manifest {path} lists a genome name more than once")
+    return [(name, str(Path(path).parent / genome_path)) for name, genome_path in zip(names, manifest["path"])]
+
+
+def read_results(path: Path) -> "pl.DataFrame | None":
+    """Results written by an earlier run, as Parquet or CSV by file extension."""
+    import polars as pl
+
+    if not path.exists():
+        return None
+    return pl.read_parquet(path) if path.suffix == ".parquet" else pl.read_csv(path)
+
+
+def write_results(frame: "pl.DataFrame", path: Path) -> None:
+    """Replace the results file atomically, so an interrupted write never loses the rows finished before it."""
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    if path.suffix == ".parquet":
+        frame.write_parquet(tmp_path)
+    else:
+        frame.write_csv(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def compare_matrix(
+    genomes: list[tuple[str, str]],
+    output: Path,
+    chunk_size: int = 40,
+    max_differences: int = 5,
+    engine: str = "scan",
+    num_threads: int = 1,
+    results: ResultCache | None = None,
+    both_strands: bool = False,
+    cache_dir: str = str(CACHE_DIR),
+    executor: RemoteExecutor | None = None,
+    edit_distance: bool = False,
+) -> "pl.DataFrame":
+    """Compare every ordered pair of distinct `(name, path)` genomes and return the rows of all pairs in `output`.
+
+    Pairs are grouped by target, so each target is indexed once for all its queries, and every genome is loaded once.
+    A pair uses every thread (or worker) by itself, since one comparison already splits its chunks across them. Each
+    finished pair is written to `output` straight away, and pairs already in it with the same parameters are skipped,
+    so an interrupted run picks up where it stopped.
+    """
+    import polars as pl
+
+    parameters = {
+        "chunk_size": chunk_size,
+        "max_differences": max_differences,
+        "both_strands": both_strands,
+        "edit_distance": edit_distance,
+    }
+    frame = read_results(output)
+    done = set()
+    if frame is not None:
+        finished = frame.filter(**parameters) if set(parameters) <= set(frame.columns) else frame.clear()
+        done = set(zip(finished["query_species"].to_list(), finished["target_species"].to_list()))
+
+    loaded: dict[str, CachedGenome | PackedGenome] = {}
+
+    def genome(name: str, path: str) -> CachedGenome | PackedGenome:
+        if name not in loaded:
+            print(f"Reading and encoding {name}: {path}")
+            loaded[name] = load_genome(path, cache_dir)
+        return loaded[name]
+
+    for target_name, target_path in genomes:
+        pending = [(name, path) for name, path in genomes if name != target_name and (name, target_name) not in done]
+        if not pending:
+            continue
+        target = genome(target_name, target_path)
+        index = None
+        if engine == "index" and executor is None:
+            print(f"Indexing {target_name}")
+            index = GenomeIndex.build(_packed(target), seed_size_for(chunk_size, max_differences))
+        for query_name, query_path in pending:
+            start = perf_counter()
+            row = compare_genomes(
+                query_name,
+                genome(query_name, query_path),
+                target_name,
+                target,
+                chunk_size,
+                max_differences,
+                engine,
+                num_threads,
+                results,
+                both_strands,
+                executor,
+                (query_path, target_path),
+                cache_dir,
+                index,
+                edit_distance,
+            ).with_columns(**{name: pl.lit(value) for name, value in parameters.items()})
+            frame = row if frame is None else pl.concat([frame, row], how="diagonal_relaxed")
+            write_results(frame, output)
+            similarity = row["similarity_percentage"][0]
+            print(f"{query_name} vs {target_name}: {similarity:.4f}% ({perf_counter() - start:.1f} s)")
+    return frame if frame is not None else pl.DataFrame()
+
+
+def sketch_estimates(
+    genomes: list[tuple[str, str]],
+    pairs: list[tuple[str, str]],
+    chunk_size: int = 40,
+    both_strands: bool = False,
+    scaled: int = DEFAULT_SCALED,
+    cache_dir: str = str(CACHE_DIR),
+    num_threads: int = 1,
+) -> "pl.DataFrame":
+    """Pre-flight estimates, from k-mer sketches, of how much of each query genome's `chunk_size`-mers each target
+    holds, for the `(query, target)` name pairs of `(name, path)` genomes.
+
+    Each genome is sketched once, or its sketch is read from next to its entry in `cache_dir`, so that pairs of cached
+    genomes are estimated in milliseconds. The containment is a lower bound on the similarity percentage of an exact
+    comparison, which also counts chunks that match with differences.
+    """
+    import polars as pl
+
+    paths = dict(genomes)
+    sketch_dir = Path(cache_dir) if cache_dir else None
+    sketches = {
+        name: load_sketch(paths[name], sketch_dir, chunk_size, scaled, both_strands, num_threads)
+        for name in dict.fromkeys(name for pair in pairs for name in pair)
+    }
+    return pl.DataFrame(
+        [
+            {"query_species": query, "target_species": target, **sketches[query].compare(sketches[target]).to_dict()}
+            for query, target in pairs
+        ]
+    )
+
+
+def load_genome(path: str, cache_dir: str) -> CachedGenome | PackedGenome:
+    """Map a genome from the encoded-genome cache, or encode it in memory when caching is disabled."""
+    if cache_dir:
+        return load_cached_genome(path, Path(cache_dir))
+    encoded, _, stats = stream_encode_genome(path)
+    print(f"  {stats}")
+    return PackedGenome.from_encoded(encoded)
+
+
+def _packed(genome: Genome | CachedGenome) -> Genome:
+    return genome.packed if isinstance(genome, CachedGenome) else genome
+
+
+@contextmanager
+def remote_executor(args: argparse.Namespace) -> Iterator[RemoteExecutor | None]:
+    """Executor over the distributed workers of the command line, if any, shut down (with any local workers) after."""
+    if not args.workers and not args.local_workers:
+        yield None
+        return
+    local_workers = []
+    if args.local_workers:
+        addresses, local_workers = start_local_workers(args.local_workers)
+    else:
+        addresses = [parse_address(address) for address in args.workers]
+    executor = RemoteExecutor(addresses)
+    try:
+        yield executor
+    finally:
+        executor.shutdown()
+        for process in local_workers:
+            process.terminate()
+
+
 def main() -> None:
-    parser = argparse.ArgumentParser(description="Compare two genomes and find matches.")
-    parser.add_argument("genome1", type=str, help="Path to the first genome file")
-    parser.add_argument("species1", type=str, help="Name of the first species")
-    parser.add_argument("genome2", type=str, help="Path to the second genome file")
-    parser.add_argument("species2", type=str, help="Name of the second species")
+    parser = argparse.ArgumentParser(
+        description="Compare two genomes, or every pair of a set of genomes, and find matches."
+    )
+    parser.add_argument("genome1", type=str, nargs="?", help="Path to the first genome file")
+    parser.add_argument("species1", type=str, nargs="?", help="Name of the first species")
+    parser.add_argument("genome2", type=str, nargs="?", help="Path to the second genome file")
+    parser.add_argument("species2", type=str, nargs="?", help="Name of the second species")
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        help="CSV of genomes (name and path columns) to compare every ordered pair of, instead of genome1 and genome2; "
+        "finished pairs are added to --output (.csv or .parquet) one by one, and pairs already there are skipped",
+    )
     parser.add_argument("--chunk-size", type=int, default=40, help="Size of genome chunks (default: 40)")
     parser.add_argument("--max-differences", type=int, default=5, help="Maximum allowed differences (default: 5)")
+    parser.add_argument(
+        "--engine",
+        choices=ENGINES,
+        default="scan",
+        help="Matching engine: brute-force scan or seed index (default: scan)",
+    )
+    parser.add_argument(
+        "--both-strands",
+        action="store_true",
+        help="Also count chunks that match the reverse strand of genome2, in the same pass over it",
+    )
+    parser.add_argument(
+        "--edit-distance",
+        action="store_true",
+        help="Count insertions and deletions towards --max-differences too, not only substitutions (chunks of at most "
+        f"{MAX_EDIT_CHUNK_SIZE} bases)",
+    )
+    preflight = parser.add_mutually_exclusive_group()
+    preflight.add_argument(
+        "--preflight",
+        action="store_true",
+        help="Print estimates of each comparison from k-mer sketches of the genomes (saved in --cache-dir) first",
+    )
+    preflight.add_argument(
+        "--preflight-only",
+        action="store_true",
+        help="Only estimate each comparison from k-mer sketches, and write the estimates to --output",
+    )
+    parser.add_argument(
+        "--sketch-scaled",
+        type=int,
+        default=DEFAULT_SCALED,
+        help=f"Keep one k-mer in this many in the sketches (default: {DEFAULT_SCALED})",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default=str(CACHE_DIR),
+        help=f"Directory of memory-mapped encoded genomes, empty to disable (default: {CACHE_DIR})",
+    )
+    parser.add_argument(
+        "--results",
+        type=str,
+        default=str(RESULTS_PATH),
+        help=f"Database of stored comparison results to reuse, empty to disable (default: {RESULTS_PATH})",
+    )
     parser.add_argument(
         "--output", type=str, default="genome_comparison.csv", help="Output file name (default: genome_comparison.csv)"
     )
+    query_set = parser.add_mutually_exclusive_group()
+    query_set.add_argument(
+        "--queries", type=str, help="Scan genome2 once against the queries in this FASTA file instead of genome1"
+    )
+    query_set.add_argument(
+        "--sample-queries", type=int, help="Scan genome2 once against this many chunks sampled at random from genome1"
+    )
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for --sample-queries")
+    parser.add_argument("--save-queries", type=str, help="Write the sampled queries to this FASTA file for reuse")
+    parser.add_argument("--hits-output", type=str, help="Write the best distance of every query that hits to this CSV")
+    parser.add_argument(
+        "--threads", type=int, default=os.cpu_count(), help="Threads to split the comparison across (default: all cores)"
+    )
+    workers = parser.add_mutually_exclusive_group()
+    workers.add_argument(
+        "--workers",
+        nargs="+",
+        help="host:port of distributed workers (scripts.distributed_worker) to split the comparison across",
+    )
+    workers.add_argument(
+        "--local-workers", type=int, help="Split the comparison across this many distributed workers on this machine"
+    )
 
     args = parser.parse_args()
+    if args.manifest and (args.genome1 or args.queries or args.sample_queries):
+        parser.error("--manifest replaces genome1, genome2 and the query set options")
+    if not args.manifest and not args.species2:
+        parser.error("Give genome1, species1, genome2 and species2, or a --manifest")
+    distributed = bool(args.workers or args.local_workers)
+    if distributed and (args.queries or args.sample_queries):
+        parser.error("Distributed workers only run whole-genome comparisons, not query sets")
+    if distributed and not args.cache_dir:
+        parser.error("Distributed workers map genomes from their genome cache, so --cache-dir must be set")
+    if args.workers and not os.environ.get(AUTHKEY_VARIABLE):
+        parser.error(f"--workers authenticate with the shared secret in {AUTHKEY_VARIABLE}, which must be set")
+
+    if (args.preflight or args.preflight_only) and args.queries:
+        parser.error("--preflight needs genome1, not a --queries file")
+    if (args.preflight or args.preflight_only) and args.chunk_size > MAX_KMER_SIZE:
+        parser.error(f"Sketches hold k-mers of at most {MAX_KMER_SIZE} bases, so --chunk-size must be at most that")
 
     start_time = perf_counter()
 
-    print(f"Reading and encoding genome1: {args.genome1}")
-    genome1 = read_and_encode_genome(args.genome1)
+    if args.preflight or args.preflight_only:
+        if args.manifest:
+            genomes = read_manifest(args.manifest)
+            pairs = [(query, target) for query, _ in genomes for target, _ in genomes if query != target]
+        else:
+            genomes = [(args.species1, args.genome1), (args.species2, args.genome2)]
+            pairs = [(args.species1, args.species2)]
+        estimates = sketch_estimates(
+            genomes, pairs, args.chunk_size, args.both_strands, args.sketch_scaled, args.cache_dir, args.threads
+        )
+        print(f"Sketch estimates, {perf_counter() - start_time:.2f} seconds after start:\n{estimates}")
+        if args.preflight_only:
+            write_results(estimates, Path(args.output))
+            print(f"Estimates saved to {args.output}")
+            return
+
+    if args.manifest:
+        with remote_executor(args) as executor:
+            result = compare_matrix(
+                read_manifest(args.manifest),
+                Path(args.output),
+                chunk_size=args.chunk_size,
+                max_differences=args.max_differences,
+                engine=args.engine,
+                num_threads=args.threads,
+                results=ResultCache(args.results) if args.results else None,
+                both_strands=args.both_strands,
+                cache_dir=args.cache_dir,
+                executor=executor,
+                edit_distance=args.edit_distance,
+            )
+        print(f"Comparison matrix completed in {perf_counter() - start_time:.2f} seconds.")
+        print(f"Results:\n{result}")
+        print(f"Results saved to {args.output}")
+        return
+
+    queries = None
+    if args.queries:
+        print(f"Indexing queries: {args.queries}")
+        queries = QuerySet.from_fasta(
+            args.queries, args.chunk_size, args.max_differences, args.both_strands, args.edit_distance
+        )
+    else:
+        print(f"Reading and encoding genome1: {args.genome1}")
+        genome1 = load_genome(args.genome1, args.cache_dir)
+        if args.sample_queries:
+            print(f"Sampling and indexing {args.sample_queries} queries")
+            queries, _ = QuerySet.sample(
+                _packed(genome1),
+                args.sample_queries,
+                args.chunk_size,
+                args.max_differences,
+                seed=args.seed,
+                both_strands=args.both_strands,
+                edit_distance=args.edit_distance,
+            )
+    if queries is not None and args.save_queries:
+        queries.write_fasta(args.save_queries)
+        print(f"Queries saved to {args.save_queries}")
     print(f"Reading and encoding genome2: {args.genome2}")
-    genome2 = read_and_encode_genome(args.genome2)
+    genome2 = load_genome(args.genome2, args.cache_dir)
 
-    print("Comparing genomes...")
-    result = compare_genomes(
-        args.species1, genome1, args.species2, genome2, chunk_size=args.chunk_size, max_differences=args.max_differences
-    )
+    print(f"Comparing genomes, {perf_counter() - start_time:.2f} seconds after start...")
+    if queries is not None:
+        result, hits = compare_query_set(
+            args.species1, queries, args.species2, _packed(genome2), num_threads=args.threads
+        )
+        if args.hits_output:
+            hits.write_csv(args.hits_output)
+            print(f"Query hits saved to {args.hits_output}")
+    else:
+        with remote_executor(args) as executor:
+            result = compare_genomes(
+                args.species1,
+                genome1,
+                args.species2,
+                genome2,
+                chunk_size=args.chunk_size,
+                max_differences=args.max_differences,
+                engine=args.engine,
+                num_threads=args.threads,
+                results=ResultCache(args.results) if args.results else None,
+                both_strands=args.both_strands,
+                executor=executor,
+                genome_paths=(args.genome1, args.genome2),
+                cache_dir=args.cache_dir,
+                edit_distance=args.edit_distance,
+            )
 
     end_time = perf_counter()
     elapsed_time = end_time - start_time
@@ -0,0 +1,29 @@
+import argparse
+import os
+
+from distributed import AUTHKEY_VARIABLE, DEFAULT_PORT, serve
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Serve find_matches shards and simulation batches to coordinators. Coordinators can run any code on "
+        f"this node, so it only starts with a shared secret: set {AUTHKEY_VARIABLE} to the same secret on every node."
+    )
+    parser.add_argument(
+        "--host", type=str, default="127.0.0.1", help="Interface to listen on (default: 127.0.0.1)"
+    )
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port to listen on (default: {DEFAULT_PORT})")
+    parser.add_argument(
+        "--authkey",
+        type=str,
+        default=os.environ.get(AUTHKEY_VARIABLE),
+        help=f"Shared secret, instead of {AUTHKEY_VARIABLE} (which keeps it out of the process list)",
+    )
+    args = parser.parse_args()
+    if not args.authkey:
+        parser.error(f"Set {AUTHKEY_VARIABLE} (or --authkey) to a shared secret, the same on every node")
+    serve((args.host, args.port), args.authkey.encode())
+
+
+if __name__ == "__main__":
+    main()
@@ -45,44 +45,56 @@ General Tips:
  internet connection and computer specifications
 """
 
+import argparse
 from pathlib import Path
 
-import requests
-
-
-def download_genome(name: str, url: str, output_path: Path, expected_size: int) -> None:
-    response = requests.get(url, timeout=300)
-    response.raise_for_status()
-
-    if len(response.content) != expected_size:
-        raise ValueError(f"Expected size {expected_size} doesn't match actual size {len(response.content)}")
-
-    output_path.parent.mkdir(parents=True, exist_ok=True)
-    output_path.write_bytes(response.content)
-    print(f"Downloaded {name} genome")
-
-
-if __name__ == "__main__":
-    genomes = (
-        ("Bonobo", "http://bioinf.eva.mpg.de/bonobo/contigs.fa.gz", Path("genomes/bonobo_contigs.fa.gz"), 771_200_739),
-        (
-            "Human",
-            "https://hgdownload.soe.ucsc.edu/goldenPath/hg38/bigZips/hg38.fa.gz",
-            Path("genomes/human_hg38.fa.gz"),
-            872_409_395,
-        ),
-        (
-            "Pig",
-            "ftp://ftp.ensembl.org/pub/release-104/fasta/sus_scrofa/dna/Sus_scrofa.Sscrofa11.1.dna.toplevel.fa.gz",
-            Path("genomes/pig_sscrofa11.1.fa.gz"),
-            2_501_912_388,
-        ),
+from genome_cache import CACHE_DIR
+from genome_download import download_genome
+
+# Name, URL, output path and size in bytes of every genome; the downloads checksum-verify with an MD5 when one is given
+GENOMES = (
+    ("Bonobo", "http://bioinf.eva.mpg.de/bonobo/contigs.fa.gz", Path("genomes/bonobo_contigs.fa.gz"), 771_200_739),
+    (
+        "Human",
+        "https://hgdownload.soe.ucsc.edu/goldenPath/hg38/bigZips/hg38.fa.gz",
+        Path("genomes/human_hg38.fa.gz"),
+        872_409_395,
+    ),
+    (
+        "Pig",
+        "ftp://ftp.ensembl.org/pub/release-104/fasta/sus_scrofa/dna/Sus_scrofa.Sscrofa11.1.dna.toplevel.fa.gz",
+        Path("genomes/pig_sscrofa11.1.fa.gz"),
+        2_501_912_388,
+    ),
+)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Download the genomes, resuming interrupted downloads, and encode each into the genome cache as it "
+        "arrives, so it is ready to map as soon as it is complete."
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default=str(CACHE_DIR),
+        help=f"Directory of memory-mapped encoded genomes, empty to only download (default: {CACHE_DIR})",
     )
+    parser.add_argument("--md5", nargs=2, action="append", metavar=("NAME", "MD5"), help="Expected MD5 of a genome")
+    args = parser.parse_args()
+    checksums = dict(args.md5 or ())
 
-    for name, url, output_path, expected_size in genomes:
-        if not output_path.exists():
-            download_genome(name, url, output_path, expected_size)
-        else:
+    for name, url, output_path, expected_size in GENOMES:
+        if output_path.exists():
             print(f"{name} genome already exists, skipping download")
+            continue
+        stats = download_genome(
+            url, output_path, expected_size, checksums.get(name), Path(args.cache_dir) if args.cache_dir else None
+        )
+        print(f"Downloaded {name} genome" + (f", encoded {stats}" if stats else ""))
 
     print("All downloads completed")
+
+
+if __name__ == "__main__":
+    main()
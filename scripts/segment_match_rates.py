@@ -0,0 +1,176 @@
+import argparse
+import os
+from pathlib import Path
+from time import perf_counter
+from typing import TYPE_CHECKING
+
+from genome_cache import CACHE_DIR, load_cached_genome
+from genome_comparison import ContigTable, PackedGenome, stream_encode_genome
+from query_scan import QuerySet
+from scripts.compare_genomes import load_genome, read_results, write_results
+from segment_scan import SEGMENT_SIZE, scan_segments
+
+if TYPE_CHECKING:
+    import polars as pl
+
+# Columns that identify a run: rows with other values were scanned with other parameters and are never skipped
+RUN_KEY = ("target", "queries", "chunk_size", "max_differences", "both_strands", "edit_distance", "segment_size")
+
+
+def load_target(path: str, cache_dir: str) -> tuple[PackedGenome, ContigTable]:
+    """Map a genome and its records from the encoded-genome cache, or encode it in memory when caching is disabled."""
+    if cache_dir:
+        cached = load_cached_genome(path, Path(cache_dir))
+        return cached.packed, cached.contigs
+    encoded, contigs, stats = stream_encode_genome(path)
+    print(f"  {stats}")
+    return PackedGenome.from_encoded(encoded), contigs
+
+
+def summarize(frame: "pl.DataFrame") -> "pl.DataFrame":
+    """Mean segmental match rate of each chromosome class, over the segments with at least one window."""
+    import polars as pl
+
+    return (
+        frame.drop_nulls("match_rate")
+        .group_by("target", "chromosome_class")
+        .agg(
+            segments=pl.len(),
+            mean_match_rate=pl.col("match_rate").mean(),
+            standard_error=pl.col("match_rate").std() / pl.len().sqrt(),
+        )
+        .sort("target", "chromosome_class")
+    )
+
+
+def main() -> None:
+    import polars as pl
+
+    parser = argparse.ArgumentParser(
+        description="Scan every segment of a target genome against a query set and report per-segment match rates "
+        "by chromosome class. Finished segments are added to --output as they complete, and segments already there "
+        "with the same parameters are skipped, so an interrupted run picks up where it stopped."
+    )
+    parser.add_argument("target_genome", type=str, help="Path to the target genome file")
+    parser.add_argument("target_species", type=str, help="Name of the target species")
+    query_set = parser.add_mutually_exclusive_group(required=True)
+    query_set.add_argument("--queries", type=str, help="FASTA file with one query per record")
+    query_set.add_argument("--query-genome", type=str, help="Genome to sample --sample-queries queries from")
+    parser.add_argument("--sample-queries", type=int, default=813_194, help="Queries to sample (default: 813194)")
+    parser.add_argument(
+        "--seed", type=int, default=0, help="Random seed for sampling, so that a restarted run samples the same queries"
+    )
+    parser.add_argument("--save-queries", type=str, help="Write the sampled queries to this FASTA file for reuse")
+    parser.add_argument(
+        "--segment-size", type=int, default=SEGMENT_SIZE, help=f"Segment size in bases (default: {SEGMENT_SIZE})"
+    )
+    parser.add_argument("--chunk-size", type=int, default=40, help="Size of the queries (default: 40)")
+    parser.add_argument("--max-differences", type=int, default=5, help="Maximum allowed differences (default: 5)")
+    parser.add_argument(
+        "--both-strands", action="store_true", help="Also count queries that match the reverse strand of a segment"
+    )
+    parser.add_argument(
+        "--edit-distance",
+        action="store_true",
+        help="Count insertions and deletions towards --max-differences too, not only substitutions",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default=str(CACHE_DIR),
+        help=f"Directory of memory-mapped encoded genomes, empty to disable (default: {CACHE_DIR})",
+    )
+    parser.add_argument(
+        "--threads", type=int, default=os.cpu_count(), help="Segments to scan in parallel (default: all cores)"
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default="segment_match_rates.parquet",
+        help="Per-segment output file, .parquet or .csv (default: segment_match_rates.parquet)",
+    )
+    parser.add_argument("--summary-output", type=str, help="Write the per-class summary to this CSV")
+    parser.add_argument(
+        "--flush-seconds",
+        type=float,
+        default=30.0,
+        help="Write finished segments to --output at most this often (default: 30)",
+    )
+    args = parser.parse_args()
+
+    start_time = perf_counter()
+    if args.queries:
+        print(f"Indexing queries: {args.queries}")
+        queries = QuerySet.from_fasta(
+            args.queries, args.chunk_size, args.max_differences, args.both_strands, args.edit_distance
+        )
+        queries_label = str(Path(args.queries).resolve())
+    else:
+        print(f"Sampling and indexing {args.sample_queries} queries from {args.query_genome}")
+        queries, _ = QuerySet.sample(
+            load_genome(args.query_genome, args.cache_dir),
+            args.sample_queries,
+            args.chunk_size,
+            args.max_differences,
+            seed=args.seed,
+            both_strands=args.both_strands,
+            edit_distance=args.edit_distance,
+        )
+        queries_label = f"{Path(args.query_genome).resolve()}:{args.sample_queries}:{args.seed}"
+        if args.save_queries:
+            queries.write_fasta(args.save_queries)
+            print(f"Queries saved to {args.save_queries}")
+
+    print(f"Reading and encoding the target: {args.target_genome}")
+    target, contigs = load_target(args.target_genome, args.cache_dir)
+
+    parameters = {
+        "target": args.target_species,
+        "queries": queries_label,
+        "chunk_size": args.chunk_size,
+        "max_differences": args.max_differences,
+        "both_strands": args.both_strands,
+        "edit_distance": args.edit_distance,
+        "segment_size": args.segment_size,
+    }
+    output = Path(args.output)
+    frame = read_results(output)
+    done = set()
+    if frame is not None:
+        finished = frame.filter(**parameters) if set(RUN_KEY) <= set(frame.columns) else frame.clear()
+        done = set(zip(finished["record"].to_list(), finished["segment"].to_list()))
+        print(f"Skipping {len(done)} segments already in {output}")
+
+    print(f"Scanning segments, {perf_counter() - start_time:.2f} seconds after start...")
+    rows, last_flush, num_scanned = [], perf_counter(), 0
+
+    def flush() -> None:
+        nonlocal frame, rows, last_flush
+        if rows:
+            new = pl.DataFrame(rows).with_columns(**{name: pl.lit(value) for name, value in parameters.items()})
+            frame = new if frame is None else pl.concat([frame, new], how="diagonal_relaxed")
+            write_results(frame, output)
+        rows, last_flush = [], perf_counter()
+
+    for row in scan_segments(target, contigs, queries, args.segment_size, args.threads, skip=done):
+        rows.append(row)
+        num_scanned += 1
+        if perf_counter() - last_flush >= args.flush_seconds:
+            flush()
+            print(f"  {num_scanned} segments scanned")
+    flush()
+
+    print(f"Segment scan completed in {perf_counter() - start_time:.2f} seconds.")
+    if frame is None:
+        print("No segments to scan")
+        return
+    summary = summarize(frame.filter(**parameters))
+    print(f"Mean segmental match rates:\n{summary}")
+    print(f"Per-segment results saved to {args.output}")
+    if args.summary_output:
+        summary.write_csv(args.summary_output)
+        print(f"Summary saved to {args.summary_output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Per-segment match rates of a target genome against a query set, the metric of the BOOMSTICK paper.
+
+Each FASTA record of the target is cut into segments of `SEGMENT_SIZE` letters, counted in the record as it appears in
+the file (gaps of `N`s included), so segment boundaries don't depend on how much of the record could be sequenced.
+Every segment is scanned against the same `QuerySet`, and a segment's match rate is the fraction of the queries that
+match somewhere within it. Windows never cross a record junction or a gap: each run of contiguous bases in a segment is
+scanned on its own. Segments are then grouped by chromosome class (autosomes, X, Y) to compare mean segmental match
+rates.
+
+Segments are independent of each other, so they are scanned in parallel and reported as they finish, and a restarted
+run can skip the segments it already has.
+"""
+
+import re
+from collections.abc import Container, Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Any
+
+import numpy as np
+import numpy.typing as npt
+
+from genome_comparison import ContigTable, PackedGenome
+from query_scan import NO_HIT, QuerySet, merge_distances
+
+SEGMENT_SIZE = 100_000
+
+CHROMOSOME_CLASSES = ("autosome", "X", "Y", "other")
+
+# Numbered chromosomes, including the 2a and 2b of the great apes
+_AUTOSOME_NAME = re.compile(r"\d+[ab]?", re.IGNORECASE)
+
+
+def chromosome_class(name: str) -> str:
+    """Class of a record named like `chr7`, `7`, `chr2a` or `chrX`; unplaced scaffolds, the mitochondrion and anything
+    else are `other`."""
+    if name[:3].lower() == "chr":
+        name = name[3:]
+    if name.upper() in ("X", "Y"):
+        return name.upper()
+    return "autosome" if _AUTOSOME_NAME.fullmatch(name) else "other"
+
+
+@dataclass(frozen=True)
+class Segment:
+    """Segment `index` of record `contig`, letters `[start, end)` of the record, gaps included."""
+
+    contig: int
+    index: int
+    start: int
+    end: int
+
+
+def record_lengths(contigs: ContigTable, genome_length: int) -> npt.NDArray[np.int64]:
+    """Length of every record as it appears in the FASTA file, gap letters included."""
+    ends = np.append(contigs.starts[1:], genome_length)
+    in_record = contigs.gap_contigs >= 0
+    gap_letters = np.bincount(
+        contigs.gap_contigs[in_record], weights=contigs.gap_lengths[in_record], minlength=len(contigs)
+    )
+    return ends - contigs.starts + gap_letters.astype(np.int64)
+
+
+def segments(contigs: ContigTable, genome_length: int, segment_size: int = SEGMENT_SIZE) -> list[Segment]:
+    """Every segment of every record; the last segment of a record is shorter unless the record fills it."""
+    return [
+        Segment(contig, index, start, min(start + segment_size, length))
+        for contig, length in enumerate(record_lengths(contigs, genome_length).tolist())
+        for index, start in enumerate(range(0, length, segment_size))
+    ]
+
+
+def scan_segment(
+    target: PackedGenome, contigs: ContigTable, queries: QuerySet, segment: Segment
+) -> tuple[int, int, npt.NDArray[np.int8]]:
+    """Scan the contiguous runs of bases in a segment; returns its number of bases and of query-length windows, and
+    each query's best distance within it."""
+    begin, end = contigs.to_encoded(segment.contig, np.array([segment.start, segment.end])).tolist()
+    breaks = contigs.breaks
+    bounds = [begin, *breaks[(breaks > begin) & (breaks < end)].tolist(), end]
+    distances = np.full(len(queries), NO_HIT, dtype=np.int8)
+    num_windows = 0
+    for run_begin, run_end in zip(bounds[:-1], bounds[1:]):
+        if run_end - run_begin < queries.chunk_size:
+            continue
+        distances = merge_distances(distances, queries.scan(target.chunk(run_begin, run_end - run_begin)))
+        num_windows += run_end - run_begin - queries.chunk_size + 1
+    return end - begin, num_windows, distances
+
+
+def _segment_row(target: PackedGenome, contigs: ContigTable, queries: QuerySet, segment: Segment) -> dict[str, Any]:
+    bases, num_windows, distances = scan_segment(target, contigs, queries, segment)
+    matching_queries = int(np.count_nonzero(distances != NO_HIT))
+    name = contigs.names[segment.contig]
+    return {
+        "record": name,
+        "chromosome_class": chromosome_class(name),
+        "segment": segment.index,
+        "start": segment.start,
+        "end": segment.end,
+        "bases": bases,
+        "windows": num_windows,
+        "matching_queries": matching_queries,
+        "match_rate": matching_queries / len(queries) if num_windows else None,
+    }
+
+
+def scan_segments(
+    target: PackedGenome,
+    contigs: ContigTable,
+    queries: QuerySet,
+    segment_size: int = SEGMENT_SIZE,
+    num_threads: int = 1,
+    skip: Container[tuple[str, int]] = (),
+) -> Iterator[dict[str, Any]]:
+    """Scan every segment not in `skip` (by record name and segment index) and yield one row per segment, in the
+    order they finish.
+
+    Segments without a single window, such as those entirely in a gap, are yielded too, with no match rate, so that a
+    restarted run skips them as well.
+    """
+    pending = [
+        segment
+        for segment in segments(contigs, len(target), segment_size)
+        if (contigs.names[segment.contig], segment.index) not in skip
+    ]
+    # The scan kernels release the GIL, so threads scan segments in parallel
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        futures = [executor.submit(_segment_row, target, contigs, queries, segment) for segment in pending]
+        for future in as_completed(futures):
+            yield future.result()
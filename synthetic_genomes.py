@@ -0,0 +1,189 @@
+"""
+Deterministic synthetic genome pairs for benchmarks and engine tests.
+
+The target genome is drawn uniformly at random and the query genome is a mutated copy of it, into which a known set of
+near-matches is planted: chunks copied from random target positions, optionally reverse complemented, with a chosen
+number of substitutions. Unrelated random 40-mers practically never come within a few differences of each other, so
+with a high mutation rate the planted chunks are the only matches, and they double as a correctness oracle for any
+matching engine.
+
+Both genomes are generated block by block, every block from its own seed, so the same arguments always give the same
+genomes and a multi-Gbp pair can be written to FASTA without ever holding it in memory.
+"""
+
+from collections.abc import Iterator
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import numpy.typing as npt
+
+# Bases per generated block; a multiple of the FASTA line width so that every written line is full
+FASTA_LINE_WIDTH = 60
+DEFAULT_BLOCK_BASES = FASTA_LINE_WIDTH * 2**18
+
+_BASE_LETTERS = np.frombuffer(b"ACGT", dtype=np.uint8)
+
+
+@dataclass(frozen=True, eq=False)
+class PlantedMatches:
+    """Chunk `i` of the query, `query_starts[i]` onwards, lies within `differences[i]` substitutions of the target at
+    `target_starts[i]`, on the reverse strand of the target if `reverse[i]`."""
+
+    chunk_size: int
+    query_starts: npt.NDArray[np.int64]
+    target_starts: npt.NDArray[np.int64]
+    differences: npt.NDArray[np.int64]
+    reverse: npt.NDArray[np.bool_]
+
+    def __len__(self) -> int:
+        return len(self.query_starts)
+
+    @classmethod
+    def concatenate(cls, chunk_size: int, parts: list["PlantedMatches"]) -> "PlantedMatches":
+        if not parts:
+            empty = np.empty(0, dtype=np.int64)
+            return cls(chunk_size, empty, empty, empty, np.empty(0, dtype=np.bool_))
+        return cls(
+            chunk_size,
+            *(np.concatenate([getattr(part, name) for part in parts]) for name in _PLANTED_ARRAYS),
+        )
+
+    def save(self, path: str | Path) -> None:
+        np.savez(path, chunk_size=self.chunk_size, **{name: getattr(self, name) for name in _PLANTED_ARRAYS})
+
+    @classmethod
+    def load(cls, path: str | Path) -> "PlantedMatches":
+        with np.load(path) as data:
+            return cls(int(data["chunk_size"]), *(data[name] for name in _PLANTED_ARRAYS))
+
+
+_PLANTED_ARRAYS = ("query_starts", "target_starts", "differences", "reverse")
+
+
+def _plant(
+    query: npt.NDArray[np.int8],
+    target: npt.NDArray[np.int8],
+    offset: int,
+    num_planted: int,
+    chunk_size: int,
+    max_differences: int,
+    both_strands: bool,
+    rng: np.random.Generator,
+) -> PlantedMatches:
+    """Plant `num_planted` near-matches of target chunks into non-overlapping slots of the query block."""
+    num_slots = len(query) // chunk_size
+    if num_planted > num_slots:
+        raise ValueError(f"Cannot plant {num_planted} chunks of {chunk_size} bases in a block of {len(query)} bases")
+    query_starts = rng.choice(num_slots, num_planted, replace=False).astype(np.int64) * chunk_size
+    target_starts = rng.integers(0, len(target) - chunk_size + 1, num_planted)
+    differences = rng.integers(0, max_differences + 1, num_planted)
+    reverse = rng.random(num_planted) < 0.5 if both_strands else np.zeros(num_planted, dtype=np.bool_)
+    for query_start, target_start, num_differences, is_reverse in zip(
+        query_starts, target_starts, differences, reverse
+    ):
+        chunk = target[target_start : target_start + chunk_size].copy()
+        if is_reverse:
+            chunk = 3 - chunk[::-1]
+        # Shifting a base by 1-3 (mod 4) always changes it, so the distance is exactly `num_differences`
+        changed = rng.choice(chunk_size, num_differences, replace=False)
+        chunk[changed] = (chunk[changed] + rng.integers(1, 4, num_differences)) % 4
+        query[query_start : query_start + chunk_size] = chunk
+    return PlantedMatches(chunk_size, query_starts + offset, target_starts + offset, differences, reverse)
+
+
+def generate_blocks(
+    num_bases: int,
+    mutation_rate: float,
+    num_planted: int,
+    chunk_size: int = 40,
+    max_differences: int = 5,
+    seed: int = 0,
+    both_strands: bool = False,
+    block_size: int = DEFAULT_BLOCK_BASES,
+) -> Iterator[tuple[npt.NDArray[np.int8], npt.NDArray[np.int8], PlantedMatches]]:
+    """Yield `(query block, target block, planted matches)` in genome order; positions are genome-wide.
+
+    Every base of the query is redrawn with probability `mutation_rate` (1.0 gives an unrelated query), and the planted
+    chunks are spread over the blocks in proportion to their length.
+    """
+    block_starts = np.arange(0, num_bases, block_size)
+    block_ends = np.minimum(block_starts + block_size, num_bases)
+    planted_ends = (block_ends * num_planted) // max(num_bases, 1)
+    planted_starts = np.concatenate([[0], planted_ends[:-1]])
+    for b, (start, end) in enumerate(zip(block_starts, block_ends)):
+        rng = np.random.default_rng([seed, b])
+        target = rng.integers(0, 4, end - start, dtype=np.int8)
+        query = target.copy()
+        mutated = rng.random(len(query)) < mutation_rate
+        query[mutated] = rng.integers(0, 4, mutated.sum(), dtype=np.int8)
+        planted = _plant(
+            query,
+            target,
+            int(start),
+            int(planted_ends[b] - planted_starts[b]),
+            chunk_size,
+            max_differences,
+            both_strands,
+            rng,
+        )
+        yield query, target, planted
+
+
+def generate_genomes(
+    num_bases: int,
+    mutation_rate: float,
+    num_planted: int,
+    chunk_size: int = 40,
+    max_differences: int = 5,
+    seed: int = 0,
+    both_strands: bool = False,
+    block_size: int = DEFAULT_BLOCK_BASES,
+) -> tuple[npt.NDArray[np.int8], npt.NDArray[np.int8], PlantedMatches]:
+    """Generate an encoded `(query, target)` pair in memory, with the same contents `write_synthetic_fasta` writes."""
+    blocks = list(
+        generate_blocks(
+            num_bases, mutation_rate, num_planted, chunk_size, max_differences, seed, both_strands, block_size
+        )
+    )
+    query = np.concatenate([block[0] for block in blocks]) if blocks else np.empty(0, dtype=np.int8)
+    target = np.concatenate([block[1] for block in blocks]) if blocks else np.empty(0, dtype=np.int8)
+    return query, target, PlantedMatches.concatenate(chunk_size, [block[2] for block in blocks])
+
+
+def _fasta_lines(genome: npt.NDArray[np.int8]) -> bytes:
+    letters = _BASE_LETTERS[genome]
+    num_full = len(letters) // FASTA_LINE_WIDTH * FASTA_LINE_WIDTH
+    lines = np.empty((num_full // FASTA_LINE_WIDTH, FASTA_LINE_WIDTH + 1), dtype=np.uint8)
+    lines[:, :FASTA_LINE_WIDTH] = letters[:num_full].reshape(-1, FASTA_LINE_WIDTH)
+    lines[:, FASTA_LINE_WIDTH] = ord("\n")
+    tail = letters[num_full:].tobytes()
+    return lines.tobytes() + (tail + b"\n" if tail else b"")
+
+
+def write_synthetic_fasta(
+    query_path: str | Path,
+    target_path: str | Path,
+    num_bases: int,
+    mutation_rate: float,
+    num_planted: int,
+    chunk_size: int = 40,
+    max_differences: int = 5,
+    seed: int = 0,
+    both_strands: bool = False,
+    block_size: int = DEFAULT_BLOCK_BASES,
+) -> PlantedMatches:
+    """Write a synthetic pair as two single-record FASTA files, one block at a time; returns the planted matches."""
+    if block_size % FASTA_LINE_WIDTH:
+        raise ValueError(f"Block size must be a multiple of {FASTA_LINE_WIDTH}, got {block_size}")
+    planted = []
+    with Path(query_path).open("wb") as query_file, Path(target_path).open("wb") as target_file:
+        query_file.write(b">query\n")
+        target_file.write(b">target\n")
+        for query, target, block_planted in generate_blocks(
+            num_bases, mutation_rate, num_planted, chunk_size, max_differences, seed, both_strands, block_size
+        ):
+            query_file.write(_fasta_lines(query))
+            target_file.write(_fasta_lines(target))
+            planted.append(block_planted)
+    return PlantedMatches.concatenate(chunk_size, planted)
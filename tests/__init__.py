@@ -1 +1,16 @@
-# This file can be left empty
+import numpy as np
+
+
+def semi_global_edit_distances(chunks: np.ndarray, target_genome: np.ndarray) -> np.ndarray:
+    """Fewest edits between each row of `chunks` and any substring of the target, by dynamic programming over the
+    target; the oracle the edit distance engines are tested against."""
+    chunk_size = chunks.shape[1]
+    column = np.tile(np.arange(chunk_size + 1), (len(chunks), 1))
+    best = np.full(len(chunks), chunk_size)
+    for base in target_genome:
+        previous, column = column, np.zeros_like(column)
+        for j in range(1, chunk_size + 1):
+            substitution = previous[:, j - 1] + (chunks[:, j - 1] != base)
+            column[:, j] = np.minimum(np.minimum(previous[:, j], column[:, j - 1]) + 1, substitution)
+        best = np.minimum(best, column[:, -1])
+    return best
@@ -0,0 +1,70 @@
+import math
+
+import numpy as np
+import pytest
+
+from adaptive_sampling import PrecisionGoal, SamplingTracker, ratio_interval, wilson_interval
+
+CATEGORIES = ["Human only", "Human-A", "Human-B", "Human-A-B"]
+
+
+def test_wilson_interval():
+    low, high = wilson_interval(50, 100, 1.96)
+    assert low == pytest.approx(0.4038, abs=1e-4)
+    assert high == pytest.approx(0.5962, abs=1e-4)
+    assert wilson_interval(0, 100, 1.96)[0] == 0.0
+    assert wilson_interval(0, 0, 1.96) == (0.0, 1.0)
+
+
+def test_ratio_interval_covers_true_ratio():
+    rng = np.random.default_rng(0)
+    z = PrecisionGoal(confidence=0.95).z
+    covered = 0
+    for _ in range(400):
+        a = rng.random(2_000) < 0.3
+        b = (rng.random(2_000) < 0.2) | a & (rng.random(2_000) < 0.1)
+        _, low, high = ratio_interval(int(a.sum()), int(b.sum()), int((a & b).sum()), z)
+        covered += low <= 0.3 / (0.2 + 0.8 * 0.3 * 0.1) <= high
+    assert 0.92 <= covered / 400 <= 0.98
+
+
+def test_ratio_interval_without_hits_is_unbounded():
+    assert ratio_interval(5, 0, 0, 1.96)[2] == math.inf
+    assert not PrecisionGoal(relative_precision=0.1).is_met(*ratio_interval(5, 0, 0, 1.96))
+
+
+def test_tracker_drops_converged_targets():
+    tracker = SamplingTracker(["A", "B"], CATEGORIES, PrecisionGoal(half_width=0.05, min_samples=100), ["A", "B"])
+    # A matched nearly always, B half of the time
+    tracker.add(np.array([0, 0, 490, 510]) * 2, tracker.all_targets)
+    intervals = tracker.intervals(np.zeros(4, dtype=np.int64))
+
+    assert [interval.converged for interval in intervals] == [True, True]
+    assert tracker.converged(intervals)
+
+    tracker = SamplingTracker(["A", "B"], CATEGORIES, PrecisionGoal(half_width=0.02, min_samples=100), ["A", "B"])
+    tracker.add(np.array([0, 490, 0, 510]) * 2, tracker.all_targets)
+    intervals = tracker.intervals(np.zeros(4, dtype=np.int64))
+    assert tracker.active_targets(intervals) == 0b10
+
+    # Batches against B alone leave A's counts alone
+    tracker.add(np.array([500, 0, 500, 0]), 0b10)
+    assert tracker.pair_samples.tolist() == [[2_000, 2_000], [2_000, 3_000]]
+    assert tracker.intervals(np.zeros(4, dtype=np.int64))[0].estimate == 1.0
+
+
+def test_tracker_waits_for_min_samples():
+    tracker = SamplingTracker(["A"], ["Human only", "Human-A"], PrecisionGoal(half_width=0.5, min_samples=1_000))
+    tracker.add(np.array([10, 10]), tracker.all_targets)
+    intervals = tracker.intervals(np.array([10, 10]))
+
+    assert intervals[0].converged
+    assert not tracker.converged(intervals)
+    assert tracker.active_targets(intervals) == 0b1
+
+
+def test_tracker_rejects_unknown_quantities():
+    with pytest.raises(ValueError):
+        SamplingTracker(["A", "B"], CATEGORIES, PrecisionGoal(), ["A/C"])
+    with pytest.raises(ValueError):
+        SamplingTracker(["A", "B"], CATEGORIES, PrecisionGoal(), ["Human-C"])
@@ -0,0 +1,456 @@
+import multiprocessing as mp
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import replace
+from multiprocessing import shared_memory
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+import app
+from app import Simulation, SimulationConfig, SimulationState, category_names
+from genome_comparison import PackedGenome, stream_encode_genome
+from genome_registry import FileIdentity
+
+
+@pytest.fixture(autouse=True)
+def clear_registry():
+    yield
+    app.genome_registry.clear()
+
+
+@pytest.fixture
+def fasta_files(tmp_path):
+    rng = np.random.default_rng(0)
+    human = rng.integers(0, 4, 5_000)
+    paths = []
+    for name, mutation_rate in [("human", 0.0), ("close", 0.02), ("far", 0.3), ("other", 1.0)]:
+        genome = human.copy()
+        mutated = rng.random(len(genome)) < mutation_rate
+        genome[mutated] = rng.integers(0, 4, mutated.sum())
+        path = tmp_path / f"{name}.fa"
+        path.write_text(f">{name}\n" + np.frombuffer(b"ACGT", dtype=np.uint8)[genome].tobytes().decode() + "\n")
+        paths.append(str(path))
+    return paths
+
+
+def test_category_names():
+    assert category_names(["Chimp", "Pig"]) == ["Human only", "Human-Chimp", "Human-Pig", "Human-Chimp-Pig"]
+    assert len(category_names([f"Genome{i}" for i in range(8)])) == 256
+
+
+def test_state_merges_batches():
+    state = SimulationState.empty(["Chimp", "Pig", "Dog"])
+    state.add(np.bincount([0, 5, 5, 7], minlength=8))
+    state.add(np.bincount([5], minlength=8))
+
+    assert state.total_comparisons == 5
+    assert state.to_dict()["Human-Chimp-Dog"] == 3
+
+
+def test_config_from_legacy_dict():
+    config = SimulationConfig.from_dict(
+        {"genome1_path": "a.fa", "genome2_path": "b.fa", "genome3_path": "", "genome1_name": "A", "genome2_name": "B"}
+    )
+    assert config.target_paths == ("a.fa", "b.fa")
+    assert config.target_names == ("A", "B")
+
+
+@pytest.mark.parametrize("engine", ["scan", "index"])
+def test_run_simulation_is_reproducible(fasta_files, engine):
+    human, *targets = fasta_files
+    config = SimulationConfig(
+        num_processes=2,
+        human_genome_path=human,
+        target_paths=tuple(targets),
+        target_names=("Close", "Far", "Other"),
+        engine=engine,
+        cache_dir="",
+        results_path="",
+        num_samples=1_050,
+        batch_size=100,
+        seed=1,
+    )
+    updates = []
+    runs = []
+    for _ in range(2):
+        simulation = Simulation(config)
+        simulation.run_simulation(lambda state: updates.append(state.total_comparisons))
+        runs.append(simulation.state.counts)
+
+    np.testing.assert_array_equal(runs[0], runs[1])
+    assert runs[0].sum() == 1_050
+    assert runs[0][0b001] > runs[0][0b000]  # most chunks match only the close genome
+    assert len(updates) == 22  # one callback per 100 chunks and one for the last 50 in each run
+
+
+def test_run_simulation_counts_do_not_depend_on_scheduling(fasta_files):
+    human, *targets = fasta_files
+    config = SimulationConfig(
+        human_genome_path=human,
+        target_paths=tuple(targets),
+        target_names=("Close", "Far", "Other"),
+        cache_dir="",
+        results_path="",
+        num_samples=1_000,
+        update_interval=250,
+        batch_size=30,
+        seed=1,
+    )
+    runs = []
+    for changes in ({"num_processes": 1}, {"num_processes": 3}, {"num_processes": 2, "batch_size": 1_000}):
+        updates = []
+        simulation = Simulation(replace(config, **changes))
+        simulation.run_simulation(lambda state: updates.append(state.total_comparisons))
+        runs.append((simulation.state.counts, updates, simulation.metrics.get("simulation_batches_total")))
+
+    # Batches are seeded by their number, so the same batches give the same counts on any number of workers
+    np.testing.assert_array_equal(runs[0][0], runs[1][0])
+    assert runs[0][1] == runs[1][1] == [270, 510, 750, 1_000]  # the first batch in after every 250 samples
+    assert runs[0][2] == runs[1][2] == 34
+    # One batch of every sample draws other chunks, but just as many and with updates only once it is in
+    counts, updates, batches = runs[2]
+    assert counts.sum() == 1_000 and counts[0b001] > counts[0b000]
+    assert updates == [1_000] and batches == 1
+
+
+def test_run_simulation_stops_at_precision_goal(fasta_files):
+    human, *targets = fasta_files
+    config = SimulationConfig(
+        num_processes=1,
+        human_genome_path=human,
+        target_paths=tuple(targets),
+        target_names=("Close", "Far", "Other"),
+        cache_dir="",
+        results_path="",
+        num_samples=100_000,
+        batch_size=100,
+        seed=1,
+        target_relative_precision=0.1,
+        min_samples=500,
+        monitor=("Close", "Close/Far"),
+    )
+    simulation = Simulation(config)
+    simulation.run_simulation(lambda state: None)
+
+    assert simulation.state.converged
+    assert [interval.name for interval in simulation.state.intervals] == ["Close", "Close/Far"]
+    assert simulation.state.intervals[0].samples < 5_000
+    # "Other" is not monitored, so only the first batches compare against it
+    assert simulation.state.total_comparisons < simulation.state.intervals[0].samples
+    close, far, other = simulation.state.target_samples.tolist()
+    assert close == simulation.state.intervals[0].samples == simulation.state.samples
+    assert other == simulation.state.total_comparisons < far <= close
+
+
+def test_run_simulation_both_strands(tmp_path, fasta_files):
+    human = fasta_files[0]
+    lines = Path(human).read_text().split()
+    reverse = tmp_path / "reverse.fa"
+    reverse.write_text(">reverse\n" + lines[1][::-1].translate(str.maketrans("ACGT", "TGCA")) + "\n")
+    config = SimulationConfig(
+        num_processes=1,
+        human_genome_path=human,
+        target_paths=(str(reverse),),
+        target_names=("Reverse",),
+        cache_dir="",
+        results_path="",
+        num_samples=200,
+        seed=1,
+    )
+    counts = []
+    for both_strands in (False, True):
+        simulation = Simulation(replace(config, both_strands=both_strands))
+        simulation.run_simulation(lambda state: None)
+        counts.append(simulation.state.counts)
+
+    # Every human chunk lies on the other strand of its reverse complement
+    assert counts[0][1] < 10
+    np.testing.assert_array_equal(counts[1], [0, 200])
+
+
+def test_run_simulation_edit_distance(tmp_path, fasta_files):
+    human = fasta_files[0]
+    sequence = Path(human).read_text().split()[1]
+    # Delete every 50th base: chunks rarely match within Hamming distance, but always within a few edits
+    indels = tmp_path / "indels.fa"
+    indels.write_text(">indels\n" + "".join(sequence[i + 1 : i + 50] for i in range(0, len(sequence), 50)) + "\n")
+    config = SimulationConfig(
+        num_processes=1,
+        human_genome_path=human,
+        target_paths=(str(indels),),
+        target_names=("Indels",),
+        max_differences=2,
+        edit_distance=True,
+        cache_dir="",
+        results_path=str(tmp_path / "results.sqlite"),
+        num_samples=200,
+        seed=1,
+    )
+    counts = {}
+    for engine in ("scan", "index"):
+        simulation = Simulation(replace(config, engine=engine))
+        simulation.run_simulation(lambda state: None)
+        counts[engine] = simulation.state.counts
+    hamming = Simulation(replace(config, edit_distance=False))
+    hamming.run_simulation(lambda state: None)
+
+    np.testing.assert_array_equal(counts["scan"], [0, 200])
+    np.testing.assert_array_equal(counts["index"], [0, 200])
+    assert hamming.state.counts[1] < 100
+
+
+def test_configure_keeps_the_seed(monkeypatch, fasta_files):
+    monkeypatch.setattr(app, "simulation", Simulation(SimulationConfig(human_genome_path=fasta_files[0])))
+    monkeypatch.setattr(app, "save_config", lambda config: None)
+    form = {"chunk_size": "40", "max_differences": "5", "num_processes": "1", "update_interval": "100"}
+    client = app.app.test_client()
+
+    assert SimulationConfig().seed is not None
+    assert client.post("/configure", data={**form, "seed": "7"}).get_json()["config"]["seed"] == 7
+    assert b'name="seed" value="7"' in client.get("/").data
+    assert client.post("/configure", data={**form, "seed": ""}).get_json()["config"]["seed"] is None
+
+
+def test_preflight_estimates_targets_from_sketches(monkeypatch, tmp_path, fasta_files):
+    config = SimulationConfig(
+        human_genome_path=fasta_files[0],
+        target_paths=tuple(fasta_files[1:]),
+        target_names=("Close", "Far", "Other"),
+        cache_dir=str(tmp_path / "cache"),
+        sketch_scaled=1,
+    )
+    monkeypatch.setattr(app, "simulation", Simulation(config))
+    response = app.app.test_client().post("/preflight")
+
+    assert response.status_code == 200
+    estimates = {estimate["target"]: estimate for estimate in response.get_json()["estimates"]}
+    # A 40-mer survives 2% mutations about half of the time, and hardly ever 30%
+    assert 0.3 < estimates["Close"]["containment"] < 0.7
+    assert estimates["Far"]["containment"] < 0.01 and estimates["Other"]["containment"] == 0
+    assert estimates["Close"]["containment_low"] <= estimates["Close"]["containment"]
+    assert list((tmp_path / "cache").glob("*.sketch"))
+
+
+def test_run_simulation_reuses_stored_results(tmp_path, fasta_files):
+    human, *targets = fasta_files
+    config = SimulationConfig(
+        num_processes=1,
+        human_genome_path=human,
+        target_paths=tuple(targets[:2]),
+        target_names=("Close", "Far"),
+        cache_dir="",
+        results_path=str(tmp_path / "results.sqlite"),
+        num_samples=500,
+        seed=1,
+    )
+    uncached = Simulation(replace(config, results_path=""))
+    uncached.run_simulation(lambda state: None)
+    first = Simulation(config)
+    first.run_simulation(lambda state: None)
+    # Adding an outgroup keeps the stored results of the first two targets
+    extended = Simulation(replace(config, target_paths=tuple(targets), target_names=("Close", "Far", "Other")))
+    extended.run_simulation(lambda state: None)
+
+    np.testing.assert_array_equal(first.state.counts, uncached.state.counts)
+    np.testing.assert_array_equal(extended.state.counts.reshape(2, 4).sum(axis=0), first.state.counts)
+    (num_rows,) = sqlite3.connect(tmp_path / "results.sqlite").execute("SELECT count(*) FROM chunks").fetchone()
+    assert num_rows <= 3 * 500
+
+
+@pytest.mark.parametrize("engine", ["scan", "index"])
+def test_run_simulation_records_metrics(monkeypatch, fasta_files, engine):
+    human, *targets = fasta_files
+    config = SimulationConfig(
+        num_processes=1,
+        human_genome_path=human,
+        target_paths=tuple(targets[:2]),
+        target_names=("Close", "Far"),
+        engine=engine,
+        cache_dir="",
+        results_path="",
+        num_samples=300,
+        seed=1,
+    )
+    simulation = Simulation(config)
+    simulation.run_simulation(lambda state: None)
+    monkeypatch.setattr(app, "simulation", simulation)
+
+    metrics = simulation.metrics
+    assert metrics.get("simulation_samples_total") == 300
+    assert metrics.get("simulation_batches_total") == 3
+    assert 0 < metrics.get("simulation_worker_utilization") <= 1
+    assert metrics.get("simulation_stage_seconds", stage="fasta_read", genome="Far") > 0
+    text = app.app.test_client().get("/metrics").get_data(as_text=True)
+    assert "simulation_samples_total 300" in text
+    assert 0 < metrics.get("simulation_first_batch_seconds") < 60
+    assert "simulation_worker_warm_up_seconds_count 1" in text
+    compared = ["Close", "Far"] if engine == "index" else ["(fused)"]
+    for target in compared:
+        assert f'simulation_compare_seconds_count{{target="{target}"}} 3' in text
+
+
+def test_stop_simulation_releases_shared_memory(fasta_files):
+    human, *targets = fasta_files
+    config = SimulationConfig(
+        num_processes=2,
+        human_genome_path=human,
+        target_paths=tuple(targets),
+        target_names=("Close", "Far", "Other"),
+        cache_dir="",
+        results_path="",
+        num_samples=1_000_000,
+        update_interval=100,
+        seed=1,
+    )
+    simulation = Simulation(config)
+    stop = threading.Event()
+    simulation.run_simulation(lambda state: stop.set(), stop)
+
+    assert simulation.stopped
+    assert 0 < simulation.state.total_comparisons < 10_000
+    assert not simulation.registry_keys
+    key = ("genome", FileIdentity.of(human))
+    assert key in app.genome_registry and app.genome_registry.references(key) == 0
+    app.genome_registry.clear()
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(simulation.human_genome.shm.name)
+
+
+def test_stop_simulation_kills_workers_mid_batch(fasta_files):
+    human, *targets = fasta_files
+    # Each batch takes many seconds, so the run only stops quickly if its workers are killed
+    config = SimulationConfig(
+        num_processes=2,
+        human_genome_path=human,
+        target_paths=tuple(targets),
+        target_names=("Close", "Far", "Other"),
+        cache_dir="",
+        results_path="",
+        num_samples=1_000_000,
+        batch_size=200_000,
+        seed=1,
+    )
+    simulation = Simulation(config)
+    stop = threading.Event()
+    worker_pids = []
+
+    def stop_run() -> None:
+        worker_pids.extend(process.pid for process in mp.active_children())
+        stop.set()
+
+    timer = threading.Timer(1.0, stop_run)
+    timer.start()
+    start = time.perf_counter()
+    simulation.run_simulation(lambda state: None, stop)
+
+    assert simulation.stopped and simulation.state.total_comparisons == 0
+    assert time.perf_counter() - start < 10
+    assert len(worker_pids) == 2 and not mp.active_children()
+    for pid in worker_pids:
+        with pytest.raises(ProcessLookupError):
+            os.kill(pid, 0)
+
+
+@pytest.mark.parametrize("engine", ["scan", "index"])
+def test_run_simulation_reuses_registered_genomes(fasta_files, engine):
+    human, *targets = fasta_files
+    config = SimulationConfig(
+        num_processes=1,
+        human_genome_path=human,
+        target_paths=tuple(targets[:2]),
+        target_names=("Close", "Far"),
+        engine=engine,
+        cache_dir="",
+        results_path="",
+        num_samples=200,
+        seed=1,
+    )
+    first = Simulation(config)
+    first.run_simulation(lambda state: None)
+    second = Simulation(replace(config, target_paths=(targets[0], targets[2]), max_differences=4))
+    second.run_simulation(lambda state: None)
+
+    assert second.human_genome.shm.name == first.human_genome.shm.name
+    assert second.targets[0].shm.name == first.targets[0].shm.name
+    assert second.targets[1].shm.name != first.targets[1].shm.name
+    assert second.metrics.get("simulation_registry_reuses_total", kind="genome", genome="Human") == 1
+    assert second.metrics.get("simulation_stage_seconds", stage="fasta_read", genome="Human") == 0
+    assert second.metrics.get("simulation_stage_seconds", stage="fasta_read", genome="Far") > 0
+    # Fewer allowed differences means longer seeds, so the index is rebuilt
+    assert second.metrics.get("simulation_registry_reuses_total", kind="index", genome="Close") == 0
+    np.testing.assert_array_equal(
+        second.human_genome.attach().words, PackedGenome.from_encoded(stream_encode_genome(human)[0]).words
+    )
+
+    third = Simulation(replace(config, registry_max_bytes=0))
+    third.run_simulation(lambda state: None)
+    # Unused blocks are evicted as soon as the registry is over budget, but the ones in use survive the run
+    assert third.human_genome.shm.name == first.human_genome.shm.name
+    assert ("genome", FileIdentity.of(human)) not in app.genome_registry
+
+
+def test_simulation_job_coalesces_updates(monkeypatch, fasta_files):
+    human, *targets = fasta_files
+    config = SimulationConfig(
+        num_processes=1,
+        human_genome_path=human,
+        target_paths=tuple(targets[:2]),
+        target_names=("Close", "Far"),
+        cache_dir="",
+        results_path="",
+        num_samples=2_000,
+        update_interval=100,
+        update_seconds=60.0,
+        seed=1,
+    )
+    monkeypatch.setattr(app, "simulation", Simulation(config))
+    monkeypatch.setattr(app, "current_job", None)
+    client = app.socketio.test_client(app.app)
+
+    response = app.app.test_client().post("/simulations")
+    assert response.status_code == 202
+    job_id = response.get_json()["job_id"]
+    assert app.app.test_client().post("/simulations").status_code == 409
+    assert app.jobs[job_id].done.wait(120)
+    time.sleep(0.5)  # let the emitter send the final state and status
+
+    status = app.app.test_client().get(f"/simulations/{job_id}").get_json()
+    assert status["status"] == "finished"
+    assert status["total"] == 2_000
+    updates = [event["args"][0] for event in client.get_received() if event["name"] == "update"]
+    # 20 callbacks, but the emitter only sends the state it finds when it wakes up
+    assert 1 <= len(updates) <= 2
+    assert updates[-1]["total"] == 2_000
+    assert app.app.test_client().get("/simulations/unknown").status_code == 404
+
+
+def test_finished_jobs_are_forgotten(monkeypatch, fasta_files):
+    human, *targets = fasta_files
+    config = SimulationConfig(
+        num_processes=1,
+        human_genome_path=human,
+        target_paths=tuple(targets[:1]),
+        target_names=("Close",),
+        cache_dir="",
+        results_path="",
+        num_samples=100,
+        seed=1,
+    )
+    monkeypatch.setattr(app, "simulation", Simulation(config))
+    monkeypatch.setattr(app, "current_job", None)
+    monkeypatch.setattr(app, "jobs", {})
+    monkeypatch.setattr(app, "MAX_KEPT_JOBS", 2)
+
+    job_ids = []
+    for _ in range(3):
+        job = app.start_job()
+        assert job.done.wait(120)
+        job_ids.append(job.job_id)
+
+    assert list(app.jobs) == job_ids[1:]
+    assert app.app.test_client().get(f"/simulations/{job_ids[0]}").status_code == 404
+    assert app.app.test_client().get(f"/simulations/{job_ids[2]}").get_json()["status"] == "finished"
@@ -0,0 +1,37 @@
+import json
+
+from scripts.benchmark import _COMPARED_PARAMETERS, BASELINE_PATH, find_regressions
+
+BASELINE = {
+    "compare_chunk/scan": {"queries_per_second": 1_000.0, "first_call_seconds": 0.1, "peak_rss_mb": 100.0},
+    "GenomeIndex.build": {"bases_per_second": 1e6, "peak_rss_mb": 1_000.0},
+}
+
+
+def test_find_regressions_flags_slower_stages():
+    assert find_regressions({"compare_chunk/scan": {"queries_per_second": 850.0}}, BASELINE, 0.2) == []
+    assert find_regressions({"compare_chunk/scan": {"queries_per_second": 1e6}}, BASELINE, 0.2) == []
+    (regression,) = find_regressions({"compare_chunk/scan": {"queries_per_second": 750.0}}, BASELINE, 0.2)
+    assert regression.startswith("compare_chunk/scan queries_per_second")
+
+
+def test_find_regressions_flags_growth_beyond_the_absolute_slack():
+    # 0.1 s to 0.5 s is five times slower, but within the 0.5 s slack of a kernel load
+    assert find_regressions({"compare_chunk/scan": {"first_call_seconds": 0.5}}, BASELINE, 0.2) == []
+    assert len(find_regressions({"compare_chunk/scan": {"first_call_seconds": 0.7}}, BASELINE, 0.2)) == 1
+    # 100 MB to 140 MB is within the 50 MB slack, but 1000 MB to 1300 MB is beyond the threshold
+    assert find_regressions({"compare_chunk/scan": {"peak_rss_mb": 140.0}}, BASELINE, 0.2) == []
+    (regression,) = find_regressions({"GenomeIndex.build": {"peak_rss_mb": 1_300.0}}, BASELINE, 0.2)
+    assert regression.startswith("GenomeIndex.build peak_rss_mb")
+    assert find_regressions({"GenomeIndex.build": {"peak_rss_mb": 1.0, "bases_per_second": 2e6}}, BASELINE, 0.2) == []
+
+
+def test_find_regressions_skips_metrics_without_a_baseline():
+    stages = {"find_matches/scan": {"queries_per_second": 1.0}, "GenomeIndex.build": {"first_call_seconds": 60.0}}
+    assert find_regressions(stages, BASELINE, 0.2) == []
+
+
+def test_committed_baseline_is_complete():
+    baseline = json.loads(BASELINE_PATH.read_text())
+    assert set(baseline["parameters"]) == set(_COMPARED_PARAMETERS)
+    assert find_regressions(baseline["stages"], baseline["stages"], 0.0) == []
@@ -0,0 +1,119 @@
+import os
+import socket
+
+import numpy as np
+import pytest
+
+from app import Simulation, SimulationConfig
+from distributed import RemoteExecutor, find_matches_sharded, parse_address, serve, start_local_workers
+from genome_comparison import GenomeIndex, find_matches, seed_size_for, stream_encode_genome
+from synthetic_genomes import write_synthetic_fasta
+
+
+@pytest.fixture
+def workers():
+    addresses, processes = start_local_workers(2)
+    yield addresses
+    for process in processes:
+        process.terminate()
+
+
+@pytest.fixture
+def fasta_files(tmp_path):
+    query_path, target_path = tmp_path / "query.fa", tmp_path / "target.fa"
+    write_synthetic_fasta(query_path, target_path, 6_000, 0.5, 20, both_strands=True, block_size=3_000)
+    return str(query_path), str(target_path)
+
+
+def _closed_port_address() -> tuple[str, int]:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()
+
+
+def _exit_once(flag_path: str, value: int) -> int:
+    """Kill the worker process the first time any worker runs it."""
+    if not os.path.exists(flag_path):
+        open(flag_path, "w").close()
+        os._exit(1)
+    return value
+
+
+def _fail(message: str) -> None:
+    raise ValueError(message)
+
+
+def test_parse_address():
+    assert parse_address("node1:6000") == ("node1", 6000)
+    assert parse_address("node1") == ("node1", 5050)
+
+
+@pytest.mark.parametrize("engine", ["scan", "index"])
+def test_find_matches_sharded_matches_single_node(tmp_path, workers, fasta_files, engine):
+    query_path, target_path = fasta_files
+    query, target = (stream_encode_genome(path)[0] for path in fasta_files)
+    if engine == "index":
+        expected = GenomeIndex.build(target, seed_size_for(40, 5)).find_matches(query, 40, 5, both_strands=True)
+    else:
+        expected = find_matches(query, target, 40, 5, both_strands=True)
+
+    executor = RemoteExecutor(workers, connections_per_worker=2)
+    try:
+        result = find_matches_sharded(
+            executor, query_path, target_path, len(query), 40, 5, engine, True, tmp_path / "cache"
+        )
+    finally:
+        executor.shutdown()
+    assert result == expected
+    assert expected[0] > 0
+
+
+def test_retries_tasks_of_lost_workers(tmp_path, workers):
+    executor = RemoteExecutor([_closed_port_address(), *workers])
+    futures = [executor.submit(_exit_once, str(tmp_path / "exited"), i) for i in range(10)]
+    failing = executor.submit(_fail, "bad shard")
+    assert [future.result(timeout=30) for future in futures] == list(range(10))
+    with pytest.raises(ValueError, match="bad shard"):
+        failing.result(timeout=30)
+    executor.shutdown()
+
+
+def test_fails_when_no_worker_is_left(tmp_path):
+    executor = RemoteExecutor([_closed_port_address()])
+    # Either the queued task fails, or the executor knows it is broken by the time the task is submitted
+    with pytest.raises(ConnectionError):
+        executor.submit(_fail, "never runs").result(timeout=30)
+    executor.shutdown()
+
+
+def test_workers_require_the_shared_key(workers):
+    with pytest.raises(ValueError, match="DISTRIBUTED_AUTHKEY"):
+        serve(("127.0.0.1", 0), b"")
+    executor = RemoteExecutor(workers, authkey=b"not the key")
+    with pytest.raises(ConnectionError):
+        executor.submit(_fail, "never runs").result(timeout=30)
+    executor.shutdown()
+
+
+@pytest.mark.parametrize("engine", ["scan", "index"])
+def test_distributed_simulation_matches_local(tmp_path, workers, fasta_files, engine):
+    query_path, target_path = fasta_files
+    config = SimulationConfig(
+        num_processes=1,
+        human_genome_path=query_path,
+        target_paths=(target_path, query_path),
+        target_names=("Target", "Self"),
+        engine=engine,
+        both_strands=True,
+        cache_dir=str(tmp_path / "cache"),
+        results_path="",
+        num_samples=600,
+        seed=3,
+    )
+    local = Simulation(config)
+    local.run_simulation(lambda state: None)
+    distributed = Simulation(SimulationConfig(**{**config.__dict__, "workers": tuple(f"{h}:{p}" for h, p in workers)}))
+    distributed.run_simulation(lambda state: None)
+
+    np.testing.assert_array_equal(distributed.state.counts, local.state.counts)
+    assert distributed.state.total_comparisons == 600
@@ -0,0 +1,138 @@
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+from genome_cache import (
+    CacheFormatError,
+    cache_path_for,
+    evict,
+    index_path_for,
+    invalidate,
+    load_cached_genome,
+    load_cached_index,
+    open_cached_genome,
+)
+from genome_comparison import GenomeIndex
+from genome_sketch import load_sketch, sketch_path_for
+
+
+@pytest.fixture
+def fasta_file(tmp_path):
+    fasta_file = tmp_path / "test_genome.fa"
+    fasta_file.write_text(">chr1 first\nACGTN\nACGT\n>chr2\n" + "TTGCA" * 20 + "\n")
+    return fasta_file
+
+
+def test_load_cached_genome_round_trip(tmp_path, fasta_file):
+    cached = load_cached_genome(fasta_file, tmp_path / "cache")
+
+    expected = np.array([0, 1, 2, 3, 0, 1, 2, 3] + [3, 3, 2, 1, 0] * 20, dtype=np.int8)
+    np.testing.assert_array_equal(cached.encoded, expected)
+    np.testing.assert_array_equal(cached.packed.unpack(), expected)
+    assert isinstance(cached.encoded, np.memmap) or isinstance(cached.encoded.base, np.memmap)
+    assert cached.contigs.names == ("chr1", "chr2")
+    np.testing.assert_array_equal(cached.contigs.starts, [0, 8])
+    np.testing.assert_array_equal(cached.contigs.gap_starts, [4])
+    np.testing.assert_array_equal(cached.contigs.gap_lengths, [1])
+    np.testing.assert_array_equal(cached.contigs.gap_contigs, [0])
+
+
+def test_load_cached_genome_reuses_entry(tmp_path, fasta_file):
+    cache_dir = tmp_path / "cache"
+    load_cached_genome(fasta_file, cache_dir)
+    cache_path = cache_path_for(fasta_file, cache_dir)
+    inode = cache_path.stat().st_ino
+
+    # Touching the source without changing it is caught by the content hash and the entry is kept
+    os.utime(fasta_file, ns=(10**9, 10**9))
+    cached = load_cached_genome(fasta_file, cache_dir)
+    assert cache_path.stat().st_ino == inode
+    assert cached.source.mtime_ns == 10**9
+    assert list(cache_dir.iterdir()) == [cache_path]
+
+
+def test_load_cached_genome_rebuilds_stale_entry(tmp_path, fasta_file):
+    cache_dir = tmp_path / "cache"
+    load_cached_genome(fasta_file, cache_dir)
+
+    fasta_file.write_text(">chr1\nGGGG\n")
+    cached = load_cached_genome(fasta_file, cache_dir)
+    np.testing.assert_array_equal(cached.encoded, [2, 2, 2, 2])
+
+
+def test_cached_genome_pickles_as_path(tmp_path, fasta_file):
+    cached = load_cached_genome(fasta_file, tmp_path / "cache")
+
+    payload = pickle.dumps(cached)
+    assert len(payload) < 1_000
+    np.testing.assert_array_equal(pickle.loads(payload).encoded, cached.encoded)
+
+
+def test_open_cached_genome_rejects_other_files(tmp_path):
+    not_a_cache = tmp_path / "not_a_cache.genome"
+    not_a_cache.write_bytes(b"\0" * 200)
+
+    with pytest.raises(CacheFormatError):
+        open_cached_genome(not_a_cache)
+
+
+def test_load_cached_index_maps_the_index_file(tmp_path, fasta_file):
+    cache_dir = tmp_path / "cache"
+    cached = load_cached_index(fasta_file, 3, cache_dir)
+    genome = load_cached_genome(fasta_file, cache_dir).packed
+    expected = GenomeIndex.build(genome, 3)
+
+    assert index_path_for(fasta_file, cache_dir, 3).exists()
+    np.testing.assert_array_equal(cached.offsets, expected.offsets)
+    np.testing.assert_array_equal(cached.positions, expected.positions)
+    assert not cached.positions.flags.writeable
+    assert cached.attach(genome).find_matches(genome, 10, 1) == expected.find_matches(genome, 10, 1)
+    assert load_cached_index(fasta_file, 3, cache_dir) is cached
+    np.testing.assert_array_equal(pickle.loads(pickle.dumps(cached)).positions, cached.positions)
+
+    # Rewriting the genome changes its content hash, so the index is rebuilt
+    fasta_file.write_text(">chr1\n" + "GATTACA" * 10 + "\n")
+    rebuilt = load_cached_index(fasta_file, 3, cache_dir)
+    assert len(rebuilt.positions) == 70 - 2
+
+
+def test_invalidate(tmp_path, fasta_file):
+    cache_dir = tmp_path / "cache"
+    load_cached_genome(fasta_file, cache_dir)
+    load_cached_index(fasta_file, 3, cache_dir)
+    load_sketch(fasta_file, cache_dir, 7, scaled=1)
+
+    invalidate(fasta_file, cache_dir)
+    assert not cache_path_for(fasta_file, cache_dir).exists()
+    assert not index_path_for(fasta_file, cache_dir, 3).exists()
+    assert not sketch_path_for(fasta_file, cache_dir, 7, 1, False).exists()
+
+
+def test_evict_least_recently_used(tmp_path):
+    cache_dir = tmp_path / "cache"
+    paths = []
+    for i in range(3):
+        fasta_file = tmp_path / f"genome{i}.fa"
+        fasta_file.write_text(">chr\n" + "ACGT" * 100 + "\n")
+        paths.append(load_cached_genome(fasta_file, cache_dir).path)
+        os.utime(paths[-1], ns=(i * 10**9, i * 10**9))
+    entry_size = paths[0].stat().st_size
+
+    assert evict(cache_dir, max_bytes=entry_size * 2, keep=(paths[0],)) == [paths[1]]
+    assert sorted(cache_dir.iterdir()) == sorted([paths[0], paths[2]])
+
+
+def test_evict_counts_indexes_and_sketches(tmp_path, fasta_file):
+    cache_dir = tmp_path / "cache"
+    entry = load_cached_genome(fasta_file, cache_dir).path
+    index = load_cached_index(fasta_file, 3, cache_dir).path
+    load_sketch(fasta_file, cache_dir, 7, scaled=1)
+    sketch = sketch_path_for(fasta_file, cache_dir, 7, 1, False)
+    for i, path in enumerate([sketch, index, entry]):
+        os.utime(path, ns=(i * 10**9, i * 10**9))
+
+    # The sketch and the index are the least recently used, and together put the cache over its budget
+    assert evict(cache_dir, max_bytes=entry.stat().st_size) == [sketch, index]
+    assert entry.exists()
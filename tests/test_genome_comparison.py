@@ -1,13 +1,22 @@
+import gzip
+
 import numpy as np
 import pytest
 
 from genome_comparison import (
+    GenomeIndex,
+    PackedGenome,
     _encode_genome,
     compare_chunk,
     encode_base,
     find_matches,
+    match_masks,
+    pack_genome,
     read_and_encode_genome,
+    seed_size_for,
+    stream_encode_genome,
 )
+from tests import semi_global_edit_distances
 
 
 def test_encode_base():
@@ -38,6 +47,62 @@ def test_read_and_encode_genome(tmp_path):
     np.testing.assert_array_equal(read_and_encode_genome(str(fasta_file)), expected_output)
 
 
+def test_read_and_encode_genome_gzip(tmp_path):
+    fasta_file = tmp_path / "test_genome.fa.gz"
+    with gzip.open(fasta_file, "wt") as f:
+        f.write(">chr1\nACGTN\r\nacgt\n>chr2 description\nTTAA\n")
+
+    expected_output = np.array([0, 1, 2, 3, 0, 1, 2, 3, 3, 3, 0, 0])
+    np.testing.assert_array_equal(read_and_encode_genome(str(fasta_file)), expected_output)
+
+
+def test_stream_encode_genome_grows_buffer(tmp_path):
+    # A highly compressible file decompresses to far more than the initial 4x-of-compressed-size estimate
+    fasta_file = tmp_path / "test_genome.fa.gz"
+    with gzip.open(fasta_file, "wt") as f:
+        f.write(">chrA\n" + "ACGT" * 50_000 + "\n")
+
+    genome, _, _ = stream_encode_genome(str(fasta_file), block_size=4096)
+    np.testing.assert_array_equal(genome, np.tile(np.arange(4, dtype=np.int8), 50_000))
+
+
+def test_stream_encode_genome_small_blocks(tmp_path):
+    # Headers and sequence lines split across block boundaries must decode exactly like one big block
+    fasta_content = ">first record with a long header ACGT\nACGTNNACGT\n>second ACGT\nGGCCAATT\n"
+    fasta_file = tmp_path / "test_genome.fasta"
+    fasta_file.write_text(fasta_content)
+
+    genome, contigs, stats = stream_encode_genome(str(fasta_file), block_size=3)
+    expected_output = np.array([0, 1, 2, 3, 0, 1, 2, 3, 2, 2, 1, 1, 0, 0, 3, 3])
+    np.testing.assert_array_equal(genome, expected_output)
+    assert contigs.names == ("first", "second")
+    np.testing.assert_array_equal(contigs.starts, [0, 8])
+    assert contigs.contig_at(7) == 0
+    assert contigs.contig_at(8) == 1
+    np.testing.assert_array_equal(contigs.gap_starts, [4])
+    np.testing.assert_array_equal(contigs.gap_lengths, [2])
+    np.testing.assert_array_equal(contigs.gap_contigs, [0])
+    assert stats.bases == len(expected_output)
+    assert stats.source_bytes == len(fasta_content)
+
+
+def test_contig_table_gaps(tmp_path):
+    fasta_file = tmp_path / "test_genome.fa"
+    fasta_file.write_text(">a\nAC\nN\nNGT\n>b\nNNA\nCNN\n")
+
+    genome, contigs, _ = stream_encode_genome(str(fasta_file), block_size=4)
+    np.testing.assert_array_equal(genome, [0, 1, 2, 3, 0, 1])
+    # Line breaks inside a gap don't count towards its length, and gaps at record and file ends are kept
+    np.testing.assert_array_equal(contigs.gap_starts, [2, 4, 6])
+    np.testing.assert_array_equal(contigs.gap_lengths, [2, 2, 2])
+    np.testing.assert_array_equal(contigs.gap_contigs, [0, 1, 1])
+    np.testing.assert_array_equal(contigs.breaks, [0, 2, 4, 6])
+    np.testing.assert_array_equal(contigs.contiguous(np.arange(5), 2), [True, False, True, False, True])
+    # Offsets count the gap letters; those inside a gap map to the base after it
+    np.testing.assert_array_equal(contigs.to_encoded(0, np.arange(7)), [0, 1, 2, 2, 2, 3, 4])
+    np.testing.assert_array_equal(contigs.to_encoded(1, np.arange(5)), [4, 4, 4, 5, 6])
+
+
 def test_compare_chunk():
     chunk = np.array([0, 1, 2, 3])
     target_genome = np.array([3, 2, 1, 0, 1, 2, 3, 0])
@@ -62,5 +127,229 @@ def test_find_matches():
     assert total_chunks == 5
 
 
+def test_pack_genome():
+    genome = np.array([0, 1, 2, 3] * 9, dtype=np.int8)
+    words = pack_genome(genome)
+
+    assert words.dtype == np.uint64
+    assert len(words) == 2
+    assert words[0] == 0xE4E4E4E4E4E4E4E4
+    assert words[1] == 0xE4
+    np.testing.assert_array_equal(PackedGenome(words, len(genome)).unpack(), genome)
+
+
+def test_packed_genome_chunk():
+    genome = np.random.default_rng(0).integers(0, 4, 100).astype(np.int8)
+    packed = PackedGenome.from_encoded(genome)
+
+    np.testing.assert_array_equal(packed.chunk(29, 40).unpack(), genome[29:69])
+    np.testing.assert_array_equal(packed.chunk(64, 36).unpack(), genome[64:])
+
+
+def test_compare_chunk_packed():
+    chunk = PackedGenome.from_encoded(np.array([0, 1, 2, 3], dtype=np.int8))
+    target_genome = PackedGenome.from_encoded(np.array([3, 2, 1, 0, 1, 2, 3, 0], dtype=np.int8))
+
+    assert compare_chunk(chunk, target_genome, max_differences=0)
+    assert compare_chunk(np.array([1, 1, 1, 1]), target_genome, max_differences=2)
+    assert not compare_chunk(np.array([1, 1, 1, 1]), target_genome, max_differences=1)
+
+
+@pytest.mark.parametrize(("chunk_size", "max_differences"), [(40, 5), (33, 2), (70, 10), (8, 0)])
+def test_find_matches_packed_matches_unpacked(chunk_size, max_differences):
+    rng = np.random.default_rng(1)
+    target_genome = rng.integers(0, 4, 3_000).astype(np.int8)
+    query_genome = target_genome[1_000:1_300].copy()
+    query_genome[::7] = rng.integers(0, 4, len(query_genome[::7]))
+
+    assert find_matches(
+        PackedGenome.from_encoded(query_genome), PackedGenome.from_encoded(target_genome), chunk_size, max_differences
+    ) == find_matches(query_genome, target_genome, chunk_size, max_differences)
+
+
+def test_match_masks():
+    target_genome = np.array([3, 2, 1, 0, 1, 2, 3, 0], dtype=np.int8)
+    targets = [target_genome, PackedGenome.from_encoded(target_genome[::-1].copy()), target_genome[:3]]
+    chunks = [np.array([0, 1, 2, 3], dtype=np.int8), np.array([3, 2, 1, 0], dtype=np.int8)]
+
+    np.testing.assert_array_equal(match_masks(chunks, targets, max_differences=0), [0b011, 0b011])
+    np.testing.assert_array_equal(match_masks(np.array([1, 1, 1, 1]), targets, max_differences=2), [0b011])
+    np.testing.assert_array_equal(match_masks(np.array([1, 1, 1, 1]), targets, max_differences=1), [0b000])
+
+
+def test_match_masks_matches_compare_chunk():
+    rng = np.random.default_rng(2)
+    query_genome = rng.integers(0, 4, 5_000).astype(np.int8)
+    targets = []
+    for mutation_rate in (0.02, 0.1, 0.3):
+        target_genome = query_genome.copy()
+        mutated = rng.random(len(target_genome)) < mutation_rate
+        target_genome[mutated] = rng.integers(0, 4, mutated.sum())
+        targets.append(PackedGenome.from_encoded(target_genome))
+    packed_query = PackedGenome.from_encoded(query_genome)
+    chunks = [packed_query.chunk(start, 40) for start in rng.integers(0, len(query_genome) - 40, 100)]
+
+    expected = [sum(1 << t for t, target in enumerate(targets) if compare_chunk(c, target, 5)) for c in chunks]
+    np.testing.assert_array_equal(match_masks(chunks, targets, max_differences=5), expected)
+
+
+def test_reverse_complement():
+    genome = np.random.default_rng(5).integers(0, 4, 75).astype(np.int8)
+
+    np.testing.assert_array_equal(PackedGenome.from_encoded(genome).reverse_complement().unpack(), 3 - genome[::-1])
+
+
+@pytest.mark.parametrize(("chunk_size", "max_differences"), [(40, 5), (33, 2), (8, 0)])
+def test_both_strands_matches_reverse_complement_scan(chunk_size, max_differences):
+    rng = np.random.default_rng(6)
+    target_genome = rng.integers(0, 4, 3_000).astype(np.int8)
+    query_genome = np.concatenate([target_genome[200:400], 3 - target_genome[1_000:1_300][::-1]])
+    query_genome[::8] = rng.integers(0, 4, len(query_genome[::8]))
+    reverse = (3 - query_genome[::-1]).astype(np.int8)
+    index = GenomeIndex.build(target_genome, seed_size_for(chunk_size, max_differences))
+    chunks = [query_genome[i : i + chunk_size] for i in range(len(query_genome) - chunk_size + 1)]
+
+    expected = [
+        compare_chunk(chunk, target_genome, max_differences)
+        or compare_chunk(reverse[len(reverse) - i - chunk_size : len(reverse) - i], target_genome, max_differences)
+        for i, chunk in enumerate(chunks)
+    ]
+    assert sum(expected) > find_matches(query_genome, target_genome, chunk_size, max_differences)[0]
+    both = find_matches(query_genome, target_genome, chunk_size, max_differences, both_strands=True)
+    assert both == (sum(expected), len(chunks))
+    assert find_matches(query_genome, target_genome, chunk_size, max_differences, 3, both_strands=True) == both
+    assert index.find_matches(query_genome, chunk_size, max_differences, both_strands=True) == both
+    np.testing.assert_array_equal(
+        match_masks(chunks, [target_genome], max_differences, both_strands=True), np.array(expected, dtype=np.int64)
+    )
+    assert [compare_chunk(chunk, target_genome, max_differences, both_strands=True) for chunk in chunks] == expected
+    assert [index.compare_chunk(chunk, max_differences, both_strands=True) for chunk in chunks] == expected
+
+
+@pytest.mark.parametrize("num_threads", [2, 3, 8])
+def test_find_matches_threads_match_serial(num_threads):
+    rng = np.random.default_rng(3)
+    target_genome = rng.integers(0, 4, 3_000).astype(np.int8)
+    query_genome = target_genome[200:600].copy()
+    query_genome[::6] = rng.integers(0, 4, len(query_genome[::6]))
+    index = GenomeIndex.build(target_genome, seed_size_for(40, 5))
+
+    serial = find_matches(query_genome, target_genome, 40, 5)
+    assert find_matches(query_genome, target_genome, 40, 5, num_threads=num_threads) == serial
+    assert index.find_matches(query_genome, 40, 5, num_threads=num_threads) == serial
+
+
+def test_compare_chunk_threads():
+    target_genome = np.random.default_rng(4).integers(0, 4, 10_000).astype(np.int8)
+
+    # Matches in the first slice, across a slice boundary, in the last slice, and nowhere
+    for start in (0, 4_980, 9_960):
+        assert compare_chunk(target_genome[start : start + 40], target_genome, 0, num_threads=4)
+    assert not compare_chunk(np.zeros(40, dtype=np.int8), target_genome, 5, num_threads=4)
+    assert not compare_chunk(np.zeros(40, dtype=np.int8), target_genome[:39], 5, num_threads=4)
+
+
+def test_edit_distance_matches_indels():
+    target_genome = np.random.default_rng(7).integers(0, 4, 2_000).astype(np.int8)
+    deleted = np.delete(target_genome[1_000:1_041], 20)
+    inserted = np.insert(target_genome[500:539], 10, [0, 1])
+    index = GenomeIndex.build(target_genome, seed_size_for(40, 2))
+
+    for chunk in (deleted, inserted):
+        assert not compare_chunk(chunk, target_genome, 2)
+        assert compare_chunk(chunk, target_genome, 2, edit_distance=True)
+        assert index.compare_chunk(chunk, 2, edit_distance=True)
+        assert match_masks([chunk], [target_genome], 2, edit_distance=True)[0] == 1
+        assert not compare_chunk(chunk, target_genome, 0, edit_distance=True)
+    with pytest.raises(ValueError, match="at most 64 bases"):
+        compare_chunk(target_genome[:65], target_genome, 2, edit_distance=True)
+
+
+@pytest.mark.parametrize(("chunk_size", "max_differences"), [(40, 5), (20, 3), (64, 6), (8, 0)])
+def test_edit_distance_engines_match_dynamic_programming(chunk_size, max_differences):
+    rng = np.random.default_rng(8)
+    target_genome = rng.integers(0, 4, 600).astype(np.int8)
+    # Chunks of the target with a few random edits each, and unrelated chunks
+    chunks = []
+    for start in rng.integers(0, len(target_genome) - chunk_size - 10, 30):
+        chunk = target_genome[start : start + chunk_size + 5].copy()
+        for _ in range(rng.integers(0, max_differences + 2)):
+            position = rng.integers(0, chunk_size)
+            edit = rng.integers(0, 3)
+            if edit == 0:
+                chunk[position] = rng.integers(0, 4)
+            elif edit == 1:
+                chunk = np.insert(chunk, position, rng.integers(0, 4))
+            else:
+                chunk = np.delete(chunk, position)
+        chunks.append(chunk[:chunk_size].astype(np.int8))
+    chunks += [rng.integers(0, 4, chunk_size).astype(np.int8) for _ in range(10)]
+    query_genome = np.concatenate(chunks)
+    index = GenomeIndex.build(target_genome, seed_size_for(chunk_size, max_differences))
+
+    expected = (semi_global_edit_distances(np.array(chunks), target_genome) <= max_differences).tolist()
+    assert 0 < sum(expected) < len(chunks)
+    assert [compare_chunk(chunk, target_genome, max_differences, edit_distance=True) for chunk in chunks] == expected
+    assert [
+        compare_chunk(chunk, target_genome, max_differences, num_threads=3, edit_distance=True) for chunk in chunks
+    ] == expected
+    assert [index.compare_chunk(chunk, max_differences, edit_distance=True) for chunk in chunks] == expected
+    np.testing.assert_array_equal(
+        match_masks(chunks, [target_genome], max_differences, edit_distance=True), np.array(expected, dtype=np.int64)
+    )
+    scan = find_matches(query_genome, target_genome, chunk_size, max_differences, 2, edit_distance=True)
+    assert scan == index.find_matches(query_genome, chunk_size, max_differences, edit_distance=True)
+    assert scan[0] >= find_matches(query_genome, target_genome, chunk_size, max_differences)[0]
+
+
+def test_edit_distance_both_strands():
+    rng = np.random.default_rng(9)
+    target_genome = rng.integers(0, 4, 1_000).astype(np.int8)
+    chunk = np.delete(3 - target_genome[300:341][::-1], 15).astype(np.int8)
+    index = GenomeIndex.build(target_genome, seed_size_for(40, 1))
+
+    assert not compare_chunk(chunk, target_genome, 1, edit_distance=True)
+    assert compare_chunk(chunk, target_genome, 1, both_strands=True, edit_distance=True)
+    assert index.compare_chunk(chunk, 1, both_strands=True, edit_distance=True)
+    assert match_masks([chunk], [target_genome], 1, both_strands=True, edit_distance=True)[0] == 1
+
+
+def test_seed_size_for():
+    assert seed_size_for(40, 5) == 6
+    assert seed_size_for(40, 0) == 12
+    assert seed_size_for(4, 4) == 1
+
+
+def test_genome_index_build():
+    target_genome = np.array([3, 2, 1, 0, 1, 2, 3, 0], dtype=np.int8)
+    index = GenomeIndex.build(target_genome, seed_size=1)
+
+    np.testing.assert_array_equal(index.offsets, [0, 2, 4, 6, 8])
+    np.testing.assert_array_equal(index.positions, [3, 7, 2, 4, 1, 5, 0, 6])
+
+
+def test_genome_index_compare_chunk():
+    target_genome = np.array([3, 2, 1, 0, 1, 2, 3, 0], dtype=np.int8)
+    index = GenomeIndex.build(target_genome, seed_size=1)
+
+    assert index.compare_chunk(np.array([0, 1, 2, 3], dtype=np.int8), max_differences=0)
+    assert index.compare_chunk(np.array([1, 1, 1, 1], dtype=np.int8), max_differences=2)
+    assert not index.compare_chunk(np.array([1, 1, 1, 1], dtype=np.int8), max_differences=1)
+
+
+@pytest.mark.parametrize(("chunk_size", "max_differences"), [(40, 5), (20, 3), (8, 0), (4, 4)])
+def test_genome_index_matches_scan(chunk_size, max_differences):
+    rng = np.random.default_rng(0)
+    target_genome = rng.integers(0, 4, 3_000).astype(np.int8)
+    query_genome = target_genome[500:800].copy()
+    query_genome[::9] = rng.integers(0, 4, len(query_genome[::9]))
+    query_genome = np.concatenate([query_genome, rng.integers(0, 4, 200).astype(np.int8)])
+
+    index = GenomeIndex.build(target_genome, seed_size_for(chunk_size, max_differences))
+    assert index.find_matches(query_genome, chunk_size, max_differences) == find_matches(
+        query_genome, target_genome, chunk_size, max_differences
+    )
+
+
 if __name__ == "__main__":
     pytest.main([__file__])
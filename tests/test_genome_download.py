@@ -0,0 +1,194 @@
+import gzip
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pytest
+import requests
+
+from genome_cache import cache_path_for, load_cached_genome, open_cached_genome
+from genome_comparison import stream_encode_genome
+from genome_download import download_genome
+
+_BASE_LETTERS = np.frombuffer(b"ACGTN", dtype=np.uint8)
+
+
+class _FileServer(ThreadingHTTPServer):
+    """Serves one file at every path, honouring `Range: bytes=N-` (and `If-Range` with its ETag) unless told not to,
+    and dropping the connection after `cut_after` bytes of each of the first `cuts` responses."""
+
+    def __init__(self, payload: bytes):
+        super().__init__(("127.0.0.1", 0), _FileHandler)
+        self.payload = payload
+        self.etag = '"v1"'
+        self.supports_range = True
+        self.cuts = 0
+        self.cut_after = 0
+        self.ranges: list[str | None] = []
+        self.if_ranges: list[str | None] = []
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/genome.fa.gz"
+
+
+class _FileHandler(BaseHTTPRequestHandler):
+    server: _FileServer
+
+    def do_GET(self) -> None:
+        server = self.server
+        requested, if_range = self.headers.get("Range"), self.headers.get("If-Range")
+        server.ranges.append(requested)
+        server.if_ranges.append(if_range)
+        start = 0
+        if requested and server.supports_range and if_range in (None, server.etag):
+            start = int(requested.removeprefix("bytes=").removesuffix("-"))
+            if start >= len(server.payload):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(server.payload)}")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(server.payload) - 1}/{len(server.payload)}")
+        else:
+            self.send_response(200)
+        body = server.payload[start:]
+        self.send_header("ETag", server.etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if server.cuts:
+            server.cuts -= 1
+            body = body[: server.cut_after]
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+@pytest.fixture
+def fasta():
+    rng = np.random.default_rng(0)
+    records = []
+    for name in ("chr1", "chr2"):
+        codes = rng.choice(5, 150_000, p=[0.24, 0.24, 0.24, 0.24, 0.04])
+        codes[1_000:6_000] = 4  # a long run of Ns, which gzip compresses far more than the rest
+        sequence = _BASE_LETTERS[codes].tobytes().decode()
+        records.append(f">{name} description\n" + "\n".join(sequence[i : i + 60] for i in range(0, len(sequence), 60)))
+    return ("\n".join(records) + "\n").encode()
+
+
+@pytest.fixture
+def server(fasta):
+    # Two gzip members, like bgzip writes
+    server = _FileServer(gzip.compress(fasta[:100_000]) + gzip.compress(fasta[100_000:]))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _assert_cached(output_path, cache_dir, fasta, tmp_path):
+    assert output_path.read_bytes() and gzip.decompress(output_path.read_bytes()) == fasta
+    plain = tmp_path / "plain.fa"
+    plain.write_bytes(fasta)
+    expected, expected_contigs, _ = stream_encode_genome(str(plain))
+    entry = open_cached_genome(cache_path_for(output_path, cache_dir))
+    np.testing.assert_array_equal(entry.encoded, expected)
+    assert entry.contigs.names == expected_contigs.names == ("chr1", "chr2")
+    np.testing.assert_array_equal(entry.contigs.gap_lengths, expected_contigs.gap_lengths)
+    # The entry is fresh for the downloaded file, so loading it doesn't encode the file again
+    open_cached_genome.cache_clear()
+    assert load_cached_genome(output_path, cache_dir).path == entry.path
+    return entry
+
+
+def test_download_encodes_into_the_genome_cache(tmp_path, server, fasta, capsys):
+    output_path, cache_dir = tmp_path / "genomes" / "genome.fa.gz", tmp_path / "cache"
+    md5 = hashlib.md5(server.payload).hexdigest()
+    stats = download_genome(server.url, output_path, len(server.payload), md5, cache_dir, block_size=4_096)
+
+    assert not output_path.with_name("genome.fa.gz.part").exists()
+    capsys.readouterr()
+    entry = _assert_cached(output_path, cache_dir, fasta, tmp_path)
+    assert stats.source_bytes == len(server.payload) and stats.bases == len(entry.encoded)
+    assert "Encoded" not in capsys.readouterr().out
+
+
+def test_download_resumes_after_interruption(tmp_path, server, fasta):
+    server.cuts, server.cut_after = 2, 30_000
+    output_path, cache_dir = tmp_path / "genome.fa.gz", tmp_path / "cache"
+    download_genome(server.url, output_path, len(server.payload), cache_dir=cache_dir, block_size=4_096)
+
+    # Each attempt resumes from what the previous ones got, give or take the block in flight when it broke
+    assert server.ranges[0] is None
+    first, second = (int(r.removeprefix("bytes=").removesuffix("-")) for r in server.ranges[1:])
+    assert 30_000 - 4_096 <= first <= 30_000 and first + 30_000 - 4_096 <= second <= first + 30_000
+    assert server.if_ranges == [None, server.etag, server.etag]
+    assert not output_path.with_name("genome.fa.gz.part.validator").exists()
+    _assert_cached(output_path, cache_dir, fasta, tmp_path)
+
+
+def test_download_resumes_a_partial_file(tmp_path, server, fasta):
+    output_path, cache_dir = tmp_path / "genome.fa.gz", tmp_path / "cache"
+    output_path.with_name("genome.fa.gz.part").write_bytes(server.payload[:12_345])
+    output_path.with_name("genome.fa.gz.part.validator").write_text(server.etag)
+    download_genome(server.url, output_path, len(server.payload), cache_dir=cache_dir)
+
+    assert server.ranges == ["bytes=12345-"]
+    _assert_cached(output_path, cache_dir, fasta, tmp_path)
+
+
+@pytest.mark.parametrize("validator", [None, '"v0"'])
+def test_download_starts_over_when_the_file_changed(tmp_path, server, fasta, validator):
+    output_path, cache_dir = tmp_path / "genome.fa.gz", tmp_path / "cache"
+    output_path.with_name("genome.fa.gz.part").write_bytes(b"stale bytes from another file")
+    if validator is not None:
+        output_path.with_name("genome.fa.gz.part.validator").write_text(validator)
+    download_genome(server.url, output_path, len(server.payload), cache_dir=cache_dir)
+
+    assert server.if_ranges == [validator]
+    assert output_path.read_bytes() == server.payload
+    _assert_cached(output_path, cache_dir, fasta, tmp_path)
+
+
+def test_download_checks_the_size_of_an_unsatisfiable_range(tmp_path, server):
+    output_path = tmp_path / "genome.fa.gz"
+    part_path, validator_path = tmp_path / "genome.fa.gz.part", tmp_path / "genome.fa.gz.part.validator"
+    part_path.write_bytes(server.payload)
+    validator_path.write_text(server.etag)
+    download_genome(server.url, output_path, cache_dir=None)
+    assert server.ranges == [f"bytes={len(server.payload)}-"]
+    assert output_path.read_bytes() == server.payload
+
+    # A partial file longer than the file isn't complete, it belongs to another file
+    part_path.write_bytes(server.payload + b"more")
+    validator_path.write_text(server.etag)
+    download_genome(server.url, output_path, cache_dir=None)
+    assert server.ranges[1:] == [f"bytes={len(server.payload) + 4}-", None]
+    assert output_path.read_bytes() == server.payload
+
+
+def test_download_starts_over_when_the_server_ignores_ranges(tmp_path, server, fasta):
+    server.supports_range = False
+    output_path, cache_dir = tmp_path / "genome.fa.gz", tmp_path / "cache"
+    output_path.with_name("genome.fa.gz.part").write_bytes(server.payload[:12_345])
+    output_path.with_name("genome.fa.gz.part.validator").write_text(server.etag)
+    download_genome(server.url, output_path, len(server.payload), cache_dir=cache_dir)
+
+    assert output_path.read_bytes() == server.payload
+    _assert_cached(output_path, cache_dir, fasta, tmp_path)
+
+
+def test_download_rejects_bad_checksum_and_gives_up_on_lasting_failures(tmp_path, server):
+    output_path = tmp_path / "genome.fa.gz"
+    with pytest.raises(ValueError, match="MD5"):
+        download_genome(server.url, output_path, len(server.payload), "0" * 32, cache_dir=None)
+    assert not output_path.exists() and not output_path.with_name("genome.fa.gz.part").exists()
+
+    server.cuts, server.cut_after = 3, 0
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        download_genome(server.url, output_path, len(server.payload), cache_dir=None, retries=2)
+    download_genome(server.url, output_path, len(server.payload), cache_dir=None)
+    assert output_path.read_bytes() == server.payload
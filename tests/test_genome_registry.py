@@ -0,0 +1,63 @@
+import pytest
+
+from genome_registry import FileIdentity, GenomeRegistry
+
+
+class Block:
+    def __init__(self, nbytes: int):
+        self.nbytes = nbytes
+        self.released = False
+
+    def release(self) -> None:
+        self.released = True
+
+
+def test_acquire_loads_once():
+    registry = GenomeRegistry()
+    loads = []
+
+    def load() -> Block:
+        loads.append(1)
+        return Block(10)
+
+    first, reused_first = registry.acquire("a", load)
+    second, reused_second = registry.acquire("a", load)
+
+    assert first is second
+    assert (reused_first, reused_second) == (False, True)
+    assert len(loads) == 1
+    assert registry.references("a") == 2
+    registry.release("a")
+    registry.release("a")
+    assert registry.references("a") == 0 and "a" in registry
+    with pytest.raises(ValueError):
+        registry.release("a")
+
+
+def test_evicts_unused_blocks_least_recently_used_first():
+    registry = GenomeRegistry(max_bytes=25)
+    blocks = {key: registry.acquire(key, lambda: Block(10))[0] for key in "abc"}
+    assert registry.nbytes == 30  # over budget, but every block is in use
+
+    registry.release("a")
+    assert blocks["a"].released and "a" not in registry
+    registry.release("c")
+    registry.release("b")
+    assert not blocks["b"].released and not blocks["c"].released
+
+    registry.acquire("c", lambda: Block(10))
+    registry.acquire("d", lambda: Block(10))
+    assert blocks["b"].released and "c" in registry and registry.nbytes == 20
+
+    registry.clear()
+    assert blocks["c"].released and registry.nbytes == 0
+
+
+def test_file_identity_changes_with_contents(tmp_path):
+    path = tmp_path / "genome.fa"
+    path.write_text(">a\nACGT\n")
+    identity = FileIdentity.of(path)
+
+    assert FileIdentity.of(tmp_path / "." / "genome.fa") == identity
+    path.write_text(">a\nACGTACGT\n")
+    assert FileIdentity.of(path) != identity
@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+
+from genome_comparison import ContigTable
+from genome_sketch import Sketch, _hash_kmer, _max_hash, load_sketch, read_sketch, sketch_path_for
+
+_BASE_LETTERS = np.frombuffer(b"ACGT", dtype=np.uint8)
+
+
+def _kmer_value(bases: np.ndarray) -> int:
+    value = 0
+    for base in bases.tolist():
+        value = value << 2 | base
+    return value
+
+
+def _brute_force_hashes(
+    encoded: np.ndarray, runs: list[tuple[int, int]], kmer_size: int, canonical: bool, scaled: int
+) -> np.ndarray:
+    hashes = set()
+    for begin, end in runs:
+        for start in range(begin, end - kmer_size + 1):
+            kmer = encoded[start : start + kmer_size]
+            value = _kmer_value(kmer)
+            if canonical:
+                value = min(value, _kmer_value(3 - kmer[::-1]))
+            hashed = int(_hash_kmer(np.uint64(value >> 64), np.uint64(value & (2**64 - 1))))
+            if hashed <= int(_max_hash(scaled)):
+                hashes.add(hashed)
+    return np.array(sorted(hashes), dtype=np.uint64)
+
+
+def _write_fasta(path, sequence: np.ndarray) -> str:
+    path.write_text(">genome\n" + _BASE_LETTERS[sequence].tobytes().decode() + "\n")
+    return str(path)
+
+
+@pytest.mark.parametrize("kmer_size", [7, 32, 40, 64])
+@pytest.mark.parametrize("canonical", [False, True])
+def test_build_matches_brute_force(kmer_size, canonical):
+    encoded = np.random.default_rng(0).integers(0, 4, 3_000).astype(np.int8)
+    # Records start at 0 and 1_700, and a gap ends at 900: no k-mer may span either
+    contigs = ContigTable(("a", "b"), np.array([0, 1_700]), np.array([900]), np.array([5]), np.array([0]))
+    sketch = Sketch.build(encoded, contigs, kmer_size, scaled=4, canonical=canonical, num_threads=2)
+
+    expected = _brute_force_hashes(encoded, [(0, 900), (900, 1_700), (1_700, 3_000)], kmer_size, canonical, 4)
+    np.testing.assert_array_equal(sketch.hashes, expected)
+    assert sketch.num_kmers == 3_000 - 3 * (kmer_size - 1)
+
+
+def test_canonical_sketch_is_strand_independent():
+    encoded = np.random.default_rng(1).integers(0, 4, 5_000).astype(np.int8)
+    contigs = ContigTable(("a",), np.array([0]))
+    forward = Sketch.build(encoded, contigs, 40, scaled=10, canonical=True)
+    reverse = Sketch.build((3 - encoded[::-1]).astype(np.int8), contigs, 40, scaled=10, canonical=True)
+    np.testing.assert_array_equal(forward.hashes, reverse.hashes)
+
+
+def test_compare_estimates_containment_and_jaccard():
+    rng = np.random.default_rng(2)
+    query = rng.integers(0, 4, 400_000).astype(np.int8)
+    # The target holds the first half of the query, then as many unrelated bases
+    target = np.concatenate([query[:200_000], rng.integers(0, 4, 200_000)]).astype(np.int8)
+    contigs = ContigTable(("a",), np.array([0]))
+    query_sketch = Sketch.build(query, contigs, 40, scaled=20)
+    target_sketch = Sketch.build(target, contigs, 40, scaled=20)
+
+    comparison = query_sketch.compare(target_sketch)
+    assert comparison.containment.low < 0.5 < comparison.containment.high
+    assert comparison.containment.high - comparison.containment.low < 0.03
+    assert comparison.jaccard.low < 1 / 3 < comparison.jaccard.high
+    assert query_sketch.compare(query_sketch).containment.estimate == 1.0
+    assert abs(query_sketch.distinct_kmers - len(query)) < 0.05 * len(query)
+
+
+def test_compare_downsamples_to_the_coarser_sketch():
+    encoded = np.random.default_rng(3).integers(0, 4, 50_000).astype(np.int8)
+    contigs = ContigTable(("a",), np.array([0]))
+    fine, coarse = Sketch.build(encoded, contigs, 40, scaled=5), Sketch.build(encoded, contigs, 40, scaled=50)
+
+    np.testing.assert_array_equal(fine.downsample(50).hashes, coarse.hashes)
+    assert fine.compare(coarse).shared_hashes == len(coarse.hashes)
+    with pytest.raises(ValueError, match="finer"):
+        coarse.downsample(5)
+    with pytest.raises(ValueError, match="Cannot compare"):
+        fine.compare(Sketch.build(encoded, contigs, 40, scaled=5, canonical=True))
+
+
+def test_load_sketch_saves_next_to_the_genome_cache(tmp_path):
+    rng = np.random.default_rng(4)
+    source = tmp_path / "genome.fa"
+    _write_fasta(source, rng.integers(0, 4, 20_000))
+    cache_dir = tmp_path / "cache"
+
+    sketch = load_sketch(source, cache_dir, 40, scaled=10)
+    path = sketch_path_for(source, cache_dir, 40, 10, False)
+    assert path.exists() and path.parent == cache_dir
+    np.testing.assert_array_equal(read_sketch(path)[0].hashes, sketch.hashes)
+    np.testing.assert_array_equal(load_sketch(source, None, 40, scaled=10).hashes, sketch.hashes)
+
+    # Rewriting the genome changes its content hash, so the saved sketch is rebuilt
+    _write_fasta(source, rng.integers(0, 4, 20_001))
+    rebuilt = load_sketch(source, cache_dir, 40, scaled=10)
+    assert rebuilt.num_kmers == 20_001 - 39
+    assert read_sketch(path)[0].num_kmers == 20_001 - 39
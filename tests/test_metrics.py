@@ -0,0 +1,45 @@
+import pytest
+
+from metrics import HISTOGRAM_BUCKETS, Metrics
+
+
+def test_render_counters_and_gauges():
+    metrics = Metrics()
+    metrics.inc("simulation_samples_total", 100)
+    metrics.inc("simulation_samples_total", 50)
+    metrics.set("simulation_stage_seconds", 1.5, stage="pack", genome='Pan "paniscus"')
+
+    text = metrics.render()
+    assert "# TYPE simulation_samples_total counter\nsimulation_samples_total 150\n" in text
+    assert 'simulation_stage_seconds{genome="Pan \\"paniscus\\"",stage="pack"} 1.5\n' in text
+    assert "simulation_batches_total" not in text
+    assert metrics.get("simulation_samples_total") == 150
+
+
+def test_render_histogram():
+    metrics = Metrics()
+    for seconds in (0.0005, 0.002, 100.0):
+        metrics.observe("simulation_compare_seconds", seconds, target="Close")
+
+    lines = metrics.render().splitlines()
+    assert 'simulation_compare_seconds_bucket{target="Close",le="0.001"} 1' in lines
+    assert 'simulation_compare_seconds_bucket{target="Close",le="0.004"} 2' in lines
+    assert f'simulation_compare_seconds_bucket{{target="Close",le="{HISTOGRAM_BUCKETS[-1]:g}"}} 2' in lines
+    assert 'simulation_compare_seconds_bucket{target="Close",le="+Inf"} 3' in lines
+    assert 'simulation_compare_seconds_count{target="Close"} 3' in lines
+    assert metrics.to_dict()['simulation_compare_seconds{target="Close"}']["count"] == 3
+
+
+def test_timer_and_undeclared_metrics():
+    metrics = Metrics()
+    with metrics.timer("simulation_callback_seconds"):
+        pass
+    with metrics.timer("simulation_stage_seconds", stage="pack", genome="Human"):
+        pass
+
+    assert metrics.to_dict()["simulation_callback_seconds"]["count"] == 1
+    assert metrics.get("simulation_stage_seconds", stage="pack", genome="Human") >= 0
+    with pytest.raises(ValueError):
+        metrics.inc("simulation_unknown_total")
+    with pytest.raises(ValueError):
+        metrics.set("simulation_samples_total", 1)
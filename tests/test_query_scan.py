@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+
+from genome_comparison import PackedGenome
+from query_scan import NO_HIT, QuerySet, hit_bitmap, merge_distances
+from tests import semi_global_edit_distances
+
+
+def _brute_force_distances(queries: QuerySet, target_genome: np.ndarray) -> np.ndarray:
+    windows = np.lib.stride_tricks.sliding_window_view(target_genome, queries.chunk_size)
+    distances = []
+    for q in range(len(queries)):
+        best = (windows != PackedGenome(queries.words[q], queries.chunk_size).unpack()).sum(axis=1).min()
+        distances.append(best if best <= queries.max_differences else NO_HIT)
+    return np.array(distances)
+
+
+@pytest.fixture
+def genomes():
+    rng = np.random.default_rng(0)
+    target_genome = rng.integers(0, 4, 20_000).astype(np.int8)
+    query_genome = target_genome.copy()
+    mutated = rng.random(len(query_genome)) < 0.08
+    query_genome[mutated] = rng.integers(0, 4, mutated.sum())
+    return query_genome, target_genome
+
+
+@pytest.mark.parametrize(("chunk_size", "max_differences"), [(40, 5), (40, 2), (20, 3), (33, 0)])
+def test_scan_matches_brute_force(genomes, chunk_size, max_differences):
+    query_genome, target_genome = genomes
+    queries, starts = QuerySet.sample(PackedGenome.from_encoded(query_genome), 200, chunk_size, max_differences, seed=1)
+    first_query = PackedGenome(queries.words[0], chunk_size).unpack()
+    np.testing.assert_array_equal(first_query, query_genome[starts[0] : starts[0] + chunk_size])
+
+    distances = queries.scan(PackedGenome.from_encoded(target_genome))
+    np.testing.assert_array_equal(distances, _brute_force_distances(queries, target_genome))
+
+
+def test_scan_threads_match_serial(genomes):
+    query_genome, target_genome = genomes
+    queries, _ = QuerySet.sample(PackedGenome.from_encoded(query_genome), 300, 40, 4, seed=2)
+    target = PackedGenome.from_encoded(target_genome)
+
+    np.testing.assert_array_equal(queries.scan(target, num_threads=4), queries.scan(target, num_threads=1))
+
+
+def test_scan_both_strands(genomes):
+    query_genome, target_genome = genomes
+    queries, _ = QuerySet.sample(PackedGenome.from_encoded(query_genome), 200, 40, 5, seed=4)
+    both_strands, _ = QuerySet.sample(PackedGenome.from_encoded(query_genome), 200, 40, 5, seed=4, both_strands=True)
+    forward = PackedGenome.from_encoded(target_genome)
+    reverse = forward.reverse_complement()
+
+    assert len(both_strands) == len(queries)
+    np.testing.assert_array_equal(both_strands.scan(reverse), queries.scan(forward))
+    np.testing.assert_array_equal(both_strands.scan(forward), queries.scan(forward))
+    assert (queries.scan(reverse) == NO_HIT).all()
+
+
+def _brute_force_edit_distances(queries: QuerySet, target_genome: np.ndarray) -> np.ndarray:
+    query_bases = np.array([PackedGenome(queries.words[q], queries.chunk_size).unpack() for q in range(len(queries))])
+    best = semi_global_edit_distances(query_bases, target_genome)
+    return np.where(best <= queries.max_differences, best, NO_HIT)
+
+
+@pytest.mark.parametrize(("chunk_size", "max_differences"), [(40, 5), (20, 2)])
+def test_scan_edit_distance_matches_brute_force(chunk_size, max_differences):
+    rng = np.random.default_rng(5)
+    target_genome = rng.integers(0, 4, 3_000).astype(np.int8)
+    query_genome = np.delete(target_genome, rng.choice(len(target_genome), 60, replace=False))
+    query_genome = np.insert(query_genome, rng.choice(len(query_genome), 60), rng.integers(0, 4, 60)).astype(np.int8)
+    queries, _ = QuerySet.sample(
+        PackedGenome.from_encoded(query_genome), 100, chunk_size, max_differences, seed=6, edit_distance=True
+    )
+    hamming, _ = QuerySet.sample(PackedGenome.from_encoded(query_genome), 100, chunk_size, max_differences, seed=6)
+
+    distances = queries.scan(PackedGenome.from_encoded(target_genome), num_threads=2)
+    np.testing.assert_array_equal(distances, _brute_force_edit_distances(queries, target_genome))
+    assert (distances != NO_HIT).sum() > (hamming.scan(PackedGenome.from_encoded(target_genome)) != NO_HIT).sum()
+
+
+def test_from_fasta_round_trip(tmp_path, genomes):
+    query_genome, _ = genomes
+    queries, _ = QuerySet.sample(PackedGenome.from_encoded(query_genome), 50, 40, 5, seed=3)
+    fasta_file = tmp_path / "queries.fa"
+    queries.write_fasta(fasta_file)
+    with fasta_file.open("a") as f:
+        f.write(">too_short\nACGT\n")
+
+    reloaded = QuerySet.from_fasta(str(fasta_file), 40, 5)
+    np.testing.assert_array_equal(reloaded.words, queries.words)
+    np.testing.assert_array_equal(reloaded.entries, queries.entries)
+
+
+def test_query_set_rejects_short_chunks():
+    with pytest.raises(ValueError):
+        QuerySet.build(np.zeros((1, 1), dtype=np.uint64), chunk_size=4, max_differences=4)
+
+
+def test_hit_bitmap():
+    distances = np.array([0, NO_HIT, 3, NO_HIT, NO_HIT, NO_HIT, NO_HIT, NO_HIT, 1])
+    np.testing.assert_array_equal(hit_bitmap(distances), [0b10100000, 0b10000000])
+
+
+def test_merge_distances_keeps_the_best_hit():
+    a = np.array([NO_HIT, 3, 2, NO_HIT], dtype=np.int8)
+    b = np.array([NO_HIT, 1, NO_HIT, 0], dtype=np.int8)
+    np.testing.assert_array_equal(merge_distances(a, b), [NO_HIT, 1, 2, 0])
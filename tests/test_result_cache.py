@@ -0,0 +1,86 @@
+import pickle
+
+import numpy as np
+
+from genome_cache import load_cached_genome, open_cached_genome
+from genome_comparison import PackedGenome, stream_encode_genome
+from result_cache import RESULTS_VERSION, UNKNOWN, ResultCache, genome_key
+
+
+def _chunk_words(num_chunks: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return np.stack([PackedGenome.from_encoded(rng.integers(0, 4, 40).astype(np.int8)).words for _ in range(num_chunks)])
+
+
+def test_lookup_returns_stored_results(tmp_path):
+    results = ResultCache(tmp_path / "results.sqlite")
+    chunk_words = _chunk_words(4)
+    results.store(b"target", chunk_words[:2], 40, 5, np.array([True, False]))
+
+    np.testing.assert_array_equal(results.lookup(b"target", chunk_words, 40, 5), [1, 0, UNKNOWN, UNKNOWN])
+    # Any other part of the key is a different result
+    np.testing.assert_array_equal(results.lookup(b"other", chunk_words[:2], 40, 5), [UNKNOWN, UNKNOWN])
+    np.testing.assert_array_equal(results.lookup(b"target", chunk_words[:2], 40, 4), [UNKNOWN, UNKNOWN])
+    np.testing.assert_array_equal(results.lookup(b"target", chunk_words[:2], 40, 5, True), [UNKNOWN, UNKNOWN])
+    np.testing.assert_array_equal(
+        results.lookup(b"target", chunk_words[:2], 40, 5, edit_distance=True), [UNKNOWN, UNKNOWN]
+    )
+
+
+def test_totals(tmp_path):
+    results = ResultCache(tmp_path / "results.sqlite")
+    assert results.lookup_totals(b"target", b"query", 40, 5) is None
+
+    results.store_totals(b"target", b"query", 40, 5, 12, 100)
+    assert results.lookup_totals(b"target", b"query", 40, 5) == (12, 100)
+    assert results.lookup_totals(b"target", b"query", 40, 5, edit_distance=True) is None
+
+
+def test_results_persist_and_pickle(tmp_path):
+    results = ResultCache(tmp_path / "results.sqlite")
+    chunk_words = _chunk_words(1)
+    results.store(b"target", chunk_words, 40, 5, np.array([True]))
+    results.close()
+
+    reopened = pickle.loads(pickle.dumps(ResultCache(tmp_path / "results.sqlite")))
+    np.testing.assert_array_equal(reopened.lookup(b"target", chunk_words, 40, 5), [1])
+
+
+def test_results_of_another_version_are_dropped(tmp_path):
+    results = ResultCache(tmp_path / "results.sqlite")
+    chunk_words = _chunk_words(1)
+    results.store(b"target", chunk_words, 40, 5, np.array([True]))
+    results._connection.execute(f"PRAGMA user_version = {RESULTS_VERSION - 1}")
+    results.close()
+
+    reopened = ResultCache(tmp_path / "results.sqlite")
+    np.testing.assert_array_equal(reopened.lookup(b"target", chunk_words, 40, 5), [UNKNOWN])
+
+
+def test_evict_least_recently_used(tmp_path):
+    results = ResultCache(tmp_path / "results.sqlite", max_bytes=2**40)
+    old, new = _chunk_words(5_000, seed=1), _chunk_words(5_000, seed=2)
+    results.store(b"target", old, 40, 5, np.zeros(len(old), dtype=np.bool_))
+    results.store(b"target", new, 40, 5, np.ones(len(new), dtype=np.bool_))
+
+    results.max_bytes = results.size() * 3 // 4
+    assert results.evict() > 0
+    assert results.size() <= results.max_bytes
+    assert (results.lookup(b"target", old, 40, 5) == UNKNOWN).any()
+    assert (results.lookup(b"target", new, 40, 5) == 1).all()
+
+
+def test_genome_key_is_content_addressed():
+    encoded = np.random.default_rng(0).integers(0, 4, 1_000).astype(np.int8)
+    assert genome_key(PackedGenome.from_encoded(encoded)) == genome_key(PackedGenome.from_encoded(encoded.copy()))
+    encoded[500] = (encoded[500] + 1) % 4
+    assert genome_key(PackedGenome.from_encoded(encoded)) != genome_key(PackedGenome.from_encoded(encoded[:-1]))
+
+
+def test_genome_key_is_the_same_for_cached_and_encoded_genomes(tmp_path):
+    fasta_file = tmp_path / "genome.fa"
+    fasta_file.write_text(">chr1\n" + "ACGTN" * 50 + "\n>chr2\n" + "TTGCA" * 20 + "\n")
+    cached = load_cached_genome(fasta_file, tmp_path / "cache")
+    encoded, _, _ = stream_encode_genome(fasta_file)
+    assert genome_key(cached) == genome_key(PackedGenome.from_encoded(encoded))
+    assert genome_key(open_cached_genome(cached.path)) == genome_key(cached)
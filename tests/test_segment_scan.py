@@ -0,0 +1,104 @@
+import re
+
+import numpy as np
+import pytest
+
+from genome_comparison import PackedGenome, stream_encode_genome
+from query_scan import QuerySet
+from segment_scan import chromosome_class, scan_segments, segments
+
+_BASE_LETTERS = np.frombuffer(b"ACGT", dtype=np.uint8)
+
+
+def _bases(rng: np.random.Generator, size: int) -> str:
+    return _BASE_LETTERS[rng.integers(0, 4, size)].tobytes().decode()
+
+
+@pytest.fixture
+def records():
+    rng = np.random.default_rng(0)
+    return {
+        "chr1": _bases(rng, 12_000) + "N" * 5_000 + _bases(rng, 8_000),
+        "chrX": _bases(rng, 10_000),
+        "chrY": "N" * 3_000,
+        "chrUn_1": "NNN" + _bases(rng, 1_000),
+    }
+
+
+@pytest.fixture
+def target(tmp_path, records):
+    path = tmp_path / "target.fa"
+    with path.open("w") as f:
+        for name, sequence in records.items():
+            f.write(f">{name} description\n")
+            f.writelines(sequence[i : i + 60] + "\n" for i in range(0, len(sequence), 60))
+    encoded, contigs, _ = stream_encode_genome(str(path))
+    return PackedGenome.from_encoded(encoded), contigs
+
+
+def _brute_force_hits(queries: QuerySet, sequence: str) -> int:
+    """Queries within `max_differences` of a window of one of the runs of bases in `sequence`."""
+    query_bases = np.array([PackedGenome(queries.words[q], queries.chunk_size).unpack() for q in range(len(queries))])
+    hit = np.zeros(len(queries), dtype=bool)
+    for run in re.split("N+", sequence):
+        if len(run) < queries.chunk_size:
+            continue
+        encoded = np.searchsorted(_BASE_LETTERS, np.frombuffer(run.encode(), dtype=np.uint8))
+        windows = np.lib.stride_tricks.sliding_window_view(encoded, queries.chunk_size)
+        for q in range(len(queries)):
+            hit[q] |= (windows != query_bases[q]).sum(axis=1).min() <= queries.max_differences
+    return int(hit.sum())
+
+
+def test_chromosome_class():
+    assert [chromosome_class(name) for name in ("chr7", "12", "chr2a", "chrX", "Y", "chrM", "chr1_random")] == [
+        "autosome",
+        "autosome",
+        "autosome",
+        "X",
+        "Y",
+        "other",
+        "other",
+    ]
+
+
+def test_segments_follow_record_coordinates(target):
+    genome, contigs = target
+    assert [(s.contig, s.index, s.start, s.end) for s in segments(contigs, len(genome), 10_000)] == [
+        (0, 0, 0, 10_000),
+        (0, 1, 10_000, 20_000),
+        (0, 2, 20_000, 25_000),
+        (1, 0, 0, 10_000),
+        (2, 0, 0, 3_000),
+        (3, 0, 0, 1_003),
+    ]
+
+
+def test_scan_segments_matches_brute_force(target, records):
+    genome, contigs = target
+    # Queries straddling the gap in chr1 exist in the encoded genome but not in the FASTA file, so they must not match
+    queries, _ = QuerySet.sample(genome, 60, 40, 3, seed=1)
+    rows = {(row["record"], row["segment"]): row for row in scan_segments(genome, contigs, queries, 10_000, 3)}
+
+    assert len(rows) == 6
+    for (name, _), row in rows.items():
+        sequence = records[name][row["start"] : row["end"]]
+        assert row["bases"] == len(sequence.replace("N", ""))
+        assert row["matching_queries"] == _brute_force_hits(queries, sequence)
+    assert rows["chr1", 0]["chromosome_class"] == "autosome"
+    assert rows["chr1", 1]["windows"] == (2_000 - 39) + (3_000 - 39)  # the runs on either side of the gap
+    assert rows["chrX", 0]["match_rate"] == rows["chrX", 0]["matching_queries"] / 60 > 0
+    assert rows["chrY", 0]["windows"] == 0 and rows["chrY", 0]["match_rate"] is None
+
+
+def test_scan_segments_skips_finished_segments(target):
+    genome, contigs = target
+    queries, _ = QuerySet.sample(genome, 20, 40, 3, seed=1)
+    rows = list(scan_segments(genome, contigs, queries, 10_000, skip={("chr1", 0), ("chrX", 0)}))
+
+    assert sorted((row["record"], row["segment"]) for row in rows) == [
+        ("chr1", 1),
+        ("chr1", 2),
+        ("chrUn_1", 0),
+        ("chrY", 0),
+    ]
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from genome_comparison import GenomeIndex, compare_chunk, find_matches, seed_size_for, stream_encode_genome
+from synthetic_genomes import PlantedMatches, generate_genomes, write_synthetic_fasta
+
+
+def test_generate_genomes_is_deterministic():
+    first = generate_genomes(10_000, 0.1, 20, seed=3, block_size=3_000)
+    second = generate_genomes(10_000, 0.1, 20, seed=3, block_size=3_000)
+
+    np.testing.assert_array_equal(first[0], second[0])
+    np.testing.assert_array_equal(first[1], second[1])
+    np.testing.assert_array_equal(first[2].query_starts, second[2].query_starts)
+    assert len(first[0]) == len(first[1]) == 10_000
+    assert len(first[2]) == 20
+    assert not np.array_equal(first[1], generate_genomes(10_000, 0.1, 20, seed=4, block_size=3_000)[1])
+
+
+def test_planted_matches_have_their_distance():
+    query, target, planted = generate_genomes(20_000, 1.0, 50, both_strands=True, block_size=6_000)
+
+    assert planted.reverse.any() and not planted.reverse.all()
+    for query_start, target_start, differences, reverse in zip(
+        planted.query_starts, planted.target_starts, planted.differences, planted.reverse
+    ):
+        chunk = query[query_start : query_start + 40]
+        source = target[target_start : target_start + 40]
+        assert ((3 - source[::-1] if reverse else source) != chunk).sum() == differences
+
+
+@pytest.mark.parametrize("engine", ["scan", "index"])
+def test_planted_matches_are_the_only_matches(engine):
+    query, target, planted = generate_genomes(20_000, 1.0, 30, both_strands=True, block_size=6_000)
+    index = GenomeIndex.build(target, seed_size_for(40, 5))
+
+    def compare(chunk: np.ndarray) -> bool:
+        if engine == "index":
+            return index.compare_chunk(chunk, 5, both_strands=True)
+        return compare_chunk(chunk, target, 5, both_strands=True)
+
+    assert all(compare(query[start : start + 40]) for start in planted.query_starts)
+    prefix = query[: planted.query_starts.max() + 40]
+    matching_chunks, _ = (
+        index.find_matches(prefix, 40, 5, both_strands=True)
+        if engine == "index"
+        else find_matches(prefix, target, 40, 5, both_strands=True)
+    )
+    # Only windows overlapping a planted chunk by nearly all of its bases can match
+    assert len(planted) <= matching_chunks <= 11 * len(planted)
+
+
+def test_write_synthetic_fasta(tmp_path):
+    planted = write_synthetic_fasta(tmp_path / "query.fa", tmp_path / "target.fa", 10_000, 0.5, 10, block_size=3_000)
+    query, target, expected = generate_genomes(10_000, 0.5, 10, block_size=3_000)
+
+    np.testing.assert_array_equal(stream_encode_genome(str(tmp_path / "query.fa"))[0], query)
+    np.testing.assert_array_equal(stream_encode_genome(str(tmp_path / "target.fa"))[0], target)
+    np.testing.assert_array_equal(planted.target_starts, expected.target_starts)
+
+    planted.save(tmp_path / "planted.npz")
+    reloaded = PlantedMatches.load(tmp_path / "planted.npz")
+    assert reloaded.chunk_size == 40
+    np.testing.assert_array_equal(reloaded.differences, planted.differences)
+
+
+def test_too_many_planted_chunks():
+    with pytest.raises(ValueError):
+        generate_genomes(1_000, 0.0, 30, block_size=600)